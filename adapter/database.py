@@ -1,8 +1,9 @@
 import mysql.connector.pooling
 from configuration import configuration as config
 
+pool_size = config['DATABASE'].getint('pool_size', 5)
 connection_pool = mysql.connector.pooling.MySQLConnectionPool(pool_name="trade_pool",
-                                                              pool_size=5,
+                                                              pool_size=pool_size,
                                                               pool_reset_session=True,
                                                               host=config['DATABASE']['host'],
                                                               port=config['DATABASE']['port'],
@@ -0,0 +1,9 @@
+USE trade;
+
+ALTER TABLE quote
+	MODIFY quote_timestamp TIMESTAMP(6) NOT NULL,
+	MODIFY symbol VARCHAR(20) NOT NULL,
+	ADD COLUMN seq BIGINT UNSIGNED NOT NULL AUTO_INCREMENT FIRST,
+	ADD PRIMARY KEY (symbol, quote_timestamp, seq),
+	ADD KEY quote_seq (seq),
+	ADD KEY quote_timestamp (quote_timestamp);
@@ -10,9 +10,10 @@ GRANT ALL ON trade.* to 'tradeuser'@'localhost';
 USE trade;
 
 CREATE TABLE quote (
+	seq BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
 	created_on TIMESTAMP,
-	quote_timestamp TIMESTAMP,
-	symbol VARCHAR(20),
+	quote_timestamp TIMESTAMP(6) NOT NULL,
+	symbol VARCHAR(20) NOT NULL,
 	bid_price FLOAT,
 	ask_price FLOAT,
 	last_price FLOAT,
@@ -25,5 +26,8 @@ CREATE TABLE quote (
 	trade_time INT,
 	quote_time INT,
 	last_id CHAR(10),
-	nav FLOAT
+	nav FLOAT,
+	PRIMARY KEY (symbol, quote_timestamp, seq),
+	KEY quote_seq (seq),
+	KEY quote_timestamp (quote_timestamp)
 );
@@ -1,15 +1,28 @@
-import sys
-from adapter.database import connection_pool
-from model import Entity
-from repository import DBRepository
+import argparse
+import logging
+import metrics
+import profiling
+from configuration import configuration as config
+from model.codec import get_reader
+from repository import create_repository
 
 
-def main():
-    with DBRepository(connection_pool) as repo:
-        for message in sys.stdin:
-            entity = Entity.from_json(message)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Persists the quotes read from stdin")
+    parser.add_argument('--format', choices=['json', 'binary'], default='json',
+                        help="input format, must match the amt_streamer.py output format")
+    return parser.parse_args()
+
+
+def main(args):
+    with create_repository() as repo:
+        for entity in get_reader(args.format):
             repo.add(entity)
 
 
 if __name__ == "__main__":
-    main()
+    logging.basicConfig(level=logging.WARNING)
+    if config.has_section('METRICS'):
+        metrics.start_reporting(config['METRICS'])
+    profiling.install(config['PROFILER'] if config.has_section('PROFILER') else None)
+    main(parse_args())
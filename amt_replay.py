@@ -0,0 +1,47 @@
+import argparse
+import asyncio
+import logging
+
+from amtclient.pipeline import create_output
+from amtclient.recorder import read_frames, replay
+from amtclient.service import get_service_client, ServiceType
+from amtclient.stages import create_output_stages, run_output_stages, flush_output_stages
+from model.codec import get_writer
+
+logger = logging.getLogger('replay')
+logger.setLevel(logging.INFO)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Replays the messages recorded by amt_streamer.py --record to stdout")
+    parser.add_argument('directory', help="directory with the recorded segment files")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="replay speed relative to the recording, 0 replays as fast "
+                             "as possible")
+    parser.add_argument('--format', choices=['json', 'binary'], default='json',
+                        help="output format, binary must be read by amt_persister.py "
+                             "with the same format")
+    return parser.parse_args()
+
+
+async def run(args):
+    credentials = {'userid': None, 'appid': None}
+    output = create_output_stages(create_output(get_writer(args.format)))
+    service_client = get_service_client(ServiceType.QUOTE, credentials, output)
+    stages = asyncio.create_task(run_output_stages(output))
+    try:
+        return await replay(read_frames(args.directory), service_client, args.speed)
+    finally:
+        stages.cancel()
+        flush_output_stages(output)
+
+
+def main(args):
+    replayed = asyncio.run(run(args))
+    logger.info("Replayed %d messages", replayed)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main(parse_args())
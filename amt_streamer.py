@@ -1,21 +1,107 @@
+import argparse
 import asyncio
+import json
 import logging
-from websockets.exceptions import ConnectionClosedError
+import metrics
+import profiling
 
-from amtclient import StreamerClient, ServiceType
+from amtclient import ServiceType, stream_forever
+from amtclient.pipeline import QueueOutput, PersistenceStage, OverflowPolicy, create_output
+from amtclient.recorder import FrameRecorder
+from amtclient.sharding import ShardedStreamer
+from amtclient.stages import create_output_stages, run_output_stages, flush_output_stages
+from configuration import configuration as config
+from model.codec import get_writer
 
 
-async def main():
-    while True:
-        try:
-            logging.debug("Connecting to streamer service")
-            service = StreamerClient(ServiceType.QUOTE)
-            await service.execute()
-        except ConnectionClosedError:
-            logging.warning("Connection closed error, reconnecting...")
-            await asyncio.sleep(5)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Streams Ameritrade quotes to stdout")
+    parser.add_argument('--format', choices=['json', 'binary'], default='json',
+                        help="output format, binary must be read by amt_persister.py "
+                             "with the same format")
+    parser.add_argument('--persist', action='store_true',
+                        help="persist the quotes to the database in this process instead of "
+                             "writing them to stdout")
+    parser.add_argument('--record', metavar='DIRECTORY',
+                        help="record every raw message received into segment files in the "
+                             "directory, to be replayed with amt_replay.py")
+    return parser.parse_args()
+
+
+def get_service_types():
+    names = [name.strip() for name in config['MT_CLIENT'].get('services', 'QUOTE').split(',')]
+    service_types = [ServiceType[name] for name in names if name]
+    return service_types[0] if len(service_types) == 1 else service_types
+
+
+def create_persistence_stage():
+    from repository import create_repository
+
+    pipeline_config = config['PIPELINE'] if config.has_section('PIPELINE') \
+        else config[config.default_section]
+    queue = asyncio.Queue(maxsize=pipeline_config.getint('queue_size', 10000))
+    overflow_policy = OverflowPolicy(pipeline_config.get('overflow_policy', 'drop_oldest'))
+    repository = create_repository()
+    stage = PersistenceStage(repository, queue, pipeline_config.getint('batch_size', 1000))
+    return create_output_stages(QueueOutput(queue, overflow_policy)), stage
+
+
+def run_sharded(args, shards):
+    if args.persist or args.record:
+        raise SystemExit("--persist and --record are not supported with more than one shard")
+    if config['QUOTE'].getint('conflation_window_ms', 0) > 0 or \
+            json.loads(config['QUOTE'].get('conflation_windows_ms', '{}')):
+        raise SystemExit("Conflation is not supported with more than one shard")
+    keys = config['QUOTE']['service_keys']
+    output = create_output_stages(create_output(get_writer(args.format)))
+    try:
+        ShardedStreamer(ServiceType.QUOTE, keys, shards, output).run()
+    finally:
+        flush_output_stages(output)
+
+
+async def main(args):
+    recorder = FrameRecorder(args.record) if args.record else None
+    try:
+        await run(args, recorder)
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+
+async def stream(output, recorder):
+    stages = asyncio.create_task(run_output_stages(output))
+    try:
+        await stream_forever(get_service_types(), output, recorder,
+                             control_socket=config['MT_CLIENT'].get('control_socket'))
+    finally:
+        stages.cancel()
+        flush_output_stages(output)
+
+
+async def run(args, recorder):
+    if not args.persist:
+        await stream(create_output_stages(create_output(get_writer(args.format))), recorder)
+        return
+
+    output, stage = create_persistence_stage()
+    persistence = asyncio.create_task(stage.run())
+    try:
+        await stream(output, recorder)
+    finally:
+        persistence.cancel()
+        await stage.drain()
+        stage.repository.close()
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.WARNING)
-    asyncio.run(main())
+    arguments = parse_args()
+    if config.has_section('METRICS'):
+        metrics.start_reporting(config['METRICS'])
+    profiling.install(config['PROFILER'] if config.has_section('PROFILER') else None)
+    shards = config['QUOTE'].getint('shards', 1)
+    if shards > 1:
+        run_sharded(arguments, shards)
+    else:
+        asyncio.run(main(arguments))
@@ -1,2 +1,2 @@
-from .streamer_client import StreamerClient
+from .streamer_client import StreamerClient, stream_forever
 from .service import ServiceType
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import os
+import stat
+from .service import ServiceCommand, ServiceClientException
+
+
+class ControlServer:
+
+    def __init__(self, streamer, path):
+        self.streamer = streamer
+        self.path = path
+        self._server = None
+
+    def _remove_socket(self):
+        try:
+            if stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    async def start(self):
+        self._remove_socket()
+        self._server = await asyncio.start_unix_server(self._handle, self.path)
+        logging.info("Listening for subscription changes on %s", self.path)
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            self._remove_socket()
+
+    async def execute(self, line):
+        parts = line.split(None, 2)
+        if len(parts) < 2:
+            return 'ERROR usage: SUBS|ADD|UNSUBS|VIEW <service> <values> or KEYS <service>'
+        name, service = parts[0].upper(), parts[1].upper()
+        argument = parts[2] if len(parts) > 2 else ''
+        if name == 'KEYS':
+            client = self.streamer.service_clients().get(service)
+            if client is None:
+                return f'ERROR service {service} is not being streamed'
+            return f'OK {client.keys}'
+        try:
+            command = ServiceCommand[name]
+        except KeyError:
+            return f'ERROR unknown command {parts[0]}'
+        try:
+            sent = await self.streamer.control(command, service, argument)
+        except ServiceClientException as e:
+            return f'ERROR {e}'
+        logging.warning("%s %s %s %s", command.value, service, argument,
+                        'sent' if sent else 'applied on the next connection')
+        return 'OK sent' if sent else 'OK applied on the next connection'
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode().strip()
+                if command:
+                    writer.write((await self.execute(command)).encode() + b'\n')
+                    await writer.drain()
+        finally:
+            writer.close()
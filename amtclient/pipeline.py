@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import threading
+import time
+import configuration
+import metrics
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from model import EntityBatch
+
+
+QUEUE_DEPTH = metrics.registry.gauge('quote_streamer_persistence_queue_depth',
+                                     'Messages waiting in the persistence queue')
+DROPPED = metrics.registry.counter('quote_streamer_persistence_dropped_total',
+                                   'Messages dropped because the persistence queue was full')
+PERSISTED = metrics.registry.counter('quote_streamer_persisted_total', 'Entities persisted')
+OUTPUT_PENDING = metrics.registry.gauge('quote_streamer_output_pending',
+                                        'Entities waiting to be written to the output')
+OUTPUT_DROPPED = metrics.registry.counter('quote_streamer_output_dropped_total',
+                                          'Entities dropped because the output could not keep up')
+OUTPUT_FLUSHES = metrics.registry.counter('quote_streamer_output_flushes_total',
+                                          'Flushes of the output stream')
+PERSIST_FAILED = metrics.registry.counter('quote_streamer_persist_failed_total',
+                                          'Entities that could not be persisted')
+
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    FAIL = "fail"
+
+
+class PipelineException(Exception):
+    pass
+
+
+class QueueOutput:
+
+    def __init__(self, queue, overflow_policy=OverflowPolicy.DROP_OLDEST):
+        self.queue = queue
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+        QUEUE_DEPTH.set_function(queue.qsize)
+
+    def write(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._overflow(item)
+
+    def write_batch(self, batch):
+        self.write(batch)
+
+    def _overflow(self, item):
+        if self.overflow_policy == OverflowPolicy.FAIL:
+            raise PipelineException(f'Persistence queue is full ({self.queue.maxsize} entities)')
+        if self.overflow_policy == OverflowPolicy.DROP_OLDEST:
+            self.queue.get_nowait()
+            self.queue.put_nowait(item)
+        self.dropped += 1
+        DROPPED.inc()
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            logging.warning("Persistence queue is full, %d messages dropped so far", self.dropped)
+
+
+class PersistenceStage:
+
+    def __init__(self, repository, queue, batch_size=1000, executor=None):
+        self.repository = repository
+        self.queue = queue
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(max_workers=1) if executor is None else executor
+        self.persisted = 0
+        self.failed = 0
+
+    def _next_batch(self, first):
+        batch = [first]
+        while len(batch) < self.batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self._next_batch(await self.queue.get())
+            await self._persist(loop, batch)
+
+    def _write(self, items):
+        entities = []
+        for item in items:
+            if isinstance(item, EntityBatch):
+                if entities:
+                    self.repository.add_many(entities)
+                    entities = []
+                self.repository.add_batch(item)
+            else:
+                entities.append(item)
+        if entities:
+            self.repository.add_many(entities)
+
+    async def _persist(self, loop, items):
+        count = sum(len(item) if isinstance(item, EntityBatch) else 1 for item in items)
+        try:
+            await loop.run_in_executor(self.executor, self._write, items)
+            self.persisted += count
+            PERSISTED.inc(count)
+        except Exception:
+            self.failed += count
+            PERSIST_FAILED.inc(count)
+            logging.exception("Error persisting %d entities", count)
+
+    async def drain(self):
+        loop = asyncio.get_running_loop()
+        while not self.queue.empty():
+            await self._persist(loop, self._next_batch(self.queue.get_nowait()))
+
+
+def create_output(writer):
+    if not configuration.configuration.has_section('OUTPUT'):
+        return writer
+    config = configuration.configuration['OUTPUT']
+    if not config.getboolean('buffered', False):
+        return writer
+    return BufferedOutput(writer, config.getint('max_pending', 100000),
+                          config.getint('flush_records', 1000),
+                          config.getfloat('flush_interval', 0.05),
+                          OverflowPolicy(config.get('overflow_policy', 'drop_oldest')))
+
+
+class BufferedOutput:
+
+    def __init__(self, writer, max_pending=100000, flush_records=1000, flush_interval=0.05,
+                 overflow_policy=OverflowPolicy.DROP_OLDEST):
+        self.writer = writer
+        self.max_pending = max_pending
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+        self.written = 0
+        self.error = None
+        writer.auto_flush = False
+        self._items = deque()
+        self._pending = 0
+        self._busy = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='output-writer', daemon=True)
+        self._thread.start()
+        OUTPUT_PENDING.set_function(lambda: self._pending)
+
+    def write(self, entity):
+        self._put(entity, 1)
+
+    def write_batch(self, batch):
+        self._put(batch, len(batch))
+
+    def _put(self, item, size):
+        with self._condition:
+            if self.error is not None:
+                raise PipelineException('Output writer failed') from self.error
+            if self._pending + size > self.max_pending and not self._overflow(size):
+                return
+            self._items.append((item, size))
+            self._pending += size
+            if not self._busy:
+                self._condition.notify()
+
+    def _overflow(self, size):
+        if self.overflow_policy == OverflowPolicy.FAIL:
+            raise PipelineException(f'Output buffer is full ({self.max_pending} entities)')
+        if self.overflow_policy == OverflowPolicy.DROP_NEWEST:
+            self._dropped(size)
+            return False
+        while self._items and self._pending + size > self.max_pending:
+            _, dropped = self._items.popleft()
+            self._pending -= dropped
+            self._dropped(dropped)
+        return True
+
+    def _dropped(self, size):
+        self.dropped += size
+        OUTPUT_DROPPED.inc(size)
+        if self.dropped == size or self.dropped % 1000 < size:
+            logging.warning("Output cannot keep up, %d entities dropped so far", self.dropped)
+
+    def _take(self):
+        with self._condition:
+            self._busy = False
+            self._condition.notify_all()
+            while not self._items and not self._closed:
+                self._condition.wait()
+            items, self._items = self._items, deque()
+            self._pending = 0
+            self._busy = True
+            return items
+
+    def _write(self, items):
+        write_batch = getattr(self.writer, 'write_batch', None)
+        for item, size in items:
+            if not isinstance(item, EntityBatch):
+                self.writer.write(item)
+            elif write_batch is not None:
+                write_batch(item)
+            else:
+                for entity in item:
+                    self.writer.write(entity)
+            self.written += size
+
+    def _run(self):
+        unflushed = 0
+        flushed_at = time.monotonic()
+        try:
+            while True:
+                items = self._take()
+                if not items:
+                    self.writer.flush()
+                    return
+                self._write(items)
+                unflushed += sum(size for _, size in items)
+                with self._condition:
+                    idle = not self._items
+                if idle or unflushed >= self.flush_records or \
+                        time.monotonic() - flushed_at >= self.flush_interval:
+                    self.writer.flush()
+                    OUTPUT_FLUSHES.inc()
+                    unflushed = 0
+                    flushed_at = time.monotonic()
+        except Exception as e:
+            logging.exception("Output writer failed")
+            with self._condition:
+                self.error = e
+                self._busy = False
+                self._condition.notify_all()
+
+    def flush(self):
+        with self._condition:
+            while (self._items or self._busy) and self.error is None:
+                self._condition.wait()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
@@ -0,0 +1,95 @@
+import asyncio
+import mmap
+import os
+import struct
+import time
+
+RECORD_HEADER = struct.Struct('<dI')
+SEGMENT_PREFIX = 'frames-'
+SEGMENT_SUFFIX = '.rec'
+
+
+class RecorderException(Exception):
+    pass
+
+
+class FrameRecorder:
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.frames = 0
+        self._segment = None
+        self._segment_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._sequence = max((segment_sequence(path) for path in segment_files(directory)),
+                             default=0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+    def _open_segment(self):
+        self.close()
+        self._sequence += 1
+        path = os.path.join(self.directory, f'{SEGMENT_PREFIX}{self._sequence:06d}{SEGMENT_SUFFIX}')
+        self._segment = open(path, 'ab')
+        self._segment_bytes = self._segment.tell()
+
+    def record(self, message, received_at=None):
+        data = message.encode() if isinstance(message, str) else message
+        if self._segment is None or self._segment_bytes >= self.segment_size:
+            self._open_segment()
+        received_at = time.time() if received_at is None else received_at
+        self._segment.write(RECORD_HEADER.pack(received_at, len(data)) + data)
+        self._segment.flush()
+        self._segment_bytes += RECORD_HEADER.size + len(data)
+        self.frames += 1
+
+    def close(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+
+def segment_files(directory):
+    names = sorted(name for name in os.listdir(directory)
+                   if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+    return [os.path.join(directory, name) for name in names]
+
+
+def segment_sequence(path):
+    return int(os.path.basename(path)[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+
+def read_frames(directory):
+    for path in segment_files(directory):
+        if os.path.getsize(path) == 0:
+            continue
+        with open(path, 'rb') as segment, \
+                mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = 0
+            while offset + RECORD_HEADER.size <= len(data):
+                received_at, length = RECORD_HEADER.unpack_from(data, offset)
+                start = offset + RECORD_HEADER.size
+                if start + length > len(data):
+                    break
+                yield received_at, data[start:start + length].decode()
+                offset = start + length
+
+
+async def replay(frames, service_client, speed=1.0, clock=time.monotonic, sleep=asyncio.sleep):
+    replayed = 0
+    first_received_at = started_at = None
+    for received_at, message in frames:
+        if speed:
+            if first_received_at is None:
+                first_received_at, started_at = received_at, clock()
+            delay = (received_at - first_received_at) / speed - (clock() - started_at)
+            if delay > 0:
+                await sleep(delay)
+        service_client.handle_message(message)
+        replayed += 1
+    return replayed
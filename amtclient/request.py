@@ -1,19 +1,74 @@
 import requests
+import threading
 import time
 import datetime
 import json
+import os
 import configuration
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 class RequestException(Exception):
     pass
 
 
+class TimeoutHTTPAdapter(HTTPAdapter):
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _http_config(option, default):
+    try:
+        return float(configuration.configuration['MT_CLIENT'].get(option, default))
+    except KeyError:
+        return default
+
+
+def _retry(retries):
+    options = {'total': retries, 'backoff_factor': 0.2, 'raise_on_status': False,
+               'status_forcelist': (429, 500, 502, 503, 504)}
+    methods = frozenset(['GET'])
+    try:
+        return Retry(allowed_methods=methods, **options)
+    except TypeError:
+        return Retry(method_whitelist=methods, **options)
+
+
+def create_session():
+    adapter = TimeoutHTTPAdapter(timeout=_http_config('http_timeout', 10.0),
+                                 max_retries=_retry(int(_http_config('http_retries', 3))),
+                                 pool_maxsize=int(_http_config('http_pool_size', 4)))
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
 class Request:
 
     def __init__(self, token_retriever=None, sender=None):
         self.token_retriever = token_retriever
-        self.sender = requests if sender is None else sender
+        self.sender = get_session() if sender is None else sender
 
     def execute(self, method, url, data, content_type, params={}, requires_auth=True):
         headers = self._headers(content_type, requires_auth)
@@ -79,10 +134,15 @@ class TokenRetriever:
         data = self._request_access_token(refresh)
         data['expires_in'] = time.time() + data['expires_in']
         data['refresh_token_expires_in'] = time.time() + data['refresh_token_expires_in']
-        with open(self.token_data_file, 'w+') as token_file:
-            json.dump(data, token_file)
+        self._save_access_token(data)
         return data
 
+    def _save_access_token(self, data):
+        path = f'{self.token_data_file}.{os.getpid()}.tmp'
+        with open(path, 'w') as token_file:
+            json.dump(data, token_file)
+        os.replace(path, self.token_data_file)
+
     def _set_state(self, data):
         self.access_token = data['access_token']
         self.refresh_token = data['refresh_token']
@@ -106,7 +166,9 @@ class TokenRetriever:
         return request.execute("post", self.token_service_url, data, 'form', requires_auth=False)
 
     def _refresh_data(self):
-        data = self._get_access_token_from_provider(refresh=True)
+        data = self._get_access_token_from_file()
+        if data is None or data['expires_in'] <= self.access_token_expires_in:
+            data = self._get_access_token_from_provider(refresh=True)
         self._set_state(data)
 
     def _is_auth_token_expired(self):
@@ -127,11 +189,25 @@ class TokenRetriever:
 
 
 class UserPrincipalsRetriever:
+    TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+
     def __init__(self):
         cfg = configuration.configuration
         self.user_principals_service_url = cfg['MT_CLIENT']['user_principals_service_url']
         self.token_retriever = TokenRetriever()
         self.data = self._get_data()
+        self._credentials = None
+
+    def refresh(self):
+        self.data = self._get_data()
+        self._credentials = None
+
+    def is_expired(self):
+        expiration = self.data['streamerInfo'].get('tokenExpirationTime')
+        if expiration is None:
+            return False
+        return datetime.datetime.strptime(expiration, self.TIMESTAMP_FORMAT).timestamp() \
+            <= time.time()
 
     def _get_data(self):
         request = Request(self.token_retriever)
@@ -140,9 +216,14 @@ class UserPrincipalsRetriever:
                                params={"fields": "streamerSubscriptionKeys,streamerConnectionInfo"})
 
     def get_credentials(self):
+        if self._credentials is None:
+            self._credentials = self._build_credentials()
+        return self._credentials
+
+    def _build_credentials(self):
         data = self.data
         token_timestamp = data['streamerInfo']['tokenTimestamp']
-        token_timestamp = datetime.datetime.strptime(token_timestamp, "%Y-%m-%dT%H:%M:%S%z")
+        token_timestamp = datetime.datetime.strptime(token_timestamp, self.TIMESTAMP_FORMAT)
         token_timestamp_ms = int(token_timestamp.timestamp()) * 1000
         credentials = {
             'userid': data['accounts'][0]['accountId'],
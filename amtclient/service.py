@@ -1,9 +1,13 @@
 import json
 import abc
+import time
 from datetime import datetime
 from enum import Enum
 import configuration
-from model import Model, Entity
+import json_backend
+import metrics
+from model import Model, Entity, EntityBatch
+from model.codec import JsonLinesWriter
 
 
 class ServiceType(Enum):
@@ -12,10 +16,22 @@ class ServiceType(Enum):
 
 class ServiceCommand(Enum):
     SUBS = "SUBS"
+    ADD = "ADD"
+    UNSUBS = "UNSUBS"
+    VIEW = "VIEW"
 
 
 service_client_registry = {}
 
+DECODE_SECONDS = metrics.registry.histogram(
+    'quote_streamer_decode_seconds', 'Time to parse a message and build its entities')
+OUTPUT_SECONDS = metrics.registry.histogram(
+    'quote_streamer_output_seconds', 'Time to write the entities of a message to the output')
+QUOTE_AGE_SECONDS = metrics.registry.histogram(
+    'quote_streamer_quote_age_seconds', 'Delay between the Ameritrade timestamp of a data block '
+                                        'and its decoding')
+ENTITIES = metrics.registry.counter('quote_streamer_entities_total', 'Entities decoded')
+
 
 class ServiceClientException(Exception):
     pass
@@ -26,33 +42,59 @@ def register_client(service_client):
     return service_client
 
 
-def get_service_client(service_type, credentials):
+def get_service_client(service_type, credentials, output=None, keys=None):
     try:
         service = service_client_registry[service_type]
-        return service(credentials)
+        return service(credentials, output, keys)
     except KeyError:
         raise ServiceClientException(f'Service type {service_type} not supported')
 
 
 class ServiceClient(abc.ABC):
 
-    def __init__(self, credentials):
+    def __init__(self, credentials, output=None, keys=None):
         self.credentials = credentials
+        self.output = JsonLinesWriter() if output is None else output
+        self.keys = keys
+        self.fields = None
 
-    def get_request(self):
-        request = {
-            "requests": [
-                {
-                    "service": self.request_service(),
-                    "requestid": "2",
-                    "command": self.request_command(),
-                    "account": self.credentials['userid'],
-                    "source": self.credentials['appid'],
-                    "parameters": self.request_parameters()
-                }
-            ]
+    def build_request(self, request_id="2"):
+        return {
+            "service": self.request_service(),
+            "requestid": request_id,
+            "command": self.request_command(),
+            "account": self.credentials['userid'],
+            "source": self.credentials['appid'],
+            "parameters": self.request_parameters()
         }
-        return json.dumps(request)
+
+    def get_request(self):
+        return json.dumps({"requests": [self.build_request()]})
+
+    def build_command(self, command, argument, request_id):
+        values = [value.strip() for value in argument.split(',') if value.strip()]
+        if not values:
+            raise ServiceClientException(f'{command.value} needs a comma separated list')
+        current = [key for key in self.keys.split(',') if key]
+        if command is ServiceCommand.SUBS:
+            self.keys = ','.join(values)
+            parameters = self.request_parameters()
+        elif command is ServiceCommand.ADD:
+            self.keys = ','.join(current + [key for key in values if key not in current])
+            parameters = dict(self.request_parameters(), keys=','.join(values))
+        elif command is ServiceCommand.UNSUBS:
+            self.keys = ','.join(key for key in current if key not in values)
+            parameters = {"keys": ','.join(values)}
+        elif command is ServiceCommand.VIEW and self.fields is not None:
+            self.fields = ','.join(values)
+            parameters = {"fields": self.fields}
+        else:
+            raise ServiceClientException(f'{self.request_service()} does not support '
+                                         f'{command.value}')
+        request = self.build_request(request_id)
+        request['command'] = command.value
+        request['parameters'] = parameters
+        return request
 
     @staticmethod
     @abc.abstractmethod
@@ -72,26 +114,44 @@ class ServiceClient(abc.ABC):
         raise NotImplementedError
 
     def handle_message(self, message):
-        result = json.loads(f"{message}")
+        started = time.perf_counter()
+        result = json_backend.loads(message)
+        return self.handle_blocks(result.get('data', ()), started)
+
+    def handle_blocks(self, blocks, started=None):
+        if started is None:
+            started = time.perf_counter()
         entities = []
-        if 'data' in result:
-            data = result['data']
-            timestamp = data[0]['timestamp']
-            content = data[0]['content']
-            entities = [self._to_entity(element, timestamp) for element in content]
-            for entity in entities:
-                self._handle_entity(entity)
+        for block in blocks:
+            entities.extend(self._to_entities(block))
+        decoded = time.perf_counter()
+        DECODE_SECONDS.observe(decoded - started)
+        if entities:
+            ENTITIES.inc(len(entities))
+            self._handle_entities(entities)
+            OUTPUT_SECONDS.observe(time.perf_counter() - decoded)
         return entities
 
-    def _to_entity(self, element, timestamp):
+    def _to_entities(self, block):
+        timestamp = block['timestamp']
+        QUOTE_AGE_SECONDS.observe(max(0.0, time.time() - timestamp / 1000))
+        formated_timestamp = str(datetime.fromtimestamp(float(timestamp / 1000)))
+        return [self._to_entity(element, timestamp, formated_timestamp)
+                for element in block['content']]
+
+    def _to_entity(self, element, timestamp, formated_timestamp):
         element['timestamp'] = timestamp
-        element['formated_timestamp'] = str(datetime.fromtimestamp(float(timestamp / 1000)))
+        element['formated_timestamp'] = formated_timestamp
         return self._create_entity(element)
 
     @abc.abstractmethod
     def _create_entity(self, element):
         raise NotImplementedError
 
+    def _handle_entities(self, entities):
+        for entity in entities:
+            self._handle_entity(entity)
+
     @abc.abstractmethod
     def _handle_entity(self, entity):
         raise NotImplementedError
@@ -100,11 +160,13 @@ class ServiceClient(abc.ABC):
 @register_client
 class QuoteServiceClient(ServiceClient):
 
-    def __init__(self, credentials):
-        super().__init__(credentials)
+    def __init__(self, credentials, output=None, keys=None):
+        super().__init__(credentials, output, keys)
         config = configuration.configuration[Model.QUOTE.name]
-        self.keys = config['service_keys']
+        if self.keys is None:
+            self.keys = config['service_keys']
         self.mappings = json.loads(config['service_field_mappings'])
+        self.fields = ",".join(self.mappings)
 
     @staticmethod
     def type():
@@ -119,11 +181,66 @@ class QuoteServiceClient(ServiceClient):
     def request_parameters(self):
         return {
             "keys": self.keys,
-            "fields": ",".join(self.mappings)
+            "fields": self.fields
         }
 
     def _create_entity(self, element):
         return Entity(Model.QUOTE, element, self.mappings)
 
+    def _handle_entities(self, entities):
+        write_batch = getattr(self.output, 'write_batch', None)
+        if write_batch is None:
+            super()._handle_entities(entities)
+        else:
+            write_batch(EntityBatch.from_entities(Model.QUOTE, entities))
+
     def _handle_entity(self, entity):
-        print(entity.to_json(), flush=True)
+        self.output.write(entity)
+
+
+class ServiceDispatcher:
+
+    def __init__(self, service_clients):
+        self.service_clients = {client.request_service(): client for client in service_clients}
+        self.blocks = dict.fromkeys(self.service_clients, 0)
+        self.entities = dict.fromkeys(self.service_clients, 0)
+        self.unknown_blocks = 0
+        self._counters = {
+            service: (metrics.registry.counter(f'quote_streamer_{service.lower()}_blocks_total',
+                                               f'{service} data blocks received'),
+                      metrics.registry.counter(f'quote_streamer_{service.lower()}_entities_total',
+                                               f'{service} entities decoded'))
+            for service in self.service_clients}
+
+    def get_request(self):
+        requests = [client.build_request(str(request_id))
+                    for request_id, client in enumerate(self.service_clients.values(), start=2)]
+        return json.dumps({"requests": requests})
+
+    def handle_message(self, message):
+        started = time.perf_counter()
+        result = json_backend.loads(message)
+        blocks_by_service = {}
+        for block in result.get('data', ()):
+            blocks_by_service.setdefault(block.get('service'), []).append(block)
+        entities = []
+        for service, blocks in blocks_by_service.items():
+            client = self.service_clients.get(service)
+            if client is None:
+                self.unknown_blocks += len(blocks)
+                continue
+            service_entities = client.handle_blocks(blocks, started)
+            self.blocks[service] += len(blocks)
+            self.entities[service] += len(service_entities)
+            blocks_counter, entities_counter = self._counters[service]
+            blocks_counter.inc(len(blocks))
+            entities_counter.inc(len(service_entities))
+            entities.extend(service_entities)
+        return entities
+
+
+def get_service_dispatcher(service_types, credentials, output=None, keys=None):
+    keys = {} if keys is None else keys
+    return ServiceDispatcher([get_service_client(service_type, credentials, output,
+                                                 keys.get(service_type))
+                              for service_type in service_types])
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from model.codec import BinaryWriter, BinaryReader
+from .streamer_client import stream_forever
+
+logger = logging.getLogger('sharding')
+logger.setLevel(logging.INFO)
+
+
+class ShardException(Exception):
+    pass
+
+
+def shard_keys(keys, shards):
+    keys = [key.strip() for key in keys.split(',') if key.strip()]
+    groups = [keys[shard::shards] for shard in range(min(shards, len(keys)))]
+    return [",".join(group) for group in groups]
+
+
+class _ConnectionStream:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._pending = memoryview(b'')
+
+    def write(self, data):
+        self.connection.send_bytes(data)
+
+    def flush(self):
+        pass
+
+    def readinto(self, view):
+        if not self._pending:
+            try:
+                self._pending = memoryview(self.connection.recv_bytes())
+            except EOFError:
+                return 0
+        size = min(len(view), len(self._pending))
+        view[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def _run_shard(service_type, keys, connection, log_level):
+    logging.basicConfig(level=log_level)
+    output = BinaryWriter(_ConnectionStream(connection))
+    asyncio.run(stream_forever(service_type, output, keys=keys))
+
+
+class ShardStats:
+
+    def __init__(self, keys):
+        self.keys = len(keys.split(','))
+        self.entities = 0
+        self._last_entities = 0
+        self._last_time = time.monotonic()
+
+    def rate(self):
+        now = time.monotonic()
+        rate = (self.entities - self._last_entities) / max(now - self._last_time, 1e-9)
+        self._last_entities, self._last_time = self.entities, now
+        return rate
+
+
+class ShardedStreamer:
+
+    def __init__(self, service_type, keys, shards, output, stats_interval=60, max_restarts=10,
+                 check_interval=1.0):
+        self.service_type = service_type
+        self.keys = shard_keys(keys, shards)
+        self.output = output
+        self.stats_interval = stats_interval
+        self.max_restarts = max_restarts
+        self.check_interval = check_interval
+        self.stats = [ShardStats(shard) for shard in self.keys]
+        self.restarts = [0] * len(self.keys)
+        self._output_lock = threading.Lock()
+        self._log_level = logging.WARNING
+
+    def _merge(self, shard, connection):
+        stats = self.stats[shard]
+        try:
+            for entity in BinaryReader(_ConnectionStream(connection)):
+                with self._output_lock:
+                    self.output.write(entity)
+                stats.entities += 1
+        except Exception:
+            logger.exception("Error reading the output of shard %d", shard)
+
+    def _log_stats(self):
+        for shard, stats in enumerate(self.stats):
+            logger.info("Shard %d: %d keys, %d entities, %.1f entities/s, %d restarts", shard,
+                        stats.keys, stats.entities, stats.rate(), self.restarts[shard])
+
+    def _start(self, shard):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_run_shard, name=f'shard-{shard}',
+                                          args=(self.service_type, self.keys[shard], sender,
+                                                self._log_level),
+                                          daemon=True)
+        process.start()
+        sender.close()
+        reader = threading.Thread(target=self._merge, args=(shard, receiver),
+                                  name=f'shard-{shard}-reader', daemon=True)
+        reader.start()
+        return process, reader
+
+    def _check(self, shards):
+        for shard, (process, reader) in enumerate(shards):
+            if process is None or process.is_alive():
+                continue
+            reader.join()
+            if process.exitcode == 0:
+                shards[shard] = (None, reader)
+                continue
+            self.restarts[shard] += 1
+            if self.restarts[shard] > self.max_restarts:
+                raise ShardException(f'Shard {shard} exited with code {process.exitcode} after '
+                                     f'{self.max_restarts} restarts')
+            logger.error("Shard %d exited with code %s, restarting it", shard, process.exitcode)
+            shards[shard] = self._start(shard)
+
+    def run(self):
+        self._log_level = logging.getLogger().level
+        shards = [self._start(shard) for shard in range(len(self.keys))]
+        next_stats = time.monotonic() + self.stats_interval
+        try:
+            while any(process is not None for process, _ in shards):
+                deadline = time.monotonic() + self.check_interval
+                for process, _ in shards:
+                    if process is not None:
+                        process.join(max(0.0, deadline - time.monotonic()))
+                self._check(shards)
+                if time.monotonic() >= next_stats:
+                    next_stats = time.monotonic() + self.stats_interval
+                    self._log_stats()
+            self._log_stats()
+        finally:
+            for process, _ in shards:
+                if process is not None:
+                    process.terminate()
@@ -0,0 +1,245 @@
+import asyncio
+import heapq
+import json
+import logging
+import time
+import configuration
+import metrics
+from model import Model, EntityBatch, LatestStateStore
+from model.entity import Entity, MISSING, schemas
+
+SUPPRESSED = metrics.registry.counter('quote_streamer_dedup_suppressed_total',
+                                      'Quotes dropped because their significant fields did not '
+                                      'change')
+
+
+class StageException(Exception):
+    pass
+
+
+class OutputStage:
+
+    def __init__(self, output):
+        self.output = output
+
+    def process(self, entity):
+        return entity
+
+    def write(self, entity):
+        entity = self.process(entity)
+        if entity is not None:
+            self.output.write(entity)
+
+    def write_batch(self, batch):
+        entities = [entity for entity in map(self.process, batch) if entity is not None]
+        self._forward(batch.model, entities)
+
+    def _forward(self, model, entities):
+        if not entities:
+            return
+        write_batch = getattr(self.output, 'write_batch', None)
+        if write_batch is None:
+            for entity in entities:
+                self.output.write(entity)
+        else:
+            write_batch(EntityBatch.from_entities(model, entities))
+
+    def flush(self):
+        flush = getattr(self.output, 'flush', None)
+        if flush is not None:
+            flush()
+
+    async def run(self):
+        pass
+
+
+class LatestStateStage(OutputStage):
+
+    def __init__(self, output, store, emit_full=True):
+        super().__init__(output)
+        self.store = store
+        self.emit_full = emit_full
+
+    def process(self, entity):
+        merged = self.store.update(entity)
+        return merged if self.emit_full else entity
+
+
+class RepositoryStage(OutputStage):
+
+    def __init__(self, output, repository):
+        super().__init__(output)
+        self.repository = repository
+
+    def process(self, entity):
+        self.repository.add(entity)
+        return entity
+
+    def flush(self):
+        self.repository.flush()
+        super().flush()
+
+
+class DedupStage(OutputStage):
+
+    def __init__(self, output, model, fields, known_fields=None):
+        super().__init__(output)
+        schema = schemas[model]
+        self.fields = tuple(fields)
+        if known_fields is not None:
+            unknown = [field for field in self.fields if field not in known_fields]
+            if unknown:
+                raise StageException(f'Unknown {model.name} fields to dedup: {", ".join(unknown)}')
+        self.slots = tuple(schema.slot(field) for field in self.fields)
+        self.suppressed = 0
+        self.suppressed_by_key = {}
+        self._last = {}
+
+    def process(self, entity):
+        key = entity.symbol()
+        if key is None:
+            return entity
+        values = entity.values
+        last = self._last.get(key)
+        if last is None:
+            self._last[key] = [values[slot] if slot < len(values) else MISSING
+                               for slot in self.slots]
+            return entity
+        changed = False
+        for index, slot in enumerate(self.slots):
+            if slot < len(values):
+                value = values[slot]
+                if value is not MISSING and value != last[index]:
+                    last[index] = value
+                    changed = True
+        if changed:
+            return entity
+        self.suppressed += 1
+        SUPPRESSED.inc()
+        self.suppressed_by_key[key] = self.suppressed_by_key.get(key, 0) + 1
+        return None
+
+
+class ConflationStage(OutputStage):
+
+    def __init__(self, output, window, windows=None, clock=time.monotonic):
+        super().__init__(output)
+        self.window = window
+        self.windows = {} if windows is None else windows
+        self.clock = clock
+        self.received = 0
+        self.emitted = 0
+        self.conflated = 0
+        self.conflated_by_key = {}
+        self._pending = {}
+        self._deadlines = []
+
+    def _conflate(self, entity, now, due):
+        self.received += 1
+        key = entity.symbol()
+        window = self.windows.get(key, self.window)
+        if key is None or window <= 0:
+            due.append(entity)
+            return
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = (entity.model, list(entity.values))
+            heapq.heappush(self._deadlines, (now + window, key))
+            return
+        state = pending[1]
+        values = entity.values
+        if len(state) < len(values):
+            state.extend([MISSING] * (len(values) - len(state)))
+        for slot, value in enumerate(values):
+            if value is not MISSING:
+                state[slot] = value
+        self.conflated += 1
+        self.conflated_by_key[key] = self.conflated_by_key.get(key, 0) + 1
+
+    def _collect_due(self, now, due):
+        deadlines = self._deadlines
+        while deadlines and deadlines[0][0] <= now:
+            model, values = self._pending.pop(heapq.heappop(deadlines)[1])
+            due.append(Entity.from_slots(model, values))
+
+    def _emit(self, due):
+        self.emitted += len(due)
+        for entity in due:
+            self.output.write(entity)
+
+    def write(self, entity):
+        now = self.clock()
+        due = []
+        self._collect_due(now, due)
+        self._conflate(entity, now, due)
+        self._emit(due)
+
+    def write_batch(self, batch):
+        now = self.clock()
+        due = []
+        self._collect_due(now, due)
+        for entity in batch:
+            self._conflate(entity, now, due)
+        self.emitted += len(due)
+        self._forward(batch.model, due)
+
+    def flush_due(self):
+        due = []
+        self._collect_due(self.clock(), due)
+        self._emit(due)
+
+    def flush(self):
+        due = [Entity.from_slots(model, values) for model, values in self._pending.values()]
+        self._pending = {}
+        self._deadlines = []
+        self._emit(due)
+        super().flush()
+
+    async def run(self):
+        windows = [window for window in (self.window, *self.windows.values()) if window > 0]
+        if not windows:
+            return
+        interval = min(windows)
+        while True:
+            await asyncio.sleep(interval)
+            self.flush_due()
+            logging.debug("Conflation: received=%d, emitted=%d, conflated=%d", self.received,
+                          self.emitted, self.conflated)
+
+
+def create_output_stages(output):
+    config = configuration.configuration[Model.QUOTE.name]
+    dedup_fields = [field.strip() for field in config.get('dedup_fields', '').split(',')
+                    if field.strip()]
+    if dedup_fields:
+        mappings = json.loads(config.get('service_field_mappings', '{}'))
+        output = DedupStage(output, Model.QUOTE, dedup_fields, known_fields=mappings.values())
+    if config.getboolean('emit_full_quotes', False):
+        output = LatestStateStage(output, LatestStateStore(Model.QUOTE))
+    window = config.getint('conflation_window_ms', 0)
+    windows = json.loads(config.get('conflation_windows_ms', '{}'))
+    if window > 0 or windows:
+        output = ConflationStage(output, window / 1000,
+                                 {key: value / 1000 for key, value in windows.items()})
+    ticks = configuration.configuration['TICKS'] \
+        if configuration.configuration.has_section('TICKS') else {}
+    if ticks.get('directory'):
+        from repository import TickStore
+        output = RepositoryStage(output, TickStore(ticks['directory'],
+                                                   ticks.getint('capacity', 100000),
+                                                   json.loads(ticks.get('capacities', '{}'))))
+    return output
+
+
+async def run_output_stages(output):
+    runs = []
+    while isinstance(output, OutputStage):
+        runs.append(output.run())
+        output = output.output
+    await asyncio.gather(*runs)
+
+
+def flush_output_stages(output):
+    flush = getattr(output, 'flush', None)
+    if flush is not None:
+        flush()
@@ -1,15 +1,108 @@
-import websockets
+import asyncio
+import itertools
+import logging
+import random
+import time
+import websockets.client
 import urllib.parse
 import json
-from .request import UserPrincipalsRetriever
-from .service import get_service_client
+import metrics
+from websockets.exceptions import ConnectionClosed, InvalidHandshake
+from .request import UserPrincipalsRetriever, RequestException
+from .control import ControlServer
+from .service import ServiceType, ServiceClientException, get_service_client, \
+    get_service_dispatcher
+
+
+class LoginException(Exception):
+    pass
+
+
+MESSAGES = metrics.registry.counter('quote_streamer_messages_total', 'Websocket messages received')
+MESSAGE_BYTES = metrics.registry.counter('quote_streamer_message_bytes_total',
+                                         'Size of the websocket messages received')
+HANDLE_SECONDS = metrics.registry.histogram('quote_streamer_handle_seconds',
+                                            'Time to record, decode and output a message')
+CONNECTIONS = metrics.registry.counter('quote_streamer_connections_total',
+                                       'Successful logins to the streamer service')
+DISCONNECTIONS = metrics.registry.counter('quote_streamer_disconnections_total',
+                                          'Connections lost or failed')
+DISCONNECTED_SECONDS = metrics.registry.counter('quote_streamer_disconnected_seconds_total',
+                                                'Time spent reconnecting to the streamer service')
+CONNECTED = metrics.registry.gauge('quote_streamer_connected',
+                                   '1 while logged in to the streamer service')
+
+
+class Backoff:
+
+    def __init__(self, first_delay=0.0, base_delay=0.5, max_delay=30.0, min_uptime=30.0):
+        self.first_delay = first_delay
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_uptime = min_uptime
+        self.attempts = 0
+
+    def reset(self):
+        self.attempts = 0
+
+    def next_delay(self):
+        self.attempts += 1
+        if self.attempts == 1:
+            return self.first_delay
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.attempts - 2))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+class ConnectionStats:
+
+    def __init__(self):
+        self.connections = 0
+        self.disconnections = 0
+        self.disconnected_time = 0.0
+        self.last_uptime = 0.0
+        self._disconnected_at = None
+        self._connected_at = None
+
+    def connected(self):
+        self.connections += 1
+        CONNECTIONS.inc()
+        CONNECTED.set(1)
+        self._connected_at = time.monotonic()
+        if self._disconnected_at is None:
+            return None
+        outage = time.monotonic() - self._disconnected_at
+        self.disconnected_time += outage
+        DISCONNECTED_SECONDS.inc(outage)
+        self._disconnected_at = None
+        return outage
+
+    def disconnected(self):
+        CONNECTED.set(0)
+        if self._connected_at is None:
+            self.last_uptime = 0.0
+        else:
+            self.last_uptime = time.monotonic() - self._connected_at
+            self._connected_at = None
+        if self._disconnected_at is None:
+            self.disconnections += 1
+            DISCONNECTIONS.inc()
+            self._disconnected_at = time.monotonic()
 
 
 class StreamerClient:
 
-    def __init__(self, service_type):
+    def __init__(self, service_type, output=None, recorder=None, keys=None):
         self.user_principals_retriever = UserPrincipalsRetriever()
         self.service_type = service_type
+        self.output = output
+        self.recorder = recorder
+        self.keys = keys
+        self.connection_stats = ConnectionStats()
+        self._principals_rejected = False
+        self._service_client = None
+        self._websocket = None
+        self._request_ids = itertools.count(100)
+        self._send_lock = asyncio.Lock()
 
     def _get_streamer_url(self):
         return "wss://" + self.user_principals_retriever.get_streamer_socket_url() + "/ws"
@@ -40,18 +133,118 @@ class StreamerClient:
     async def _login(self, websocket):
         login_request = self._get_login_request()
         await websocket.send(login_request)
-        await websocket.recv()
+        response = json.loads(await websocket.recv())
+        for element in response.get('response', ()):
+            content = element.get('content', {})
+            if element.get('command') == 'LOGIN' and content.get('code', 0) != 0:
+                self._principals_rejected = True
+                raise LoginException(f'Login rejected, code={content["code"]}, '
+                                     f'message: {content.get("msg")}')
+
+    def _refresh_principals_if_needed(self):
+        if self._principals_rejected or self.user_principals_retriever.is_expired():
+            logging.info("Refreshing user principals")
+            self.user_principals_retriever.refresh()
+            self._principals_rejected = False
+
+    def _create_service_client(self):
+        if isinstance(self.service_type, ServiceType):
+            return get_service_client(self.service_type, self._get_credentials(), self.output,
+                                      self.keys)
+        return get_service_dispatcher(self.service_type, self._get_credentials(), self.output,
+                                      self.keys)
+
+    def _get_service_client(self):
+        if self._service_client is None:
+            self._service_client = self._create_service_client()
+        else:
+            credentials = self._get_credentials()
+            for client in self.service_clients().values():
+                client.credentials = credentials
+        return self._service_client
+
+    def service_clients(self):
+        if self._service_client is None:
+            return {}
+        clients = getattr(self._service_client, 'service_clients', None)
+        if clients is None:
+            return {self._service_client.request_service(): self._service_client}
+        return clients
+
+    async def control(self, command, service, argument):
+        if self._service_client is None:
+            raise ServiceClientException('Not connected to the streamer service yet')
+        client = self.service_clients().get(service)
+        if client is None:
+            raise ServiceClientException(f'Service {service} is not being streamed')
+        async with self._send_lock:
+            request = client.build_command(command, argument, str(next(self._request_ids)))
+            websocket = self._websocket
+            if websocket is None:
+                return False
+            try:
+                await websocket.send(json.dumps({"requests": [request]}))
+            except ConnectionClosed:
+                return False
+        return True
 
     @classmethod
-    async def _execute(cls, websocket, service_client):
-        request = service_client.get_request()
-        await websocket.send(request)
+    async def _execute(cls, websocket, service_client, recorder=None):
+        await websocket.send(service_client.get_request())
+        await cls._receive(websocket, service_client, recorder)
+
+    @staticmethod
+    async def _receive(websocket, service_client, recorder=None):
         async for message in websocket:
+            started = time.perf_counter()
+            MESSAGES.inc()
+            MESSAGE_BYTES.inc(len(message))
+            if recorder is not None:
+                recorder.record(message)
             service_client.handle_message(message)
+            HANDLE_SECONDS.observe(time.perf_counter() - started)
 
     async def execute(self):
+        self._refresh_principals_if_needed()
         uri = self._get_streamer_url()
         async with websockets.client.connect(uri) as websocket:
             await self._login(websocket)
-            service_client = get_service_client(self.service_type, self._get_credentials())
-            await self._execute(websocket, service_client)
+            outage = self.connection_stats.connected()
+            if outage is not None:
+                logging.warning("Reconnected after %.3f s disconnected (%.3f s in total)",
+                                outage, self.connection_stats.disconnected_time)
+            service_client = self._get_service_client()
+            async with self._send_lock:
+                await websocket.send(service_client.get_request())
+                self._websocket = websocket
+            try:
+                await self._receive(websocket, service_client, self.recorder)
+            finally:
+                self._websocket = None
+
+
+RECONNECT_ERRORS = (ConnectionClosed, InvalidHandshake, OSError, LoginException, RequestException)
+
+
+async def stream_forever(service_type, output=None, recorder=None, keys=None, backoff=None,
+                         control_socket=None):
+    backoff = Backoff() if backoff is None else backoff
+    service = StreamerClient(service_type, output, recorder, keys)
+    control = await ControlServer(service, control_socket).start() if control_socket else None
+    try:
+        while True:
+            try:
+                logging.debug("Connecting to streamer service")
+                await service.execute()
+                logging.warning("Connection closed by the streamer service")
+            except RECONNECT_ERRORS as e:
+                logging.warning("Connection error: %s", e)
+            service.connection_stats.disconnected()
+            if service.connection_stats.last_uptime >= backoff.min_uptime:
+                backoff.reset()
+            delay = backoff.next_delay()
+            logging.warning("Reconnecting in %.2f s", delay)
+            await asyncio.sleep(delay)
+    finally:
+        if control is not None:
+            await control.close()
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import pytest
+from unittest.mock import Mock
+from amtclient.control import ControlServer
+from amtclient.service import ServiceCommand, ServiceClientException
+
+
+class FakeStreamer:
+
+    def __init__(self, sent=True):
+        self.sent = sent
+        self.commands = []
+        self.client = Mock(keys='SPY,QQQ')
+
+    def service_clients(self):
+        return {'QUOTE': self.client}
+
+    async def control(self, command, service, argument):
+        if service != 'QUOTE':
+            raise ServiceClientException(f'Service {service} is not being streamed')
+        self.commands.append((command, service, argument))
+        return self.sent
+
+
+def test_execute_parses_the_commands():
+    streamer = FakeStreamer()
+    server = ControlServer(streamer, None)
+    assert asyncio.run(server.execute('add quote TSLA,NVDA')) == 'OK sent'
+    assert asyncio.run(server.execute('UNSUBS QUOTE GGAL')) == 'OK sent'
+    assert streamer.commands == [(ServiceCommand.ADD, 'QUOTE', 'TSLA,NVDA'),
+                                 (ServiceCommand.UNSUBS, 'QUOTE', 'GGAL')]
+
+
+def test_execute_reports_changes_kept_for_the_next_connection():
+    server = ControlServer(FakeStreamer(sent=False), None)
+    assert asyncio.run(server.execute('SUBS QUOTE SPY')) == 'OK applied on the next connection'
+
+
+def test_execute_reports_errors():
+    server = ControlServer(FakeStreamer(), None)
+    assert asyncio.run(server.execute('REMOVE QUOTE SPY')) == 'ERROR unknown command REMOVE'
+    assert asyncio.run(server.execute('ADD')).startswith('ERROR usage')
+    assert asyncio.run(server.execute('ADD OPTION SPY')) == \
+        'ERROR Service OPTION is not being streamed'
+    assert asyncio.run(server.execute('KEYS OPTION')) == 'ERROR service OPTION is not being streamed'
+
+
+def test_keys_lists_the_subscribed_keys():
+    server = ControlServer(FakeStreamer(), None)
+    assert asyncio.run(server.execute('KEYS QUOTE')) == 'OK SPY,QQQ'
+
+
+def test_commands_are_answered_over_the_socket(tmp_path):
+    path = str(tmp_path / 'control.sock')
+    streamer = FakeStreamer()
+
+    async def run():
+        server = await ControlServer(streamer, path).start()
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(b'ADD QUOTE TSLA\n\nKEYS QUOTE\n')
+        responses = [await reader.readline(), await reader.readline()]
+        writer.close()
+        await server.close()
+        return responses
+
+    assert asyncio.run(run()) == [b'OK sent\n', b'OK SPY,QQQ\n']
+    assert streamer.commands == [(ServiceCommand.ADD, 'QUOTE', 'TSLA')]
+
+
+def test_start_does_not_remove_a_file_that_is_not_a_socket(tmp_path):
+    path = tmp_path / 'control.sock'
+    path.write_text('keep me')
+    with pytest.raises(OSError):
+        asyncio.run(ControlServer(FakeStreamer(), str(path)).start())
+    assert path.read_text() == 'keep me'
+
+
+def test_close_removes_the_socket_file(tmp_path):
+    path = str(tmp_path / 'control.sock')
+
+    async def run():
+        server = await ControlServer(FakeStreamer(), path).start()
+        assert os.path.exists(path)
+        await server.close()
+
+    asyncio.run(run())
+    assert not os.path.exists(path)
@@ -0,0 +1,75 @@
+import json
+import logging
+import urllib.request
+from unittest.mock import Mock
+import metrics
+from amtclient.service import get_service_client, ServiceType
+
+
+def test_histogram_counts_observations_in_cumulative_buckets():
+    histogram = metrics.Histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 2.0):
+        histogram.observe(value)
+    assert list(histogram.samples()) == [('latency_seconds_bucket{le="0.1"}', 1),
+                                         ('latency_seconds_bucket{le="1.0"}', 3),
+                                         ('latency_seconds_bucket{le="+Inf"}', 4),
+                                         ('latency_seconds_sum', 3.25),
+                                         ('latency_seconds_count', 4)]
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(0.99) == float('inf')
+
+
+def test_registry_returns_the_same_metric_for_the_same_name():
+    registry = metrics.Registry()
+    assert registry.counter('messages_total', 'Messages') is \
+        registry.counter('messages_total', 'Messages')
+
+
+def test_registry_renders_prometheus_text():
+    registry = metrics.Registry()
+    registry.counter('messages_total', 'Messages received').inc(3)
+    registry.gauge('queue_depth', 'Queue depth').set_function(lambda: 7)
+    assert registry.render() == ('# HELP messages_total Messages received\n'
+                                 '# TYPE messages_total counter\n'
+                                 'messages_total 3\n'
+                                 '# HELP queue_depth Queue depth\n'
+                                 '# TYPE queue_depth gauge\n'
+                                 'queue_depth 7\n')
+
+
+def test_http_server_exposes_the_registry():
+    registry = metrics.Registry()
+    registry.counter('messages_total', 'Messages received').inc()
+    server = metrics.start_http_server(0, metrics_registry=registry)
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        with urllib.request.urlopen(url) as response:
+            assert 'messages_total 1' in response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_log_reporter_logs_values_and_counter_rates(caplog):
+    registry = metrics.Registry()
+    counter = registry.counter('messages_total', 'Messages received')
+    now = [0.0]
+    reporter = metrics.LogReporter(10, registry, clock=lambda: now[0])
+    with caplog.at_level(logging.INFO, logger='metrics'):
+        reporter.report()
+        counter.inc(50)
+        now[0] = 10.0
+        reporter.report()
+    line = json.loads(caplog.records[-1].getMessage())
+    assert line == {'metrics': {'messages_total': 50}, 'rates': {'messages_total': 5.0}}
+
+
+def test_service_client_records_decode_metrics():
+    decoded = metrics.registry.histogram('quote_streamer_decode_seconds', '').count
+    entities = metrics.registry.counter('quote_streamer_entities_total', '').value
+    client = get_service_client(ServiceType.QUOTE, {'userid': None, 'appid': None},
+                                Mock(spec=['write']))
+    client.handle_message('{"data": [{"service": "QUOTE", "timestamp": 1590879805110, '
+                          '"command": "SUBS", "content": [{"key": "MSFT", "1": 183.7}]}]}')
+    assert metrics.registry.histogram('quote_streamer_decode_seconds', '').count == decoded + 1
+    assert metrics.registry.counter('quote_streamer_entities_total', '').value == entities + 1
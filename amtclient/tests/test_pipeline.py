@@ -0,0 +1,216 @@
+import asyncio
+import configparser
+import threading
+import pytest
+from unittest.mock import Mock
+import configuration
+from model import Model, Entity, EntityBatch
+from model.codec import JsonLinesWriter
+from amtclient.pipeline import QueueOutput, PersistenceStage, OverflowPolicy, PipelineException, \
+    BufferedOutput, create_output
+
+
+def test_queue_output_enqueues_entities():
+    queue = asyncio.Queue(maxsize=2)
+    output = QueueOutput(queue)
+    output.write('e1')
+    assert queue.get_nowait() == 'e1'
+
+
+def test_queue_output_drops_oldest_when_full():
+    queue = asyncio.Queue(maxsize=2)
+    output = QueueOutput(queue, OverflowPolicy.DROP_OLDEST)
+    for entity in ['e1', 'e2', 'e3']:
+        output.write(entity)
+    assert output.dropped == 1
+    assert [queue.get_nowait(), queue.get_nowait()] == ['e2', 'e3']
+
+
+def test_queue_output_drops_newest_when_full():
+    queue = asyncio.Queue(maxsize=2)
+    output = QueueOutput(queue, OverflowPolicy.DROP_NEWEST)
+    for entity in ['e1', 'e2', 'e3']:
+        output.write(entity)
+    assert output.dropped == 1
+    assert [queue.get_nowait(), queue.get_nowait()] == ['e1', 'e2']
+
+
+def test_queue_output_throws_exception_when_full_and_policy_is_fail():
+    queue = asyncio.Queue(maxsize=1)
+    output = QueueOutput(queue, OverflowPolicy.FAIL)
+    output.write('e1')
+    with pytest.raises(PipelineException):
+        output.write('e2')
+
+
+def test_persistence_stage_writes_queued_entities_in_batches():
+    repository = Mock()
+
+    async def run():
+        queue = asyncio.Queue()
+        for entity in ['e1', 'e2', 'e3']:
+            queue.put_nowait(entity)
+        stage = PersistenceStage(repository, queue, batch_size=2)
+        task = asyncio.create_task(stage.run())
+        while stage.persisted < 3:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        return stage
+
+    stage = asyncio.run(run())
+    assert [call[0][0] for call in repository.add_many.call_args_list] == [['e1', 'e2'], ['e3']]
+    assert stage.failed == 0
+
+
+def test_persistence_stage_keeps_running_after_repository_error():
+    repository = Mock()
+    repository.add_many.side_effect = [Exception(), None]
+
+    async def run():
+        queue = asyncio.Queue()
+        stage = PersistenceStage(repository, queue, batch_size=1)
+        task = asyncio.create_task(stage.run())
+        queue.put_nowait('e1')
+        queue.put_nowait('e2')
+        while stage.persisted + stage.failed < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        return stage
+
+    stage = asyncio.run(run())
+    assert stage.failed == 1
+    assert stage.persisted == 1
+
+
+def test_persistence_stage_drain_writes_pending_entities():
+    repository = Mock()
+
+    async def run():
+        queue = asyncio.Queue()
+        queue.put_nowait('e1')
+        stage = PersistenceStage(repository, queue)
+        await stage.drain()
+        return stage
+
+    assert asyncio.run(run()).persisted == 1
+    repository.add_many.assert_called_once_with(['e1'])
+
+
+def test_persistence_stage_writes_entity_batches_directly():
+    repository = Mock()
+    batch = EntityBatch.from_entities(Model.QUOTE, [Entity(Model.QUOTE, {"key": "QQQ"}),
+                                                    Entity(Model.QUOTE, {"key": "SPY"})])
+
+    async def run():
+        queue = asyncio.Queue()
+        output = QueueOutput(queue)
+        output.write('e1')
+        output.write_batch(batch)
+        stage = PersistenceStage(repository, queue)
+        await stage.drain()
+        return stage
+
+    assert asyncio.run(run()).persisted == 3
+    repository.add_many.assert_called_once_with(['e1'])
+    repository.add_batch.assert_called_once_with(batch)
+
+
+class SlowWriter:
+
+    def __init__(self):
+        self.auto_flush = True
+        self.written = []
+        self.flushes = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def write(self, entity):
+        self.started.set()
+        self.release.wait()
+        self.written.append(entity['key'])
+
+    def flush(self):
+        self.flushes += 1
+
+
+def buffered_quote(i):
+    return Entity(Model.QUOTE, {"key": f"Q{i}"})
+
+
+def test_buffered_output_writes_from_its_own_thread_and_flushes_when_idle():
+    writer = SlowWriter()
+    output = BufferedOutput(writer)
+    assert not writer.auto_flush
+    for i in range(5):
+        output.write(buffered_quote(i))
+    output.flush()
+    assert writer.written == [f"Q{i}" for i in range(5)]
+    assert writer.flushes >= 1
+    output.close()
+
+
+def test_buffered_output_writes_batches_entity_by_entity_for_plain_writers():
+    writer = SlowWriter()
+    output = BufferedOutput(writer)
+    output.write_batch(EntityBatch.from_entities(Model.QUOTE, [buffered_quote(0),
+                                                               buffered_quote(1)]))
+    output.close()
+    assert writer.written == ["Q0", "Q1"]
+
+
+def test_buffered_output_drops_the_oldest_entities_when_full():
+    writer = SlowWriter()
+    writer.release.clear()
+    output = BufferedOutput(writer, max_pending=3)
+    output.write(buffered_quote(0))
+    writer.started.wait()
+    for i in range(1, 7):
+        output.write(buffered_quote(i))
+    writer.release.set()
+    output.close()
+    assert writer.written == ["Q0", "Q4", "Q5", "Q6"]
+    assert output.dropped == 3
+
+
+def test_buffered_output_drops_the_newest_entities_when_full():
+    writer = SlowWriter()
+    writer.release.clear()
+    output = BufferedOutput(writer, max_pending=3, overflow_policy=OverflowPolicy.DROP_NEWEST)
+    output.write(buffered_quote(0))
+    writer.started.wait()
+    for i in range(1, 7):
+        output.write(buffered_quote(i))
+    writer.release.set()
+    output.close()
+    assert writer.written == ["Q0", "Q1", "Q2", "Q3"]
+    assert output.dropped == 3
+
+
+def test_buffered_output_can_fail_when_full():
+    writer = SlowWriter()
+    writer.release.clear()
+    output = BufferedOutput(writer, max_pending=1, overflow_policy=OverflowPolicy.FAIL)
+    output.write(buffered_quote(0))
+    writer.started.wait()
+    output.write(buffered_quote(1))
+    with pytest.raises(PipelineException):
+        output.write(buffered_quote(2))
+    writer.release.set()
+    output.close()
+
+
+def test_json_writer_only_flushes_when_asked_if_auto_flush_is_disabled():
+    stream = Mock()
+    writer = JsonLinesWriter(stream)
+    writer.auto_flush = False
+    writer.write(buffered_quote(0))
+    stream.flush.assert_not_called()
+    writer.flush()
+    stream.flush.assert_called_once()
+
+
+def test_create_output_returns_the_writer_without_an_output_section(monkeypatch):
+    monkeypatch.setattr(configuration, 'configuration', configparser.ConfigParser())
+    writer = JsonLinesWriter()
+    assert create_output(writer) is writer
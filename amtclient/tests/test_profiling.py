@@ -0,0 +1,80 @@
+import configparser
+import os
+import signal
+import threading
+import profiling
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+def test_sampling_profiler_collects_collapsed_stacks_of_other_threads(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name='worker')
+    worker.start()
+    profiler = profiling.SamplingProfiler(str(tmp_path))
+    try:
+        profiler.sample()
+        profiler.sample()
+    finally:
+        stop.set()
+        worker.join()
+    stacks = [stack for stack in profiler.samples if stack.startswith('worker;')]
+    assert stacks
+    assert any('busy_loop (test_profiling.py' in stack for stack in stacks)
+    assert sum(profiler.samples[stack] for stack in stacks) == 2
+
+
+def test_sampling_profiler_writes_a_folded_file_after_the_window(tmp_path):
+    profiler = profiling.SamplingProfiler(str(tmp_path), interval=0.001)
+    assert profiler.start(0.05)
+    assert not profiler.start(0.05)
+    profiler.join()
+    files = os.listdir(tmp_path)
+    assert len(files) == 1 and files[0].endswith('.folded')
+    with open(tmp_path / files[0]) as folded:
+        lines = folded.read().splitlines()
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert any(line.startswith('MainThread;') for line in lines)
+
+
+def profiler_config(tmp_path):
+    config = configparser.ConfigParser()
+    config['PROFILER'] = {'directory': str(tmp_path), 'duration': '0.05', 'interval': '0.001'}
+    return config['PROFILER']
+
+
+def test_install_starts_the_profiler_from_the_environment(tmp_path):
+    previous = signal.getsignal(signal.SIGUSR1)
+    try:
+        profiler = profiling.install(profiler_config(tmp_path), {profiling.PROFILE_ENV: '0.05'})
+        assert profiler.running
+        profiler.join()
+        assert len(os.listdir(tmp_path)) == 1
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
+
+
+def test_install_starts_the_profiler_on_sigusr1(tmp_path):
+    previous = signal.getsignal(signal.SIGUSR1)
+    try:
+        profiler = profiling.install(profiler_config(tmp_path), {})
+        assert not profiler.running
+        os.kill(os.getpid(), signal.SIGUSR1)
+        assert profiler.running
+        profiler.join()
+        assert len(os.listdir(tmp_path)) == 1
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
+
+
+def test_install_uses_the_defaults_without_a_profiler_section():
+    previous = signal.getsignal(signal.SIGUSR1)
+    try:
+        profiler = profiling.install(None, {})
+        assert profiler.directory == '.' and profiler.interval == 0.005
+        assert not profiler.running
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
@@ -0,0 +1,93 @@
+import asyncio
+import os
+from unittest.mock import Mock
+from amtclient.recorder import FrameRecorder, read_frames, replay, segment_files
+from amtclient.streamer_client import StreamerClient
+
+
+def test_recorder_frames_are_read_back_in_order(tmpdir):
+    with FrameRecorder(str(tmpdir)) as recorder:
+        recorder.record('{"notify": 1}', received_at=10.0)
+        recorder.record('{"data": []}', received_at=10.5)
+    assert list(read_frames(str(tmpdir))) == [(10.0, '{"notify": 1}'), (10.5, '{"data": []}')]
+
+
+def test_recorder_rotates_segments_and_never_overwrites(tmpdir):
+    with FrameRecorder(str(tmpdir), segment_size=20) as recorder:
+        for i in range(3):
+            recorder.record(f'{{"frame": {i}}}', received_at=float(i))
+    with FrameRecorder(str(tmpdir), segment_size=20) as recorder:
+        recorder.record('{"frame": 3}', received_at=3.0)
+    assert len(segment_files(str(tmpdir))) == 4
+    assert [message for _, message in read_frames(str(tmpdir))] == \
+           [f'{{"frame": {i}}}' for i in range(4)]
+
+
+def test_recorder_continues_after_the_last_segment_when_old_ones_were_pruned(tmpdir):
+    with FrameRecorder(str(tmpdir), segment_size=20) as recorder:
+        for i in range(3):
+            recorder.record(f'{{"frame": {i}}}', received_at=float(i))
+    first, second, third = segment_files(str(tmpdir))
+    os.remove(first)
+    os.remove(third)
+    with FrameRecorder(str(tmpdir), segment_size=20) as recorder:
+        recorder.record('{"frame": 3}', received_at=3.0)
+    assert [os.path.basename(path) for path in segment_files(str(tmpdir))] == \
+           ['frames-000002.rec', 'frames-000003.rec']
+    assert [message for _, message in read_frames(str(tmpdir))] == ['{"frame": 1}', '{"frame": 3}']
+
+
+def test_read_frames_ignores_truncated_last_record(tmpdir):
+    with FrameRecorder(str(tmpdir)) as recorder:
+        recorder.record('{"frame": 1}', received_at=1.0)
+        recorder.record('{"frame": 2}', received_at=2.0)
+    path = segment_files(str(tmpdir))[0]
+    os.truncate(path, os.path.getsize(path) - 3)
+    assert list(read_frames(str(tmpdir))) == [(1.0, '{"frame": 1}')]
+
+
+def test_replay_keeps_the_recorded_pace_scaled_by_speed():
+    now = [0.0]
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    service_client = Mock()
+    frames = [(100.0, 'm1'), (101.0, 'm2'), (103.0, 'm3')]
+    assert asyncio.run(replay(frames, service_client, speed=2.0, clock=lambda: now[0],
+                              sleep=sleep)) == 3
+    assert sleeps == [0.5, 1.0]
+    assert [call[0][0] for call in service_client.handle_message.call_args_list] == \
+           ['m1', 'm2', 'm3']
+
+
+def test_replay_at_max_speed_does_not_sleep():
+    sleep = Mock()
+    asyncio.run(replay([(100.0, 'm1'), (200.0, 'm2')], Mock(), speed=0, sleep=sleep))
+    sleep.assert_not_called()
+
+
+def test_streamer_client_records_every_received_message():
+    class FakeWebsocket:
+        def __init__(self, messages):
+            self.messages = messages
+            self.sent = []
+
+        async def send(self, message):
+            self.sent.append(message)
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            if not self.messages:
+                raise StopAsyncIteration
+            return self.messages.pop(0)
+
+    recorder = Mock()
+    service_client = Mock()
+    asyncio.run(StreamerClient._execute(FakeWebsocket(['m1', 'm2']), service_client, recorder))
+    assert [call[0][0] for call in recorder.record.call_args_list] == ['m1', 'm2']
+    assert service_client.handle_message.call_count == 2
@@ -1,8 +1,13 @@
 import pytest
+import requests
+import urllib3
 import time
 import json
+import os
 from unittest.mock import Mock
-from amtclient.request import Request, RequestException, TokenRetriever, TokenRetrieverException
+from requests.adapters import HTTPAdapter
+from amtclient.request import Request, RequestException, TokenRetriever, TokenRetrieverException, \
+    UserPrincipalsRetriever, TimeoutHTTPAdapter, create_session
 import configuration
 
 
@@ -174,6 +179,27 @@ def test_token_retriever_refreshes_token_when_access_token_is_expired(config, to
     assert requests_mock.call_count == 2
 
 
+def test_token_retriever_uses_a_token_refreshed_by_another_process(config, token_srv_url,
+                                                                   requests_mock):
+    expired = {"access_token": "exp_token_value", "refresh_token": "refresh_token_value",
+               "expires_in": -1, "refresh_token_expires_in": 3600}
+    requests_mock.post(token_srv_url, json=expired, status_code=200)
+    token_retriever = TokenRetriever()
+    refreshed = dict(expired, access_token="shard_token_value", expires_in=time.time() + 1800)
+    with open(token_retriever.token_data_file, 'w') as token_file:
+        json.dump(refreshed, token_file)
+    assert token_retriever.get_access_token() == "shard_token_value"
+    assert requests_mock.call_count == 1
+
+
+def test_token_retriever_replaces_the_token_file_atomically(config, token_request):
+    token_retriever = TokenRetriever()
+    directory = os.path.dirname(token_retriever.token_data_file)
+    assert [name for name in os.listdir(directory) if name.endswith('.tmp')] == []
+    with open(token_retriever.token_data_file) as token_file:
+        assert json.load(token_file)['access_token'] == "token_value"
+
+
 def test_token_retriever_throws_exception_when_both_tokens_are_expired(config, token_srv_url,
                                                                        requests_mock):
     auth_response = {
@@ -212,3 +238,80 @@ def test_token_retriever_refresh_request(config, token_srv_url, token_response,
     assert refresh_req_data['refresh_token'] == 'refresh_token_value'
     assert refresh_req_data['access_type'] == 'offline'
     assert refresh_req_data['client_id'] == '123456'
+
+
+@pytest.fixture()
+def principals_srv_url():
+    return 'https://api.tdameritrade.com/v1/userprincipals'
+
+
+def principals_response(expiration):
+    return {
+        "accounts": [{"accountId": "123", "company": "AMER", "segment": "AMER",
+                      "accountCdDomainId": "A000"}],
+        "streamerInfo": {"streamerSocketUrl": "streamer-ws.tdameritrade.com", "token": "tkn",
+                         "tokenTimestamp": "2020-05-30T19:00:00+0000",
+                         "tokenExpirationTime": expiration, "userGroup": "ACCT",
+                         "accessLevel": "ACCT", "appId": "app", "acl": "AK"}
+    }
+
+
+def test_user_principals_retriever_reports_expired_streamer_token(config, token_request,
+                                                                  principals_srv_url,
+                                                                  requests_mock):
+    configuration.configuration['MT_CLIENT']['user_principals_service_url'] = principals_srv_url
+    requests_mock.get(principals_srv_url, json=principals_response("2020-05-31T19:00:00+0000"))
+    retriever = UserPrincipalsRetriever()
+    assert retriever.is_expired()
+
+    requests_mock.get(principals_srv_url, json=principals_response("2999-01-01T00:00:00+0000"))
+    retriever.refresh()
+    assert not retriever.is_expired()
+
+
+def test_user_principals_retriever_caches_credentials_until_refresh(config, token_request,
+                                                                   principals_srv_url,
+                                                                   requests_mock):
+    configuration.configuration['MT_CLIENT']['user_principals_service_url'] = principals_srv_url
+    requests_mock.get(principals_srv_url, json=principals_response("2999-01-01T00:00:00+0000"))
+    retriever = UserPrincipalsRetriever()
+    credentials = retriever.get_credentials()
+    assert credentials['token'] == "tkn"
+    assert retriever.get_credentials() is credentials
+    retriever.refresh()
+    assert retriever.get_credentials() is not credentials
+
+
+def test_requests_share_a_pooled_keep_alive_session():
+    assert isinstance(Request().sender, requests.Session)
+    assert Request().sender is Request().sender
+
+
+def test_session_uses_configured_timeout_and_retries(config):
+    configuration.configuration['MT_CLIENT']['http_timeout'] = '2.5'
+    configuration.configuration['MT_CLIENT']['http_retries'] = '5'
+    adapter = create_session().get_adapter('https://api.tdameritrade.com')
+    assert isinstance(adapter, TimeoutHTTPAdapter)
+    assert adapter.timeout == 2.5
+    assert adapter.max_retries.total == 5
+    assert 503 in adapter.max_retries.status_forcelist
+
+
+def test_session_only_retries_posts_on_connection_errors(config):
+    retry = create_session().get_adapter('https://api.tdameritrade.com').max_retries
+    assert retry.is_retry('GET', 503)
+    assert not retry.is_retry('POST', 503)
+    assert not retry.is_retry('POST', 429)
+    assert retry.increment('POST', '/v1/oauth2/token',
+                           error=urllib3.exceptions.ConnectTimeoutError()).total == retry.total - 1
+    with pytest.raises(urllib3.exceptions.ProtocolError):
+        retry.increment('POST', '/v1/oauth2/token', error=urllib3.exceptions.ProtocolError())
+
+
+def test_timeout_adapter_sets_default_timeout_only_when_not_given(monkeypatch):
+    calls = []
+    monkeypatch.setattr(HTTPAdapter, 'send', lambda self, request, **kwargs: calls.append(kwargs))
+    adapter = TimeoutHTTPAdapter(timeout=3)
+    adapter.send(Mock(), timeout=None)
+    adapter.send(Mock(), timeout=7)
+    assert [call['timeout'] for call in calls] == [3, 7]
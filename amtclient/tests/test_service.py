@@ -1,7 +1,9 @@
 import pytest
 import json
 import configuration
-from amtclient.service import QuoteServiceClient, get_service_client, ServiceType, ServiceClientException
+from unittest.mock import Mock
+from amtclient.service import QuoteServiceClient, get_service_client, ServiceType, ServiceClientException, \
+    ServiceDispatcher, get_service_dispatcher, ServiceCommand
 
 
 @pytest.fixture()
@@ -141,3 +143,122 @@ def test_get_service_from_registry_returns_the_service_client_if_found(credentia
 def test_get_service_from_registry_throws_error_if_service_not_found(credentials, config):
     with pytest.raises(ServiceClientException):
         get_service_client('unknown', credentials)
+
+
+def test_quote_service_handle_message_decodes_every_data_block(credentials, config):
+    service = QuoteServiceClient(credentials, output=Mock(spec=['write']))
+    message = """
+    {
+      "data": [
+        {
+          "service": "QUOTE",
+          "timestamp": 1590872446764,
+          "command": "SUBS",
+          "content": [{"1": 183.7, "key": "MSFT"}, {"1": 8.3, "key": "GGAL"}]
+        },
+        {
+          "service": "QUOTE",
+          "timestamp": 1590872447000,
+          "command": "SUBS",
+          "content": [{"2": 230.5, "key": "QQQ"}]
+        }
+      ]
+    }
+    """
+    quotes = service.handle_message(message)
+    assert [quote['key'] for quote in quotes] == ["MSFT", "GGAL", "QQQ"]
+    assert [quote['timestamp'] for quote in quotes] == [1590872446764, 1590872446764,
+                                                         1590872447000]
+    assert quotes[0]['formated_timestamp'] == quotes[1]['formated_timestamp']
+    assert quotes[2]['ask_price'] == 230.5
+    assert service.output.write.call_count == 3
+
+
+def test_quote_service_handle_message_accepts_bytes(credentials, config):
+    service = QuoteServiceClient(credentials, output=Mock(spec=['write']))
+    message = b'{"data": [{"timestamp": 1590872446764, "content": [{"1": 1.5, "key": "SPY"}]}]}'
+    quotes = service.handle_message(message)
+    assert quotes[0]['bid_price'] == 1.5
+
+
+def test_quote_service_writes_one_batch_per_message_if_output_supports_it(credentials, config):
+    service = QuoteServiceClient(credentials, output=Mock(spec=['write', 'write_batch']))
+    message = '{"data": [{"timestamp": 1590872446764, ' \
+              '"content": [{"1": 1.5, "key": "SPY"}, {"2": 2.5, "key": "QQQ"}]}]}'
+    service.handle_message(message)
+    service.output.write.assert_not_called()
+    batch = service.output.write_batch.call_args[0][0]
+    assert batch.values("key") == ["SPY", "QQQ"]
+    assert batch.values("bid_price") == [1.5, None]
+
+
+class ChartServiceClient(QuoteServiceClient):
+
+    def request_service(self):
+        return "CHART_EQUITY"
+
+
+def test_service_dispatcher_subscribes_every_service_in_one_request(credentials, config):
+    dispatcher = ServiceDispatcher([QuoteServiceClient(credentials),
+                                    ChartServiceClient(credentials)])
+    request = json.loads(dispatcher.get_request())
+    assert [(r['service'], r['requestid'], r['command']) for r in request['requests']] == [
+        ('QUOTE', '2', 'SUBS'), ('CHART_EQUITY', '3', 'SUBS')]
+
+
+def test_service_dispatcher_routes_data_blocks_by_service(credentials, config):
+    quote_output, chart_output = Mock(spec=['write']), Mock(spec=['write'])
+    dispatcher = ServiceDispatcher([QuoteServiceClient(credentials, quote_output),
+                                    ChartServiceClient(credentials, chart_output)])
+    message = json.dumps({"data": [
+        {"service": "QUOTE", "timestamp": 1590879805110, "command": "SUBS",
+         "content": [{"key": "MSFT", "1": 183.7}, {"key": "QQQ", "1": 230.1}]},
+        {"service": "CHART_EQUITY", "timestamp": 1590879805110, "command": "SUBS",
+         "content": [{"key": "SPY", "2": 300.2}]},
+        {"service": "TIMESALE_EQUITY", "timestamp": 1590879805110, "command": "SUBS",
+         "content": [{"key": "SPY"}]}]})
+    entities = dispatcher.handle_message(message)
+    assert [entity['key'] for entity in entities] == ['MSFT', 'QQQ', 'SPY']
+    assert [call[0][0]['key'] for call in quote_output.write.call_args_list] == ['MSFT', 'QQQ']
+    assert chart_output.write.call_args[0][0]['ask_price'] == 300.2
+    assert dispatcher.blocks == {'QUOTE': 1, 'CHART_EQUITY': 1}
+    assert dispatcher.entities == {'QUOTE': 2, 'CHART_EQUITY': 1}
+    assert dispatcher.unknown_blocks == 1
+
+
+def test_get_service_dispatcher_passes_keys_by_service_type(credentials, config):
+    dispatcher = get_service_dispatcher([ServiceType.QUOTE], credentials,
+                                        keys={ServiceType.QUOTE: 'SPY'})
+    assert dispatcher.service_clients['QUOTE'].keys == 'SPY'
+
+
+def test_quote_service_add_command_subscribes_only_the_new_keys(credentials, config):
+    service = QuoteServiceClient(credentials)
+    request = service.build_command(ServiceCommand.ADD, 'key4, key1', '100')
+    assert request == {"service": "QUOTE", "requestid": "100", "command": "ADD",
+                       "account": "theuserid", "source": "theappid",
+                       "parameters": {"keys": "key4,key1", "fields": "1,2"}}
+    assert service.keys == 'key1,key2,key3,key4'
+
+
+def test_quote_service_unsubs_command_removes_the_keys(credentials, config):
+    service = QuoteServiceClient(credentials)
+    request = service.build_command(ServiceCommand.UNSUBS, 'key2', '100')
+    assert request['command'] == 'UNSUBS'
+    assert request['parameters'] == {"keys": "key2"}
+    assert json.loads(service.get_request())['requests'][0]['parameters']['keys'] == 'key1,key3'
+
+
+def test_quote_service_subs_and_view_commands_replace_keys_and_fields(credentials, config):
+    service = QuoteServiceClient(credentials)
+    service.build_command(ServiceCommand.SUBS, 'key5,key6', '100')
+    request = service.build_command(ServiceCommand.VIEW, '1', '101')
+    assert request['parameters'] == {"fields": "1"}
+    assert service.request_parameters() == {"keys": "key5,key6", "fields": "1"}
+
+
+def test_quote_service_command_needs_values(credentials, config):
+    service = QuoteServiceClient(credentials)
+    with pytest.raises(ServiceClientException):
+        service.build_command(ServiceCommand.ADD, ' , ', '100')
+    assert service.keys == 'key1,key2,key3'
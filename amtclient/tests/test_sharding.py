@@ -0,0 +1,74 @@
+import multiprocessing
+import pytest
+from amtclient import sharding
+from amtclient.sharding import shard_keys, ShardedStreamer, ShardException, _ConnectionStream
+from amtclient.service import ServiceType
+from model import Model, Entity
+from model.codec import BinaryWriter, BinaryReader
+
+
+class ListOutput:
+
+    def __init__(self):
+        self.entities = []
+
+    def write(self, entity):
+        self.entities.append(entity)
+
+
+def fake_shard(service_type, keys, connection, log_level):
+    writer = BinaryWriter(_ConnectionStream(connection))
+    for price in range(20):
+        for key in keys.split(','):
+            writer.write(Entity(Model.QUOTE, {"key": key, "bid_price": price}))
+    connection.close()
+
+
+def test_shard_keys_splits_keys_in_balanced_groups():
+    assert shard_keys('AAPL,MSFT,QQQ,GOOG,GGAL', 2) == ['AAPL,QQQ,GGAL', 'MSFT,GOOG']
+
+
+def test_shard_keys_does_not_create_empty_shards():
+    assert shard_keys('AAPL, MSFT', 4) == ['AAPL', 'MSFT']
+
+
+def test_connection_stream_carries_binary_records():
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    writer = BinaryWriter(_ConnectionStream(sender))
+    writer.write(Entity(Model.QUOTE, {"key": "QQQ", "bid_price": 1.5}))
+    sender.close()
+    entities = list(BinaryReader(_ConnectionStream(receiver)))
+    assert [entity.fields_values for entity in entities] == [{"key": "QQQ", "bid_price": 1.5}]
+
+
+def test_sharded_streamer_merges_shards_keeping_order_per_symbol(monkeypatch):
+    monkeypatch.setattr(sharding, '_run_shard', fake_shard)
+    output = ListOutput()
+    streamer = ShardedStreamer(ServiceType.QUOTE, 'AAPL,MSFT,QQQ,GOOG,GGAL', 3, output,
+                               stats_interval=0.1)
+    streamer.run()
+
+    assert len(output.entities) == 100
+    for key in ['AAPL', 'MSFT', 'QQQ', 'GOOG', 'GGAL']:
+        prices = [entity['bid_price'] for entity in output.entities if entity['key'] == key]
+        assert prices == list(range(20))
+    assert [stats.entities for stats in streamer.stats] == [40, 40, 20]
+    assert [stats.keys for stats in streamer.stats] == [2, 2, 1]
+
+
+def crashing_shard(service_type, keys, connection, log_level):
+    writer = BinaryWriter(_ConnectionStream(connection))
+    writer.write(Entity(Model.QUOTE, {"key": keys, "bid_price": 1.0}))
+    connection.close()
+    raise SystemExit(3)
+
+
+def test_sharded_streamer_restarts_dead_shards_and_gives_up_after_max_restarts(monkeypatch):
+    monkeypatch.setattr(sharding, '_run_shard', crashing_shard)
+    output = ListOutput()
+    streamer = ShardedStreamer(ServiceType.QUOTE, 'AAPL,MSFT', 2, output, max_restarts=2,
+                               check_interval=0.01)
+    with pytest.raises(ShardException):
+        streamer.run()
+    assert streamer.restarts[0] == 3 or streamer.restarts[1] == 3
+    assert len(output.entities) >= 5
@@ -0,0 +1,207 @@
+import configparser
+import pytest
+from unittest.mock import Mock
+import configuration
+from amtclient.stages import LatestStateStage, ConflationStage, RepositoryStage, DedupStage, \
+    StageException, create_output_stages
+from model import Model, Entity, EntityBatch, LatestStateStore
+
+
+def quote(fields):
+    return Entity(Model.QUOTE, fields)
+
+
+def test_latest_state_stage_emits_full_merged_quotes():
+    output = Mock(spec=['write'])
+    stage = LatestStateStage(output, LatestStateStore(Model.QUOTE))
+    stage.write(quote({"key": "MSFT", "bid_price": 1.0}))
+    stage.write(quote({"key": "MSFT", "ask_price": 2.0}))
+    assert output.write.call_args[0][0].fields_values == {"key": "MSFT", "bid_price": 1.0,
+                                                          "ask_price": 2.0}
+
+
+def test_latest_state_stage_can_emit_deltas_while_tracking_state():
+    output = Mock(spec=['write'])
+    store = LatestStateStore(Model.QUOTE)
+    stage = LatestStateStage(output, store, emit_full=False)
+    stage.write(quote({"key": "MSFT", "bid_price": 1.0}))
+    stage.write(quote({"key": "MSFT", "ask_price": 2.0}))
+    assert output.write.call_args[0][0].fields_values == {"key": "MSFT", "ask_price": 2.0}
+    assert store.get("MSFT")['bid_price'] == 1.0
+
+
+def test_output_stage_forwards_batches_when_output_supports_them():
+    output = Mock(spec=['write', 'write_batch'])
+    stage = LatestStateStage(output, LatestStateStore(Model.QUOTE))
+    stage.write(quote({"key": "MSFT", "bid_price": 1.0}))
+    stage.write_batch(EntityBatch.from_entities(Model.QUOTE, [
+        quote({"key": "MSFT", "ask_price": 2.0}), quote({"key": "QQQ", "ask_price": 3.0})]))
+    batch = output.write_batch.call_args[0][0]
+    assert batch.values("bid_price") == [1.0, None]
+    assert batch.values("ask_price") == [2.0, 3.0]
+
+
+def test_output_stage_writes_batch_entities_one_by_one_otherwise():
+    output = Mock(spec=['write'])
+    stage = LatestStateStage(output, LatestStateStore(Model.QUOTE))
+    stage.write_batch(EntityBatch.from_entities(Model.QUOTE, [
+        quote({"key": "MSFT", "ask_price": 2.0}), quote({"key": "QQQ", "ask_price": 3.0})]))
+    assert output.write.call_count == 2
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_conflation_stage_merges_updates_within_the_window():
+    output = Mock(spec=['write'])
+    clock = FakeClock()
+    stage = ConflationStage(output, 0.1, clock=clock)
+    stage.write(quote({"key": "SPY", "bid_price": 1.0}))
+    stage.write(quote({"key": "SPY", "ask_price": 2.0}))
+    stage.write(quote({"key": "SPY", "bid_price": 1.5}))
+    output.write.assert_not_called()
+    clock.now = 0.1
+    stage.flush_due()
+    output.write.assert_called_once()
+    assert output.write.call_args[0][0].fields_values == {"key": "SPY", "bid_price": 1.5,
+                                                          "ask_price": 2.0}
+    assert stage.conflated == 2
+    assert stage.conflated_by_key == {"SPY": 2}
+    assert (stage.received, stage.emitted) == (3, 1)
+
+
+def test_conflation_stage_emits_due_symbols_on_write():
+    output = Mock(spec=['write'])
+    clock = FakeClock()
+    stage = ConflationStage(output, 0.1, clock=clock)
+    stage.write(quote({"key": "SPY", "bid_price": 1.0}))
+    clock.now = 0.2
+    stage.write(quote({"key": "QQQ", "bid_price": 2.0}))
+    assert output.write.call_args[0][0].fields_values == {"key": "SPY", "bid_price": 1.0}
+    stage.flush()
+    assert output.write.call_args[0][0].fields_values == {"key": "QQQ", "bid_price": 2.0}
+
+
+def test_conflation_stage_uses_per_symbol_windows():
+    output = Mock(spec=['write'])
+    clock = FakeClock()
+    stage = ConflationStage(output, 0, {"SPY": 0.5}, clock=clock)
+    stage.write(quote({"key": "MSFT", "bid_price": 1.0}))
+    stage.write(quote({"key": "SPY", "bid_price": 2.0}))
+    assert output.write.call_count == 1
+    clock.now = 0.4
+    stage.flush_due()
+    assert output.write.call_count == 1
+    clock.now = 0.5
+    stage.flush_due()
+    assert output.write.call_count == 2
+
+
+def test_conflation_stage_forwards_due_entities_as_a_batch():
+    output = Mock(spec=['write', 'write_batch'])
+    clock = FakeClock()
+    stage = ConflationStage(output, 0.1, clock=clock)
+    stage.write_batch(EntityBatch.from_entities(Model.QUOTE, [
+        quote({"key": "SPY", "bid_price": 1.0}), quote({"key": "SPY", "bid_price": 2.0})]))
+    output.write_batch.assert_not_called()
+    clock.now = 0.1
+    stage.write_batch(EntityBatch.from_entities(Model.QUOTE, [
+        quote({"key": "QQQ", "bid_price": 3.0})]))
+    batch = output.write_batch.call_args[0][0]
+    assert batch.values("bid_price") == [2.0]
+
+
+def test_conflation_stage_chains_into_latest_state_stage():
+    output = Mock(spec=['write'])
+    clock = FakeClock()
+    stage = ConflationStage(LatestStateStage(output, LatestStateStore(Model.QUOTE)), 0.1,
+                            clock=clock)
+    stage.write(quote({"key": "SPY", "bid_price": 1.0}))
+    stage.flush()
+    stage.write(quote({"key": "SPY", "ask_price": 2.0}))
+    stage.flush()
+    assert output.write.call_args[0][0].fields_values == {"key": "SPY", "bid_price": 1.0,
+                                                          "ask_price": 2.0}
+
+
+def test_repository_stage_stores_every_entity_before_forwarding_it():
+    output = Mock(spec=['write'])
+    repository = Mock()
+    stage = RepositoryStage(output, repository)
+    entity = quote({"key": "SPY", "bid_price": 1.0})
+    stage.write(entity)
+    repository.add.assert_called_once_with(entity)
+    output.write.assert_called_once_with(entity)
+    stage.flush()
+    repository.flush.assert_called_once()
+
+
+def test_dedup_stage_drops_updates_without_significant_changes():
+    output = Mock(spec=['write'])
+    stage = DedupStage(output, Model.QUOTE, ['bid_price', 'ask_price'])
+    stage.write(quote({"key": "GGAL", "bid_price": 1.0, "ask_price": 2.0}))
+    stage.write(quote({"key": "GGAL", "bid_size": 300}))
+    stage.write(quote({"key": "GGAL", "bid_price": 1.0, "bid_size": 200}))
+    stage.write(quote({"key": "GGAL", "ask_price": 2.1}))
+    stage.write(quote({"key": "MSFT", "bid_price": 1.0}))
+    assert [call[0][0].fields_values for call in output.write.call_args_list] == [
+        {"key": "GGAL", "bid_price": 1.0, "ask_price": 2.0},
+        {"key": "GGAL", "ask_price": 2.1},
+        {"key": "MSFT", "bid_price": 1.0}]
+    assert stage.suppressed == 2
+    assert stage.suppressed_by_key == {"GGAL": 2}
+
+
+def test_dedup_stage_filters_batches():
+    output = Mock(spec=['write', 'write_batch'])
+    stage = DedupStage(output, Model.QUOTE, ['bid_price'])
+    stage.write_batch(EntityBatch.from_entities(Model.QUOTE, [
+        quote({"key": "GGAL", "bid_price": 1.0}), quote({"key": "GGAL", "bid_price": 1.0}),
+        quote({"key": "GGAL", "bid_price": 1.1})]))
+    assert output.write_batch.call_args[0][0].values("bid_price") == [1.0, 1.1]
+    stage.write_batch(EntityBatch.from_entities(Model.QUOTE, [
+        quote({"key": "GGAL", "bid_price": 1.1})]))
+    assert output.write_batch.call_count == 1
+
+
+def test_create_output_stages_accepts_a_config_without_the_optional_sections(monkeypatch):
+    config = configparser.ConfigParser()
+    config.read_string('[MT_CLIENT]\n[QUOTE]\nservice_keys = A\n[DATABASE]\n')
+    monkeypatch.setattr(configuration, 'configuration', config)
+    output = Mock(spec=['write'])
+    assert create_output_stages(output) is output
+
+
+def test_dedup_stage_always_forwards_the_first_quote_of_a_symbol():
+    output = Mock(spec=['write'])
+    stage = DedupStage(output, Model.QUOTE, ['bid_price'])
+    stage.write(quote({"key": "GGAL", "bid_size": 100}))
+    stage.write(quote({"key": "GGAL", "bid_size": 200}))
+    assert output.write.call_count == 1
+    assert stage.suppressed == 1
+
+
+def test_dedup_stage_rejects_unknown_fields():
+    with pytest.raises(StageException):
+        DedupStage(Mock(), Model.QUOTE, ['bid_price', 'bidprice'], known_fields={'bid_price'})
+
+
+def test_dedup_compares_merged_quotes_so_dropped_deltas_still_update_the_state(monkeypatch):
+    config = configparser.ConfigParser()
+    config.read_string('[QUOTE]\nemit_full_quotes = true\ndedup_fields = bid_price\n'
+                       'service_field_mappings = {"1": "bid_price", "4": "bid_size"}\n')
+    monkeypatch.setattr(configuration, 'configuration', config)
+    output = Mock(spec=['write'])
+    stages = create_output_stages(output)
+    stages.write(quote({"key": "GGAL", "bid_price": 1.0, "bid_size": 100}))
+    stages.write(quote({"key": "GGAL", "bid_size": 300}))
+    stages.write(quote({"key": "GGAL", "bid_price": 1.1}))
+    assert [call[0][0].fields_values for call in output.write.call_args_list] == [
+        {"key": "GGAL", "bid_price": 1.0, "bid_size": 100},
+        {"key": "GGAL", "bid_price": 1.1, "bid_size": 300}]
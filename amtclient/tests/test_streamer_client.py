@@ -0,0 +1,283 @@
+import asyncio
+import itertools
+import json
+import pytest
+from unittest.mock import Mock
+from websockets.exceptions import ConnectionClosedError
+from amtclient import streamer_client, ServiceType
+from amtclient.service import ServiceCommand, ServiceClientException
+from amtclient.streamer_client import Backoff, ConnectionStats, StreamerClient, LoginException, \
+    stream_forever
+
+
+class FakeWebsocket:
+
+    def __init__(self, login_response):
+        self.login_response = login_response
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    async def recv(self):
+        return json.dumps(self.login_response)
+
+
+def streamer(principals_retriever):
+    client = StreamerClient.__new__(StreamerClient)
+    client.user_principals_retriever = principals_retriever
+    client.connection_stats = ConnectionStats()
+    client._principals_rejected = False
+    client._service_client = None
+    client._websocket = None
+    client._request_ids = itertools.count(100)
+    client._send_lock = asyncio.Lock()
+    return client
+
+
+@pytest.fixture()
+def principals_retriever():
+    retriever = Mock()
+    retriever.is_expired.return_value = False
+    retriever.get_credentials.return_value = {'userid': 'user', 'appid': 'app', 'token': 't'}
+    return retriever
+
+
+def test_backoff_retries_immediately_first_and_then_backs_off_with_jitter():
+    backoff = Backoff(first_delay=0.0, base_delay=1.0, max_delay=4.0)
+    delays = [backoff.next_delay() for _ in range(5)]
+    assert delays[0] == 0.0
+    assert 0.5 <= delays[1] <= 1.0
+    assert 1.0 <= delays[2] <= 2.0
+    assert 2.0 <= delays[3] <= 4.0
+    assert 2.0 <= delays[4] <= 4.0
+    backoff.reset()
+    assert backoff.next_delay() == 0.0
+
+
+def test_connection_stats_accumulates_disconnected_time(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(streamer_client.time, 'monotonic', lambda: now[0])
+    exported = streamer_client.DISCONNECTED_SECONDS.value
+    stats = ConnectionStats()
+    assert stats.connected() is None
+    stats.disconnected()
+    now[0] = 101.5
+    stats.disconnected()
+    now[0] = 102.0
+    assert stats.connected() == 2.0
+    assert stats.disconnected_time == 2.0
+    assert streamer_client.DISCONNECTED_SECONDS.value - exported == 2.0
+    assert stats.disconnections == 1
+    assert stats.connections == 2
+
+
+def test_login_rejected_marks_principals_to_be_refreshed(principals_retriever):
+    client = streamer(principals_retriever)
+    websocket = FakeWebsocket({"response": [{"service": "ADMIN", "command": "LOGIN",
+                                             "content": {"code": 3, "msg": "Login denied"}}]})
+    with pytest.raises(LoginException):
+        asyncio.run(client._login(websocket))
+    client._refresh_principals_if_needed()
+    principals_retriever.refresh.assert_called_once()
+    client._refresh_principals_if_needed()
+    principals_retriever.refresh.assert_called_once()
+
+
+def test_login_accepted_reuses_cached_principals(principals_retriever):
+    client = streamer(principals_retriever)
+    websocket = FakeWebsocket({"response": [{"service": "ADMIN", "command": "LOGIN",
+                                             "content": {"code": 0, "msg": "ok"}}]})
+    asyncio.run(client._login(websocket))
+    client._refresh_principals_if_needed()
+    principals_retriever.refresh.assert_not_called()
+
+
+def test_expired_principals_are_refreshed(principals_retriever):
+    principals_retriever.is_expired.return_value = True
+    client = streamer(principals_retriever)
+    client._refresh_principals_if_needed()
+    principals_retriever.refresh.assert_called_once()
+
+
+def test_stream_forever_reuses_the_streamer_client_between_reconnections(monkeypatch):
+    created = []
+
+    class FakeStreamerClient:
+        def __init__(self, *args):
+            created.append(self)
+            self.connection_stats = ConnectionStats()
+            self.executions = 0
+
+        async def execute(self):
+            self.executions += 1
+            if self.executions == 4:
+                raise asyncio.CancelledError()
+            self.connection_stats.connected()
+            raise ConnectionClosedError(1006, 'closed')
+
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(streamer_client, 'StreamerClient', FakeStreamerClient)
+    monkeypatch.setattr(streamer_client.asyncio, 'sleep', sleep)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(stream_forever(None))
+    assert len(created) == 1
+    assert delays[0] == 0.0
+    assert 0.25 <= delays[1] <= 0.5
+    assert 0.5 <= delays[2] <= 1.0
+
+
+def test_stream_forever_resets_the_backoff_once_a_connection_stayed_up(monkeypatch):
+    now = [0.0]
+
+    class FakeStreamerClient:
+        def __init__(self, *args):
+            self.connection_stats = ConnectionStats()
+            self.executions = 0
+
+        async def execute(self):
+            self.executions += 1
+            if self.executions == 4:
+                raise asyncio.CancelledError()
+            self.connection_stats.connected()
+            now[0] += 60.0 if self.executions == 2 else 1.0
+            raise ConnectionClosedError(1006, 'closed')
+
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(streamer_client.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(streamer_client, 'StreamerClient', FakeStreamerClient)
+    monkeypatch.setattr(streamer_client.asyncio, 'sleep', sleep)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(stream_forever(None, backoff=Backoff(min_uptime=30.0)))
+    assert delays[0] == 0.0
+    assert delays[1] == 0.0
+    assert 0.25 <= delays[2] <= 0.5
+
+
+def test_streamer_client_uses_a_dispatcher_for_several_services(principals_retriever, monkeypatch):
+    client = streamer(principals_retriever)
+    client.output = Mock(spec=['write'])
+    client.keys = None
+    client.service_type = [ServiceType.QUOTE]
+    get_service_dispatcher = Mock()
+    monkeypatch.setattr(streamer_client, 'get_service_dispatcher', get_service_dispatcher)
+    assert client._create_service_client() is get_service_dispatcher.return_value
+    get_service_dispatcher.assert_called_once_with(
+        [ServiceType.QUOTE], principals_retriever.get_credentials.return_value, client.output,
+        None)
+
+
+def test_control_sends_the_command_over_the_open_websocket(principals_retriever):
+    client = streamer(principals_retriever)
+    service_client = Mock(spec=['build_command', 'request_service'])
+    service_client.build_command.return_value = {'command': 'ADD'}
+    service_client.request_service.return_value = 'QUOTE'
+    client._service_client = service_client
+    websocket = FakeWebsocket({})
+    client._websocket = websocket
+    assert asyncio.run(client.control(ServiceCommand.ADD, 'QUOTE', 'SPY'))
+    service_client.build_command.assert_called_once_with(ServiceCommand.ADD, 'SPY', '100')
+    assert websocket.sent == [json.dumps({'requests': [{'command': 'ADD'}]})]
+
+
+def test_control_keeps_the_change_for_the_next_connection(principals_retriever):
+    client = streamer(principals_retriever)
+    service_client = Mock()
+    client._service_client = Mock(service_clients={'QUOTE': service_client})
+    assert not asyncio.run(client.control(ServiceCommand.UNSUBS, 'QUOTE', 'SPY'))
+    service_client.build_command.assert_called_once_with(ServiceCommand.UNSUBS, 'SPY', '100')
+    with pytest.raises(ServiceClientException):
+        asyncio.run(client.control(ServiceCommand.ADD, 'LEVELONE_FUTURES', 'SPY'))
+
+
+def test_control_needs_a_first_connection(principals_retriever):
+    client = streamer(principals_retriever)
+    with pytest.raises(ServiceClientException):
+        asyncio.run(client.control(ServiceCommand.ADD, 'QUOTE', 'SPY'))
+
+
+def test_service_client_is_reused_with_fresh_credentials(principals_retriever, monkeypatch):
+    client = streamer(principals_retriever)
+    service_client = Mock(spec=['request_service', 'credentials'])
+    create = Mock(return_value=service_client)
+    monkeypatch.setattr(client, '_create_service_client', create)
+    assert client._get_service_client() is service_client
+    principals_retriever.get_credentials.return_value = {'userid': 'other'}
+    assert client._get_service_client() is service_client
+    create.assert_called_once_with()
+    assert service_client.credentials == {'userid': 'other'}
+
+
+class BlockingWebsocket:
+
+    def __init__(self):
+        self.sent = []
+        self.sending = asyncio.Event()
+        self.release = asyncio.Event()
+        self.closed = asyncio.Event()
+
+    async def send(self, message):
+        if not self.sent and not self.release.is_set():
+            self.sending.set()
+            await self.release.wait()
+        self.sent.append(message)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self.closed.wait()
+        raise StopAsyncIteration
+
+
+class FakeConnection:
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+
+    async def __aenter__(self):
+        return self.websocket
+
+    async def __aexit__(self, *args):
+        pass
+
+
+def test_control_commands_wait_for_the_initial_subscription(principals_retriever, monkeypatch):
+    client = streamer(principals_retriever)
+    client.recorder = None
+    service_client = Mock(spec=['get_request', 'build_command', 'request_service', 'credentials'])
+    service_client.get_request.return_value = 'SUBS'
+    service_client.build_command.return_value = {'command': 'ADD'}
+    service_client.request_service.return_value = 'QUOTE'
+    client._service_client = service_client
+
+    async def login(websocket):
+        pass
+
+    monkeypatch.setattr(client, '_login', login)
+    monkeypatch.setattr(client, '_get_streamer_url', lambda: 'wss://streamer/ws')
+
+    async def run():
+        websocket = BlockingWebsocket()
+        monkeypatch.setattr(streamer_client.websockets.client, 'connect',
+                            lambda uri: FakeConnection(websocket))
+        execution = asyncio.create_task(client.execute())
+        await websocket.sending.wait()
+        control = asyncio.create_task(client.control(ServiceCommand.ADD, 'QUOTE', 'SPY'))
+        await asyncio.sleep(0.01)
+        assert not control.done()
+        websocket.release.set()
+        assert await control
+        websocket.closed.set()
+        await execution
+        return websocket.sent
+
+    assert asyncio.run(run()) == ['SUBS', json.dumps({'requests': [{'command': 'ADD'}]})]
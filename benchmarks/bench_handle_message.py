@@ -0,0 +1,59 @@
+import argparse
+import json
+import time
+from datetime import datetime
+import configuration
+import json_backend
+from amtclient.service import QuoteServiceClient
+from .frames import QuoteFrameGenerator, load_configuration, symbols
+
+
+class NullOutput:
+
+    def write(self, entity):
+        pass
+
+
+def legacy_handle_message(service, message):
+    result = json.loads(f"{message}")
+    entities = []
+    if 'data' in result:
+        data = result['data']
+        timestamp = data[0]['timestamp']
+        content = data[0]['content']
+        for element in content:
+            element['timestamp'] = timestamp
+            element['formated_timestamp'] = str(datetime.fromtimestamp(float(timestamp / 1000)))
+            entities.append(service._create_entity(element))
+    return entities
+
+
+def measure(handle, messages):
+    start = time.perf_counter()
+    quotes = sum(len(handle(message)) for message in messages)
+    return quotes / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares handle_message implementations")
+    parser.add_argument('--config', default='config.ini.template',
+                        help="configuration file with the QUOTE field mappings")
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--quotes-per-frame', type=int, default=50)
+    parser.add_argument('--symbols', type=int, default=300)
+    args = parser.parse_args()
+
+    configuration.configuration = load_configuration(args.config)
+    service = QuoteServiceClient({}, NullOutput())
+    generator = QuoteFrameGenerator(service.mappings, symbols(args.symbols),
+                                    args.quotes_per_frame)
+    messages = generator.frames(args.frames)
+
+    print(f'json backend: {json_backend.name}')
+    print(f'legacy          {measure(lambda m: legacy_handle_message(service, m), messages):12,.0f}'
+          f' quotes/s')
+    print(f'handle_message  {measure(service.handle_message, messages):12,.0f} quotes/s')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import argparse
+import datetime
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import configuration
+import json_backend
+from amtclient.service import QuoteServiceClient
+from model import Model, Entity
+from repository import DBRepository
+from .frames import QuoteFrameGenerator, load_configuration, symbols
+
+
+class NullOutput:
+
+    def write(self, entity):
+        pass
+
+
+def percentile(sorted_values, ratio):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * ratio))]
+
+
+def measure(operation, inputs, units_per_input=1):
+    gc.collect()
+    latencies = []
+    clock = time.perf_counter_ns
+    for value in inputs:
+        start = clock()
+        operation(value)
+        latencies.append(clock() - start)
+    elapsed = sum(latencies) / 1e9
+    latencies.sort()
+
+    sample = inputs[:min(len(inputs), 500)]
+    retained = [operation(value) for value in sample]
+    retained.clear()
+    gc.collect()
+    gc.disable()
+    blocks = sys.getallocatedblocks()
+    for value in sample:
+        retained.append(operation(value))
+    blocks = sys.getallocatedblocks() - blocks
+    gc.enable()
+
+    tracemalloc.start()
+    peak = 0
+    for value in sample:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        operation(value)
+        peak += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    return {
+        'ops_per_s': round(len(inputs) / elapsed),
+        'msgs_per_s': round(len(inputs) * units_per_input / elapsed),
+        'p50_us': round(percentile(latencies, 0.50) / 1000, 2),
+        'p99_us': round(percentile(latencies, 0.99) / 1000, 2),
+        'retained_blocks_per_op': round(blocks / len(sample), 1),
+        'peak_bytes_per_op': round(peak / len(sample))
+    }
+
+
+def run(args):
+    config = load_configuration(args.config)
+    configuration.configuration = config
+    mappings = json.loads(config['QUOTE']['service_field_mappings'])
+    generator = QuoteFrameGenerator(mappings, symbols(args.symbols), args.quotes_per_frame,
+                                    seed=args.seed)
+    frames = generator.frames(args.frames)
+    elements = [element for frame in frames for element in json.loads(frame)['data'][0]['content']]
+    for element in elements:
+        element['timestamp'] = generator.timestamp
+        element['formated_timestamp'] = '2020-05-30 17:00:46.764000'
+
+    service = QuoteServiceClient({}, NullOutput())
+    entities = [Entity(Model.QUOTE, element, mappings) for element in elements]
+    json_lines = [entity.to_json() for entity in entities]
+    repository = DBRepository(None)
+    repository_mappings = repository._get_field_mappings(Model.QUOTE)
+
+    return {
+        'handle_message': measure(service.handle_message, frames, args.quotes_per_frame),
+        'entity_construction': measure(lambda element: Entity(Model.QUOTE, element, mappings),
+                                       elements),
+        'to_json': measure(Entity.to_json, entities),
+        'from_json': measure(Entity.from_json, json_lines),
+        'filter_model_fields': measure(lambda entity: entity.filter_model_fields(
+            repository_mappings), entities),
+        'get_insert_statement': measure(repository._get_insert_statement, entities)
+    }
+
+
+def compare(baseline, results):
+    print(f'\n{"case":22} {"metric":18} {"baseline":>12} {"current":>12} {"change":>8}')
+    for case, metrics in results.items():
+        for metric, value in metrics.items():
+            previous = baseline['results'].get(case, {}).get(metric)
+            if previous is None:
+                continue
+            change = (value - previous) / previous * 100 if previous else 0.0
+            print(f'{case:22} {metric:18} {previous:12,.2f} {value:12,.2f} {change:+7.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the quote hot path")
+    parser.add_argument('--config', default='config.ini.template',
+                        help="configuration file with the QUOTE field mappings")
+    parser.add_argument('--symbols', type=int, default=500)
+    parser.add_argument('--quotes-per-frame', type=int, default=20)
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="file to save the results as a json baseline")
+    parser.add_argument('--baseline', help="json baseline to compare the results with")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(f'{"case":22} {"ops/s":>12} {"msgs/s":>12} {"p50 us":>9} {"p99 us":>9} '
+          f'{"kept blk/op":>11} {"peak B/op":>10}')
+    for case, metrics in results.items():
+        print(f'{case:22} {metrics["ops_per_s"]:12,} {metrics["msgs_per_s"]:12,} '
+              f'{metrics["p50_us"]:9.2f} {metrics["p99_us"]:9.2f} '
+              f'{metrics["retained_blocks_per_op"]:11.1f} {metrics["peak_bytes_per_op"]:10,}')
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            compare(json.load(baseline_file), results)
+
+    if args.output:
+        baseline = {
+            'created_on': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'json_backend': json_backend.name,
+            'parameters': {'symbols': args.symbols, 'quotes_per_frame': args.quotes_per_frame,
+                           'frames': args.frames, 'seed': args.seed},
+            'results': results
+        }
+        with open(args.output, 'w') as output_file:
+            json.dump(baseline, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
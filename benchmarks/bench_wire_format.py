@@ -0,0 +1,56 @@
+import argparse
+import io
+import json
+import time
+from model import Model, Entity
+from model.codec import get_writer, get_reader
+from .frames import QuoteFrameGenerator, load_configuration, symbols
+
+
+def generate_quotes(count, symbols_count, config):
+    mappings = json.loads(config['QUOTE']['service_field_mappings'])
+    generator = QuoteFrameGenerator(mappings, symbols(symbols_count))
+    quotes = []
+    for _ in range(count):
+        element = generator.element(generator.random.choice(generator.symbols))
+        element['timestamp'] = generator.timestamp
+        element['formated_timestamp'] = '2020-05-30 17:00:46.764000'
+        quotes.append(Entity(Model.QUOTE, element, mappings))
+    return quotes
+
+
+def measure(wire_format, quotes):
+    stream = io.BytesIO() if wire_format == 'binary' else io.StringIO()
+    writer = get_writer(wire_format, stream)
+    start = time.perf_counter()
+    for quote in quotes:
+        writer.write(quote)
+    encode_time = time.perf_counter() - start
+    size = len(stream.getvalue())
+
+    stream.seek(0)
+    start = time.perf_counter()
+    decoded = sum(1 for _ in get_reader(wire_format, stream))
+    decode_time = time.perf_counter() - start
+    assert decoded == len(quotes)
+    return encode_time, decode_time, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the json and binary wire formats")
+    parser.add_argument('--config', default='config.ini.template',
+                        help="configuration file with the QUOTE field mappings")
+    parser.add_argument('--quotes', type=int, default=100000)
+    parser.add_argument('--symbols', type=int, default=300)
+    args = parser.parse_args()
+
+    quotes = generate_quotes(args.quotes, args.symbols, load_configuration(args.config))
+    print(f'{"format":8} {"encode msg/s":>14} {"decode msg/s":>14} {"bytes/msg":>10}')
+    for wire_format in ['json', 'binary']:
+        encode_time, decode_time, size = measure(wire_format, quotes)
+        print(f'{wire_format:8} {len(quotes) / encode_time:14,.0f} '
+              f'{len(quotes) / decode_time:14,.0f} {size / len(quotes):10.1f}')
+
+
+if __name__ == "__main__":
+    main()
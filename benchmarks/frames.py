@@ -0,0 +1,62 @@
+import configparser
+import json
+import random
+
+TEMPLATE_CONFIG = 'config.ini.template'
+
+
+def load_configuration(path=TEMPLATE_CONFIG):
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        raise FileNotFoundError(path)
+    return config
+
+
+def symbols(count):
+    return [f'SYM{i}' for i in range(count)]
+
+
+class QuoteFrameGenerator:
+
+    def __init__(self, service_field_mappings, symbols_, quotes_per_frame=20,
+                 partial_ratio=0.7, seed=1):
+        self.mappings = service_field_mappings
+        self.symbols = symbols_
+        self.quotes_per_frame = quotes_per_frame
+        self.partial_ratio = partial_ratio
+        self.random = random.Random(seed)
+        self.timestamp = 1590872446764
+
+    def _value(self, field):
+        if field.endswith('_price') or field == 'nav':
+            return round(self.random.uniform(5, 500), 2)
+        if field.endswith('_id'):
+            return self.random.choice('PQKDNZ')
+        if field.endswith('_time'):
+            return self.random.randint(0, 86399)
+        if field == 'total_volume':
+            return self.random.randint(1000, 90000000)
+        if field.endswith('_size'):
+            return self.random.randint(1, 500)
+        return self.random.choice(self.symbols)
+
+    def element(self, symbol):
+        field_ids = list(self.mappings)
+        if self.random.random() < self.partial_ratio:
+            field_ids = self.random.sample(field_ids, self.random.randint(1, 4))
+        element = {field_id: self._value(self.mappings[field_id]) for field_id in field_ids}
+        element.update({"key": symbol, "delayed": False, "assetMainType": "EQUITY"})
+        return element
+
+    def content(self):
+        return [self.element(symbol)
+                for symbol in self.random.sample(self.symbols,
+                                                     min(self.quotes_per_frame, len(self.symbols)))]
+
+    def frame(self):
+        self.timestamp += self.random.randint(1, 250)
+        return json.dumps({"data": [{"service": "QUOTE", "timestamp": self.timestamp,
+                                     "command": "SUBS", "content": self.content()}]})
+
+    def frames(self, count):
+        return [self.frame() for _ in range(count)]
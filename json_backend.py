@@ -0,0 +1,16 @@
+import json
+
+try:
+    import orjson
+
+    name = 'orjson'
+    loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+
+        name = 'ujson'
+        loads = ujson.loads
+    except ImportError:
+        name = 'json'
+        loads = json.loads
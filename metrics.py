@@ -0,0 +1,199 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('metrics')
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, self.value
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def get(self):
+        return self.value if self.function is None else self.function()
+
+    def samples(self):
+        yield self.name, self.get()
+
+    def snapshot(self):
+        return self.get()
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{bound}"}}', cumulative
+        yield f'{self.name}_bucket{{le="+Inf"}}', self.count
+        yield f'{self.name}_sum', self.sum
+        yield f'{self.name}_count', self.count
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': round(self.sum, 6), 'p50': self.quantile(0.5),
+                'p99': self.quantile(0.99)}
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args):
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self.metrics.get(name)
+                if metric is None:
+                    metric = self.metrics[name] = cls(name, *args)
+        return metric
+
+    def counter(self, name, description):
+        return self._get(Counter, name, description)
+
+    def gauge(self, name, description):
+        return self._get(Gauge, name, description)
+
+    def histogram(self, name, description, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, description, buckets)
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name} {value}' for name, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in list(self.metrics.items())}
+
+
+registry = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host='127.0.0.1', metrics_registry=registry):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.registry = metrics_registry
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+class LogReporter:
+
+    def __init__(self, interval, metrics_registry=registry, clock=time.monotonic):
+        self.interval = interval
+        self.registry = metrics_registry
+        self.clock = clock
+        self._previous = None
+        self._stopped = threading.Event()
+
+    def report(self):
+        now = self.clock()
+        snapshot = self.registry.snapshot()
+        rates = {}
+        if self._previous is not None:
+            previous_time, previous = self._previous
+            elapsed = now - previous_time
+            for name, value in snapshot.items():
+                if self.registry.metrics[name].kind == 'counter' and elapsed > 0:
+                    rates[name] = round((value - previous.get(name, 0)) / elapsed, 3)
+        self._previous = now, snapshot
+        logger.info("%s", json.dumps({'metrics': snapshot, 'rates': rates}))
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.report()
+
+    def start(self):
+        threading.Thread(target=self._run, name='metrics-log', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start_reporting(config):
+    port = config.getint('http_port', 0)
+    if port:
+        start_http_server(port, config.get('http_host', '127.0.0.1'))
+    interval = config.getfloat('log_interval', 0)
+    if interval > 0:
+        logger.setLevel(logging.INFO)
+        LogReporter(interval).start()
@@ -1 +1,3 @@
-from .entity import Model, Entity, EntityException
+from .entity import Model, Entity, EntityException, Schema
+from .batch import EntityBatch
+from .state import LatestStateStore
@@ -0,0 +1,86 @@
+import array
+from itertools import zip_longest
+from .entity import Entity, EntityException, MISSING, schemas
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class EntityBatch:
+    __slots__ = ('model', 'fields', 'columns', 'masks', 'size')
+
+    def __init__(self, model, fields, columns, masks, size):
+        self.model = model
+        self.fields = fields
+        self.columns = columns
+        self.masks = masks
+        self.size = size
+
+    @classmethod
+    def from_entities(cls, model, entities):
+        schema = schemas[model]
+        rows = [entity.values for entity in entities]
+        fields, columns, masks = [], [], []
+        for field, values in zip(schema.fields, zip_longest(*rows, fillvalue=MISSING)):
+            mask = bytearray(value is not MISSING for value in values)
+            if any(mask):
+                fields.append(field)
+                columns.append(cls._column(values, mask))
+                masks.append(mask)
+        return cls(model, fields, columns, masks, len(rows))
+
+    @staticmethod
+    def _column(values, mask):
+        types = {type(value) for value, present in zip(values, mask) if present}
+        if types <= {int}:
+            typecode = 'q'
+        elif types <= {int, float}:
+            typecode = 'd'
+        else:
+            return list(values)
+        try:
+            return array.array(typecode, [value if present else 0
+                                          for value, present in zip(values, mask)])
+        except OverflowError:
+            return list(values)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        schema = schemas[self.model]
+        slots = [schema.slot(field) for field in self.fields]
+        for row in range(self.size):
+            values = [MISSING] * len(schema)
+            for slot, column, mask in zip(slots, self.columns, self.masks):
+                if mask[row]:
+                    values[slot] = column[row]
+            yield Entity.from_slots(self.model, values)
+
+    def _index(self, field):
+        try:
+            return self.fields.index(field)
+        except ValueError:
+            raise KeyError(field)
+
+    def column(self, field):
+        index = self._index(field)
+        return self.columns[index], self.masks[index]
+
+    def values(self, field):
+        column, mask = self.column(field)
+        return [value if present else None for value, present in zip(column, mask)]
+
+    def to_numpy(self, field):
+        if numpy is None:
+            raise EntityException('numpy is required to get the batch columns as arrays')
+        column, mask = self.column(field)
+        missing = ~numpy.frombuffer(mask, dtype=numpy.bool_)
+        if isinstance(column, array.array):
+            data = numpy.frombuffer(column, dtype=numpy.dtype(column.typecode))
+        else:
+            data = numpy.array([None if value is MISSING else value for value in column],
+                               dtype=object)
+        return numpy.ma.MaskedArray(data, mask=missing)
@@ -0,0 +1,256 @@
+import json
+import logging
+import operator
+import struct
+import sys
+from .entity import Model, Entity, MISSING, schemas
+
+
+class CodecException(Exception):
+    pass
+
+
+MAGIC = b'QSB\x01'
+FRAME_HEADER = struct.Struct('<cI')
+SCHEMA_FRAME = b'S'
+LAYOUT_FRAME = b'L'
+RECORD_FRAME = b'R'
+LAYOUT_ID = struct.Struct('<H')
+VAR_LENGTH = struct.Struct('<H')
+MAX_LAYOUTS = 1 << 16
+
+_fixed_codes = {float: 'd', int: 'q', bool: '?'}
+_model_ids = {model: i for i, model in enumerate(Model)}
+_models = list(Model)
+
+
+def _getter(slots):
+    if not slots:
+        return lambda values: ()
+    if len(slots) == 1:
+        slot = slots[0]
+        return lambda values: (values[slot],)
+    return operator.itemgetter(*slots)
+
+
+class JsonLinesWriter:
+
+    def __init__(self, stream=None):
+        self.stream = sys.stdout if stream is None else stream
+        self.auto_flush = True
+
+    def write(self, entity):
+        print(entity.to_json(), file=self.stream, flush=self.auto_flush)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class JsonLinesReader:
+
+    def __init__(self, stream=None):
+        self.stream = sys.stdin if stream is None else stream
+
+    def __iter__(self):
+        for message in self.stream:
+            yield Entity.from_json(message)
+
+
+class BinaryWriter:
+
+    def __init__(self, stream=None):
+        self.stream = sys.stdout.buffer if stream is None else stream
+        self.auto_flush = True
+        self.skipped = 0
+        self._schema_sizes = {}
+        self._layouts = {}
+        self._header_written = False
+
+    def encode(self, entity):
+        frames = [] if self._header_written else [MAGIC]
+        schema = entity.schema
+        schema_size = len(schema)
+        if self._schema_sizes.get(entity.model) != schema_size:
+            frames.append(self._schema_frame(entity.model, schema))
+
+        values = entity.values
+        key = (entity.model, tuple(map(type, values)))
+        layout = self._layouts.get(key)
+        new_layout = layout is None
+        if new_layout:
+            layout = self._new_layout(key, values, frames)
+        layout_id, fixed, get_fixed, variable = layout
+        try:
+            record = [LAYOUT_ID.pack(layout_id), fixed.pack(*get_fixed(values))]
+            for slot in variable:
+                value = values[slot]
+                data = (value if type(value) is str else json.dumps(value)).encode()
+                record.append(VAR_LENGTH.pack(len(data)))
+                record.append(data)
+        except struct.error as e:
+            raise CodecException(f'Cannot encode entity {entity.model.name}: {e}')
+        frames.append(self._frame(RECORD_FRAME, b''.join(record)))
+        self._header_written = True
+        self._schema_sizes[entity.model] = schema_size
+        if new_layout:
+            if len(self._layouts) >= MAX_LAYOUTS:
+                self._layouts = {}
+            self._layouts[key] = layout
+        return b''.join(frames)
+
+    def write(self, entity):
+        try:
+            data = self.encode(entity)
+        except CodecException as e:
+            self.skipped += 1
+            logging.warning("Skipping entity %s: %s", entity.get('key'), e)
+            return
+        self.stream.write(data)
+        if self.auto_flush:
+            self.stream.flush()
+
+    def flush(self):
+        self.stream.flush()
+
+    @staticmethod
+    def _frame(kind, payload):
+        return FRAME_HEADER.pack(kind, len(payload)) + payload
+
+    def _schema_frame(self, model, schema):
+        header = {'model': model.name, 'fields': schema.fields}
+        return self._frame(SCHEMA_FRAME, json.dumps(header).encode())
+
+    def _new_layout(self, key, values, frames):
+        layout_id = len(self._layouts) % MAX_LAYOUTS
+        model, types = key
+        fixed_slots, variable_slots, none_slots = [], [], []
+        for slot, type_ in enumerate(types):
+            if type_ in _fixed_codes:
+                fixed_slots.append(slot)
+            elif values[slot] is None:
+                none_slots.append(slot)
+            elif values[slot] is not MISSING:
+                variable_slots.append(slot)
+        fixed_format = '<' + ''.join(_fixed_codes[types[slot]] for slot in fixed_slots)
+        header = {
+            'id': layout_id,
+            'model': model.name,
+            'format': fixed_format,
+            'fixed': fixed_slots,
+            'variable': [[slot, 's' if types[slot] is str else 'j'] for slot in variable_slots],
+            'none': none_slots
+        }
+        frames.append(self._frame(LAYOUT_FRAME, json.dumps(header).encode()))
+        return layout_id, struct.Struct(fixed_format), _getter(fixed_slots), variable_slots
+
+
+class BinaryReader:
+    BUFFER_SIZE = 1 << 20
+
+    def __init__(self, stream=None):
+        self.stream = sys.stdin.buffer if stream is None else stream
+        self._slots = {}
+        self._layouts = {}
+
+    def _read_into(self, view):
+        read = getattr(self.stream, 'readinto1', None) or self.stream.readinto
+        return read(view)
+
+    def __iter__(self):
+        buffer = bytearray(self.BUFFER_SIZE)
+        view = memoryview(buffer)
+        start = end = 0
+        magic_checked = False
+        while True:
+            read = self._read_into(view[end:])
+            if not read:
+                break
+            end += read
+            if not magic_checked:
+                if end < len(MAGIC):
+                    continue
+                if buffer[:len(MAGIC)] != MAGIC:
+                    raise CodecException('Invalid binary stream header')
+                start = len(MAGIC)
+                magic_checked = True
+
+            while end - start >= FRAME_HEADER.size:
+                kind, length = FRAME_HEADER.unpack_from(buffer, start)
+                payload_end = start + FRAME_HEADER.size + length
+                if payload_end > end:
+                    break
+                payload = view[start + FRAME_HEADER.size:payload_end]
+                if kind == RECORD_FRAME:
+                    yield self._decode_record(payload)
+                elif kind == LAYOUT_FRAME:
+                    self._add_layout(json.loads(str(payload, 'utf-8')))
+                elif kind == SCHEMA_FRAME:
+                    self._add_schema(json.loads(str(payload, 'utf-8')))
+                else:
+                    raise CodecException(f'Invalid frame type {kind}')
+                start = payload_end
+
+            pending = end - start
+            if start:
+                buffer[:pending] = buffer[start:end]
+                start, end = 0, pending
+            if pending >= FRAME_HEADER.size:
+                frame_size = FRAME_HEADER.size + FRAME_HEADER.unpack_from(buffer, 0)[1]
+                if frame_size > len(buffer):
+                    grown = bytearray(frame_size)
+                    grown[:pending] = buffer[:pending]
+                    buffer, view = grown, memoryview(grown)
+
+        if end - start:
+            raise CodecException('Truncated binary stream')
+
+    def _add_schema(self, header):
+        model = Model[header['model']]
+        schema = schemas[model]
+        self._slots[model] = [schema.slot(field) for field in header['fields']]
+
+    def _add_layout(self, header):
+        model = Model[header['model']]
+        slots = self._slots[model]
+        self._layouts[header['id']] = (
+            model,
+            struct.Struct(header['format']),
+            [slots[slot] for slot in header['fixed']],
+            [(slots[slot], kind) for slot, kind in header['variable']],
+            [slots[slot] for slot in header['none']]
+        )
+
+    def _decode_record(self, payload):
+        layout_id, = LAYOUT_ID.unpack_from(payload)
+        model, fixed, fixed_slots, variable_slots, none_slots = self._layouts[layout_id]
+        values = [MISSING] * len(schemas[model])
+        for slot, value in zip(fixed_slots, fixed.unpack_from(payload, LAYOUT_ID.size)):
+            values[slot] = value
+        offset = LAYOUT_ID.size + fixed.size
+        for slot, kind in variable_slots:
+            length, = VAR_LENGTH.unpack_from(payload, offset)
+            offset += VAR_LENGTH.size
+            value = str(payload[offset:offset + length], 'utf-8')
+            values[slot] = value if kind == 's' else json.loads(value)
+            offset += length
+        for slot in none_slots:
+            values[slot] = None
+        return Entity.from_slots(model, values)
+
+
+writers = {'json': JsonLinesWriter, 'binary': BinaryWriter}
+readers = {'json': JsonLinesReader, 'binary': BinaryReader}
+
+
+def get_writer(wire_format, stream=None):
+    try:
+        return writers[wire_format](stream)
+    except KeyError:
+        raise CodecException(f'Wire format {wire_format} not supported')
+
+
+def get_reader(wire_format, stream=None):
+    try:
+        return readers[wire_format](stream)
+    except KeyError:
+        raise CodecException(f'Wire format {wire_format} not supported')
@@ -1,4 +1,5 @@
 import json
+import threading
 from enum import Enum
 
 
@@ -19,38 +20,147 @@ class EntityException(Exception):
     pass
 
 
+MISSING = object()
+
+
+class Schema:
+    MAX_TRANSLATORS = 64
+
+    def __init__(self, model):
+        self.model = model
+        self.fields = []
+        self.index = {}
+        self._model_fields = models[model]['fields']
+        self._translators = {}
+        self._projections = {}
+        self._lock = threading.Lock()
+        for field in self._model_fields:
+            self._add_field(field)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def _add_field(self, field):
+        self.index[field] = len(self.fields)
+        self.fields.append(field)
+        self._projections = {}
+
+    def slot(self, field):
+        slot = self.index.get(field)
+        if slot is None:
+            with self._lock:
+                slot = self.index.get(field)
+                if slot is None:
+                    slot = len(self.fields)
+                    self._add_field(field)
+        return slot
+
+    def translator(self, field_mappings):
+        key = id(field_mappings)
+        cached = self._translators.get(key)
+        if cached is None:
+            if len(self._translators) >= self.MAX_TRANSLATORS:
+                self._translators = {}
+            cached = self._translators[key] = (field_mappings, {})
+        return cached[1]
+
+    def translate(self, translator, field, field_mappings):
+        slot = translator.get(field)
+        if slot is None:
+            mapped = field_mappings[field] if field in field_mappings else field
+            slot = translator[field] = self.slot(mapped)
+        return slot
+
+    def projection(self, field_mappings=None):
+        key = None if field_mappings is None else tuple(field_mappings.items())
+        projection = self._projections.get(key)
+        if projection is None:
+            projection = self._projections[key] = self._build_projection(field_mappings)
+        return projection
+
+    def _build_projection(self, field_mappings):
+        sources = {}
+        for slot, field in enumerate(self.fields):
+            column = field_mappings.get(field, field) if field_mappings else field
+            sources.setdefault(column, []).append(slot)
+        return tuple((column, tuple(sources[column]))
+                     for column in self._model_fields if column in sources)
+
+
+schemas = {model: Schema(model) for model in Model}
+
+
 class Entity:
+    __slots__ = ('model', 'schema', 'values')
     MODEL_FIELD = 'model'
+    SYMBOL_FIELDS = ('key', 'symbol')
 
     def __init__(self, model, fields_values, field_mappings=None):
         self.model = model
-        self.fields_values = self._from_mappings(fields_values, field_mappings)
-
-    @classmethod
-    def _from_mappings(cls, fields_values, field_mappings):
-        fields = {cls._from_mapping(field, field_mappings): value
-                  for field, value in fields_values.items()}
-        return fields
+        self.schema = schemas[model]
+        self.values = self._from_mappings(self.schema, fields_values, field_mappings)
 
-    @classmethod
-    def _from_mapping(cls, field, field_mappings):
+    @staticmethod
+    def _from_mappings(schema, fields_values, field_mappings):
         if field_mappings is None:
-            return field
-        return field_mappings[field] if field in field_mappings else field
-
-    def _model_fields(self):
-        return models[self.model]['fields']
+            slots = [schema.slot(field) for field in fields_values]
+        else:
+            translator = schema.translator(field_mappings)
+            slots = [schema.translate(translator, field, field_mappings)
+                     for field in fields_values]
+        values = [MISSING] * len(schema)
+        for slot, value in zip(slots, fields_values.values()):
+            values[slot] = value
+        return values
 
-    def filter_model_fields(self, field_mappings=None):
+    @classmethod
+    def from_slots(cls, model, values):
+        entity = cls.__new__(cls)
+        entity.model = model
+        entity.schema = schemas[model]
+        entity.values = values
+        return entity
+
+    @property
+    def fields_values(self):
+        return dict(self.items())
+
+    def items(self):
+        return ((field, value) for field, value in zip(self.schema.fields, self.values)
+                if value is not MISSING)
+
+    def _value(self, slot):
+        if slot is None or slot >= len(self.values):
+            return MISSING
+        return self.values[slot]
+
+    def get(self, field, default=None):
+        value = self._value(self.schema.index.get(field))
+        return default if value is MISSING else value
+
+    def symbol(self):
+        for field in self.SYMBOL_FIELDS:
+            value = self.get(field)
+            if value is not None:
+                return value
+        return None
+
+    def project(self, projection):
         model_fields = {}
-        for field, value in self.fields_values.items():
-            field = self._from_mapping(field, field_mappings)
-            if field in self._model_fields():
-                model_fields[field] = value
+        for column, slots in projection:
+            for slot in slots:
+                value = self._value(slot)
+                if value is not MISSING:
+                    model_fields[column] = value
+                    break
         return model_fields
 
+    def filter_model_fields(self, field_mappings=None):
+        return self.project(self.schema.projection(field_mappings))
+
     def to_json(self):
-        fields = dict(item for item in self.fields_values.items())
+        fields = {field: value for field, value in zip(self.schema.fields, self.values)
+                  if value is not MISSING}
         fields[self.MODEL_FIELD] = self.model.name
         return json.dumps(fields)
 
@@ -65,5 +175,11 @@ class Entity:
                 f'Invalid json message to build the entity. The "{cls.MODEL_FIELD}" field '
                 f'must included and with a valid type')
 
+    def __contains__(self, field):
+        return self._value(self.schema.index.get(field)) is not MISSING
+
     def __getitem__(self, field):
-        return self.fields_values[field]
+        value = self._value(self.schema.index.get(field))
+        if value is MISSING:
+            raise KeyError(field)
+        return value
@@ -0,0 +1,44 @@
+from .entity import Entity, MISSING, schemas
+
+
+class LatestStateStore:
+
+    def __init__(self, model):
+        self.model = model
+        self.schema = schemas[model]
+        self.updates = 0
+        self._index = {}
+        self._states = []
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def update(self, entity):
+        key = entity.symbol()
+        if key is None:
+            return entity
+        index = self._index.get(key)
+        if index is None:
+            index = self._index[key] = len(self._states)
+            self._states.append([MISSING] * len(self.schema))
+        state = self._states[index]
+        values = entity.values
+        if len(state) < len(values):
+            state.extend([MISSING] * (len(values) - len(state)))
+        for slot, value in enumerate(values):
+            if value is not MISSING:
+                state[slot] = value
+        self.updates += 1
+        return Entity.from_slots(self.model, list(state))
+
+    def get(self, key):
+        index = self._index.get(key)
+        if index is None:
+            return None
+        return Entity.from_slots(self.model, list(self._states[index]))
+
+    def keys(self):
+        return list(self._index)
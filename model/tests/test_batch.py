@@ -0,0 +1,51 @@
+import array
+import pytest
+
+from model import Model, Entity, EntityBatch
+from model.batch import numpy
+
+
+@pytest.fixture()
+def quotes():
+    return [
+        Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 183.7, "bid_size": 8, "ask_id": "P"}),
+        Entity(Model.QUOTE, {"key": "GGAL", "bid_price": 8, "total_volume": 14391807}),
+        Entity(Model.QUOTE, {"key": "QQQ", "ask_id": None})
+    ]
+
+
+def test_batch_has_one_column_per_present_field(quotes):
+    batch = EntityBatch.from_entities(Model.QUOTE, quotes)
+    assert len(batch) == 3
+    assert set(batch.fields) == {"key", "bid_price", "bid_size", "ask_id", "total_volume"}
+
+
+def test_batch_stores_numeric_fields_in_typed_arrays_with_null_masks(quotes):
+    batch = EntityBatch.from_entities(Model.QUOTE, quotes)
+    bid_price, bid_price_mask = batch.column("bid_price")
+    assert isinstance(bid_price, array.array) and bid_price.typecode == 'd'
+    assert list(bid_price_mask) == [1, 1, 0]
+    bid_size, _ = batch.column("bid_size")
+    assert isinstance(bid_size, array.array) and bid_size.typecode == 'q'
+    assert batch.values("bid_price") == [183.7, 8.0, None]
+    assert batch.values("key") == ["MSFT", "GGAL", "QQQ"]
+
+
+def test_batch_iterates_the_original_entities(quotes):
+    batch = EntityBatch.from_entities(Model.QUOTE, quotes)
+    assert [entity.fields_values for entity in batch] == \
+           [entity.fields_values for entity in quotes]
+
+
+def test_batch_column_throws_error_if_field_not_present(quotes):
+    batch = EntityBatch.from_entities(Model.QUOTE, quotes)
+    with pytest.raises(KeyError):
+        batch.column("nav")
+
+
+@pytest.mark.skipif(numpy is None, reason="numpy not installed")
+def test_batch_numeric_columns_as_masked_numpy_arrays(quotes):
+    batch = EntityBatch.from_entities(Model.QUOTE, quotes)
+    bid_price = batch.to_numpy("bid_price")
+    assert list(bid_price.mask) == [False, False, True]
+    assert bid_price[0] == 183.7
@@ -0,0 +1,99 @@
+import io
+import json
+import pytest
+
+from model import Model, Entity
+from model.codec import BinaryWriter, BinaryReader, JsonLinesWriter, JsonLinesReader, \
+    CodecException, get_writer, get_reader
+
+
+@pytest.fixture()
+def quotes():
+    return [
+        Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 183.7, "bid_size": 8, "delayed": False,
+                             "ask_id": None, "timestamp": 1590872446764}),
+        Entity(Model.QUOTE, {"key": "GGAL", "ask_price": 8.55, "cusip": "399909100",
+                             "extra": {"nested": [1, 2]}}),
+        Entity(Model.QUOTE, {"key": "QQQ", "bid_price": 230.1, "bid_size": 2, "delayed": True,
+                             "ask_id": None, "timestamp": 1590872446765})
+    ]
+
+
+def encode(entities, writer_class):
+    stream = io.BytesIO() if writer_class is BinaryWriter else io.StringIO()
+    writer = writer_class(stream)
+    for entity in entities:
+        writer.write(entity)
+    stream.seek(0)
+    return stream
+
+
+def test_binary_reader_decodes_what_binary_writer_encodes(quotes):
+    stream = encode(quotes, BinaryWriter)
+    decoded = list(BinaryReader(stream))
+    assert [entity.fields_values for entity in decoded] == \
+           [entity.fields_values for entity in quotes]
+    assert all(entity.model == Model.QUOTE for entity in decoded)
+
+
+def test_binary_writer_sends_schema_and_layout_once(quotes):
+    stream = encode(quotes + quotes, BinaryWriter)
+    data = stream.getvalue()
+    assert data.count(b'"fields"') == 1
+    assert data.count(b'"format"') == 2
+
+
+def test_binary_reader_handles_frames_split_across_reads(quotes):
+    stream = encode(quotes * 10, BinaryWriter)
+    reader = BinaryReader(io.BufferedReader(stream, buffer_size=7))
+    reader.BUFFER_SIZE = 16
+    decoded = list(reader)
+    assert len(decoded) == 30
+    assert decoded[-1]['key'] == "QQQ"
+    assert decoded[-1]['bid_price'] == 230.1
+
+
+def test_binary_reader_throws_error_on_invalid_header():
+    with pytest.raises(CodecException):
+        list(BinaryReader(io.BytesIO(b'{"model": "QUOTE"}\n')))
+
+
+def test_binary_reader_throws_error_on_truncated_stream(quotes):
+    data = encode(quotes, BinaryWriter).getvalue()
+    with pytest.raises(CodecException):
+        list(BinaryReader(io.BytesIO(data[:-3])))
+
+
+def test_json_lines_writer_writes_one_entity_per_line(quotes):
+    stream = encode(quotes, JsonLinesWriter)
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[0])['model'] == 'QUOTE'
+    assert [entity['key'] for entity in JsonLinesReader(io.StringIO(stream.getvalue()))] == \
+           ["MSFT", "GGAL", "QQQ"]
+
+
+def test_get_writer_and_reader_throw_error_if_format_not_supported():
+    with pytest.raises(CodecException):
+        get_writer('xml')
+    with pytest.raises(CodecException):
+        get_reader('xml')
+
+
+def test_binary_writer_skips_entities_it_cannot_encode(quotes):
+    stream = io.BytesIO()
+    writer = BinaryWriter(stream)
+    writer.write(Entity(Model.QUOTE, {"key": "BAD", "bid_size": 1 << 70}))
+    for entity in quotes:
+        writer.write(entity)
+    writer.write(Entity(Model.QUOTE, {"key": "BAD", "bid_size": 1 << 70}))
+    assert writer.skipped == 2
+    stream.seek(0)
+    assert [entity['key'] for entity in BinaryReader(stream)] == ["MSFT", "GGAL", "QQQ"]
+
+
+def test_binary_writer_encode_throws_error_and_keeps_its_state(quotes):
+    writer = BinaryWriter(io.BytesIO())
+    with pytest.raises(CodecException):
+        writer.encode(Entity(Model.QUOTE, {"key": "BAD", "bid_size": 1 << 70}))
+    assert writer.encode(quotes[0]).startswith(b'QSB\x01')
@@ -64,3 +64,49 @@ def test_entity_filter_model_fields_applies_mapping_before_filtering():
     assert filtered_fields['symbol'] == "QQQ"
     assert filtered_fields['last_id'] == 1200
     assert filtered_fields['ask_id'] == 1234
+
+
+def test_entity_stores_values_in_schema_slot_order():
+    fields = {"ask_price": 2.5, "symbol": "QQQ"}
+    entity = Entity(Model.QUOTE, fields)
+    assert entity.schema.fields[:4] == ['symbol', 'quote_timestamp', 'bid_price', 'ask_price']
+    assert entity.values[entity.schema.index['symbol']] == "QQQ"
+    assert entity.values[entity.schema.index['ask_price']] == 2.5
+    assert entity.fields_values == {"symbol": "QQQ", "ask_price": 2.5}
+
+
+def test_entity_created_before_schema_growth_still_supports_new_fields():
+    entity = Entity(Model.QUOTE, {"symbol": "QQQ"})
+    Entity(Model.QUOTE, {"symbol": "SPY", "a_new_field": 1})
+    assert 'a_new_field' not in entity
+    assert entity.get('a_new_field') is None
+    with pytest.raises(KeyError):
+        entity['a_new_field']
+
+
+def test_entity_get_and_contains():
+    entity = Entity(Model.QUOTE, {"symbol": "QQQ", "bid_price": None})
+    assert 'bid_price' in entity
+    assert 'ask_price' not in entity
+    assert entity.get('symbol') == "QQQ"
+    assert entity.get('ask_price', 0) == 0
+
+
+def test_entity_filter_model_fields_returns_fields_in_model_order():
+    fields = {"last_id": 1200, "field1": "QQQ", "bid_price": 1.5}
+    entity = Entity(Model.QUOTE, fields)
+    filtered_fields = entity.filter_model_fields({"field1": "symbol"})
+    assert list(filtered_fields.items()) == [("symbol", "QQQ"), ("bid_price", 1.5),
+                                             ("last_id", 1200)]
+
+
+def test_entity_does_not_allow_arbitrary_attributes():
+    entity = Entity(Model.QUOTE, {"symbol": "QQQ"})
+    with pytest.raises(AttributeError):
+        entity.other = 1
+
+
+def test_entity_symbol_prefers_the_key_field():
+    assert Entity(Model.QUOTE, {"key": "MSFT", "symbol": "QQQ"}).symbol() == "MSFT"
+    assert Entity(Model.QUOTE, {"symbol": "QQQ"}).symbol() == "QQQ"
+    assert Entity(Model.QUOTE, {"bid_price": 1.0}).symbol() is None
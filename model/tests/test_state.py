@@ -0,0 +1,46 @@
+from model import Model, Entity, LatestStateStore
+
+
+def quote(fields):
+    return Entity(Model.QUOTE, fields)
+
+
+def test_latest_state_merges_partial_updates_per_symbol():
+    store = LatestStateStore(Model.QUOTE)
+    store.update(quote({"key": "MSFT", "bid_price": 183.7, "ask_price": 183.9}))
+    store.update(quote({"key": "QQQ", "bid_price": 230.1}))
+    merged = store.update(quote({"key": "MSFT", "ask_price": 184.0, "bid_size": 3}))
+    assert merged.fields_values == {"key": "MSFT", "bid_price": 183.7, "ask_price": 184.0,
+                                    "bid_size": 3}
+    assert store.get("QQQ").fields_values == {"key": "QQQ", "bid_price": 230.1}
+    assert len(store) == 2
+    assert store.updates == 3
+
+
+def test_latest_state_snapshots_are_not_changed_by_later_updates():
+    store = LatestStateStore(Model.QUOTE)
+    first = store.update(quote({"key": "MSFT", "bid_price": 1.0}))
+    store.update(quote({"key": "MSFT", "bid_price": 2.0}))
+    assert first['bid_price'] == 1.0
+    assert store.get("MSFT")['bid_price'] == 2.0
+
+
+def test_latest_state_get_returns_none_for_unknown_symbol():
+    store = LatestStateStore(Model.QUOTE)
+    assert store.get("MSFT") is None
+    assert "MSFT" not in store
+
+
+def test_latest_state_passes_through_entities_without_key():
+    store = LatestStateStore(Model.QUOTE)
+    entity = quote({"bid_price": 1.0})
+    assert store.update(entity) is entity
+    assert len(store) == 0
+
+
+def test_latest_state_supports_fields_added_to_the_schema_later():
+    store = LatestStateStore(Model.QUOTE)
+    store.update(quote({"key": "MSFT", "bid_price": 1.0}))
+    merged = store.update(quote({"key": "MSFT", "a_state_test_field": "x"}))
+    assert merged['a_state_test_field'] == "x"
+    assert merged['bid_price'] == 1.0
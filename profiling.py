@@ -0,0 +1,87 @@
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+PROFILE_ENV = 'QUOTE_STREAMER_PROFILE'
+
+
+class SamplingProfiler:
+
+    def __init__(self, directory='.', interval=0.005, clock=time.monotonic):
+        self.directory = directory
+        self.interval = interval
+        self.clock = clock
+        self.samples = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @staticmethod
+    def _stack(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:'
+                         f'{code.co_firstlineno})')
+            frame = frame.f_back
+        return stack
+
+    def sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = self._stack(frame)
+            stack.append(names.get(ident, str(ident)))
+            key = ';'.join(reversed(stack))
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+    def write(self, path):
+        with open(path, 'w') as collapsed:
+            for stack, count in sorted(self.samples.items()):
+                collapsed.write(f'{stack} {count}\n')
+
+    def _run(self, duration):
+        deadline = self.clock() + duration
+        while self.clock() < deadline:
+            self.sample()
+            time.sleep(self.interval)
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory,
+                            f'profile-{os.getpid()}-{time.strftime("%Y%m%d-%H%M%S")}.folded')
+        self.write(path)
+        logging.warning("Profile of %.1f s written to %s", duration, path)
+
+    def start(self, duration):
+        with self._lock:
+            if self.running:
+                logging.warning("Profiler already running")
+                return False
+            self.samples = {}
+            self._thread = threading.Thread(target=self._run, args=(duration,), name='profiler',
+                                            daemon=True)
+            self._thread.start()
+            return True
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+
+
+def install(config=None, environ=os.environ):
+    config = {} if config is None else config
+    profiler = SamplingProfiler(config.get('directory', '.'),
+                                float(config.get('interval', 0.005)))
+    duration = float(config.get('duration', 30))
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.start(duration))
+    if environ.get(PROFILE_ENV):
+        profiler.start(float(environ[PROFILE_ENV]))
+    return profiler
@@ -1 +1,6 @@
 from .repository import DBRepository, RepositoryException
+from .writer_pool import WriterPoolRepository
+from .segment import SegmentRepository, SegmentFile, read_segments
+from .spool import SpoolingRepository, Spool
+from .ring import TickStore, TickRing, open_tick_ring
+from .factory import create_db_repository, create_segment_repository, create_repository
@@ -0,0 +1,64 @@
+import logging
+import configuration
+from .repository import DBRepository, RepositoryException, logger
+from .segment import SegmentRepository
+from .spool import SpoolingRepository
+from .writer_pool import WriterPoolRepository
+
+
+def create_db_repository(connection_pool):
+    config = configuration.configuration['DATABASE']
+    batch_size = config.getint('batch_size', 1)
+    max_latency = config.getfloat('batch_max_latency', 0) or None
+    prepared_statements = config.getboolean('prepared_statements', False)
+    max_buffer_size = config.getint('max_buffer_size', 100000)
+    workers = config.getint('writer_workers', 1)
+    pool_size = config.getint('pool_size', 5)
+    if workers > 1 and workers >= pool_size:
+        raise RepositoryException(f'writer_workers ({workers}) must be less than pool_size '
+                                  f'({pool_size}), queries need a connection of their own')
+    if config.getboolean('log_flushes', False):
+        logger.setLevel(logging.INFO)
+
+    def repository_factory():
+        return DBRepository(connection_pool, batch_size, max_latency,
+                            prepared_statements=prepared_statements,
+                            hold_connection=workers > 1, max_buffer_size=max_buffer_size)
+
+    if workers <= 1:
+        return repository_factory()
+    return WriterPoolRepository(repository_factory, workers,
+                                config.getint('writer_queue_size', 10000))
+
+
+def create_segment_repository():
+    config = configuration.configuration['SEGMENTS']
+    return SegmentRepository(config['directory'], flush_size=config.getint('flush_size', 10000),
+                             fsync_interval=config.getfloat('fsync_interval', 1.0),
+                             max_open_files=config.getint('max_open_files', 512),
+                             max_latency=config.getfloat('flush_max_latency', 0) or None)
+
+
+def _create_backend_repository():
+    backend = configuration.configuration['DATABASE'].get('repository', 'mysql')
+    if backend == 'segments':
+        return create_segment_repository()
+    if backend != 'mysql':
+        raise RepositoryException(f'Unknown repository {backend}, use mysql or segments')
+    from adapter.database import connection_pool
+    return create_db_repository(connection_pool)
+
+
+def create_repository():
+    repository = _create_backend_repository()
+    if not configuration.configuration.has_section('SPOOL'):
+        return repository
+    config = configuration.configuration['SPOOL']
+    if not config.get('directory'):
+        return repository
+    return SpoolingRepository(repository, config['directory'],
+                              memory_size=config.getint('memory_size', 10000),
+                              batch_size=config.getint('batch_size', 1000),
+                              segment_size=config.getint('segment_size', 64 * 1024 * 1024),
+                              retry_interval=config.getfloat('retry_interval', 1.0),
+                              close_timeout=config.getfloat('close_timeout', 10.0))
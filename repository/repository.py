@@ -1,23 +1,113 @@
 import abc
 import configuration
 import json
+import logging
+import metrics
+import threading
+import time
+from collections import namedtuple
+from itertools import chain
+from model.entity import Entity, Model, models, schemas
+from model.batch import EntityBatch
+
+
+logger = logging.getLogger('repository')
 
 
 class RepositoryException(Exception):
     pass
 
 
+COMMIT_SECONDS = metrics.registry.histogram('quote_streamer_db_commit_seconds',
+                                            'Time to execute and commit a database write')
+ROWS = metrics.registry.counter('quote_streamer_db_rows_total', 'Rows written to the database')
+
+
+FlushStats = namedtuple('FlushStats', ['rows', 'statements', 'elapsed'])
+
+
+class InsertStatement:
+
+    def __init__(self, model, columns):
+        self.columns = columns
+        placeholders = ",".join(['%s'] * len(columns))
+        self._prefix = f'INSERT INTO {model.name} ({",".join(columns)},created_on) VALUES '
+        self._row = f'({placeholders},CURRENT_TIMESTAMP())'
+        self._sql = {}
+
+    def sql(self, rows):
+        sql = self._sql.get(rows)
+        if sql is None:
+            sql = self._sql[rows] = self._prefix + ",".join([self._row] * rows)
+        return sql
+
+    def extract(self, fields_rows):
+        return tuple(value for fields in fields_rows for value in map(fields.get, self.columns))
+
+
+class StatementCache:
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._statements = {}
+
+    def __len__(self):
+        return len(self._statements)
+
+    def get(self, key, build, *args):
+        statement = self._statements.get(key)
+        if statement is not None:
+            self.hits += 1
+            return statement
+        self.misses += 1
+        if len(self._statements) >= self.max_size:
+            self._statements = {}
+        statement = self._statements[key] = build(*args)
+        return statement
+
+
 class AbstractRepository(abc.ABC):
 
     @abc.abstractmethod
     def add(self, entity):
         raise NotImplementedError
 
+    def add_many(self, entities):
+        for entity in entities:
+            self.add(entity)
+
+    def add_batch(self, batch):
+        self.add_many(batch)
+
+    def query(self, symbol, start, end, fields=None):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
 
 class DBRepository(AbstractRepository):
+    MAX_ROWS_PER_STATEMENT = 1000
+    FETCH_SIZE = 1000
 
-    def __init__(self, connection_pool):
+    def __init__(self, connection_pool, batch_size=1, max_latency=None, flush_listener=None,
+                 prepared_statements=False, hold_connection=False, max_buffer_size=100000):
         self.connection_pool = connection_pool
+        self.hold_connection = hold_connection
+        self._connection = None
+        self.prepared_statements = prepared_statements
+        self.statement_cache = StatementCache()
+        self._field_mappings = {}
+        self._projections = {}
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.max_buffer_size = max(max_buffer_size, batch_size)
+        self.flush_listener = self._log_flush if flush_listener is None else flush_listener
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_timer = None
 
     def __enter__(self):
         return self
@@ -26,7 +116,18 @@ class DBRepository(AbstractRepository):
         self.close()
 
     def _get_connection(self):
-        return self.connection_pool.get_connection()
+        if self._connection is not None:
+            return self._connection
+        connection = self.connection_pool.get_connection()
+        if self.hold_connection:
+            self._connection = connection
+        return connection
+
+    def _release_connection(self, connection, discard=False):
+        if connection is None or (connection is self._connection and not discard):
+            return
+        self._connection = None
+        connection.close()
 
     @classmethod
     def _get_field_mappings(cls, model):
@@ -36,27 +137,249 @@ class DBRepository(AbstractRepository):
         except KeyError:
             return None
 
+    def _get_projection(self, model):
+        schema = schemas[model]
+        cached = self._projections.get(model)
+        if cached is None or cached[0] != len(schema):
+            if model not in self._field_mappings:
+                self._field_mappings[model] = self._get_field_mappings(model)
+            projection = schema.projection(self._field_mappings[model])
+            cached = self._projections[model] = (len(schema), projection)
+        return cached[1]
+
+    def _get_statement(self, model, columns):
+        return self.statement_cache.get((model, columns), InsertStatement, model, columns)
+
+    @classmethod
+    def _chunk_sizes(cls, rows):
+        while rows:
+            size = cls.MAX_ROWS_PER_STATEMENT if rows >= cls.MAX_ROWS_PER_STATEMENT else \
+                1 << (rows.bit_length() - 1)
+            yield size
+            rows -= size
+
     def _get_insert_statement(self, entity):
-        fields_to_insert = entity.filter_model_fields(self._get_field_mappings(entity.model))
-        fields_values = list(zip(*fields_to_insert.items()))
-        fields = ",".join(fields_values[0])
-        placeholders = ",".join(['%s'] * len(fields_values[0]))
-        values = fields_values[1]
-        return f'INSERT INTO {entity.model.name} ({fields},created_on) ' \
-               f'VALUES ({placeholders},CURRENT_TIMESTAMP())', values
+        fields = entity.project(self._get_projection(entity.model))
+        statement = self._get_statement(entity.model, tuple(fields))
+        return statement.sql(1), tuple(fields.values())
+
+    def _get_bulk_insert_statements(self, entities_by_model):
+        for model, model_entities in entities_by_model.items():
+            projection = self._get_projection(model)
+            start = 0
+            for size in self._chunk_sizes(len(model_entities)):
+                rows = [entity.project(projection) for entity in model_entities[start:start + size]]
+                start += size
+                present = set().union(*rows)
+                columns = tuple(field for field in models[model]['fields'] if field in present)
+                statement = self._get_statement(model, columns)
+                yield statement.sql(size), statement.extract(rows)
+
+    def _get_batch_insert_statements(self, batch):
+        schema = schemas[batch.model]
+        columns, values = [], []
+        for column, slots in self._get_projection(batch.model):
+            sources = [batch.values(schema.fields[slot]) for slot in slots
+                       if schema.fields[slot] in batch.fields]
+            if sources:
+                columns.append(column)
+                values.append(sources[0] if len(sources) == 1 else
+                              [next((value for value in row if value is not None), None)
+                               for row in zip(*sources)])
+        statement = self._get_statement(batch.model, tuple(columns))
+        rows = list(zip(*values))
+        start = 0
+        for size in self._chunk_sizes(len(rows)):
+            yield statement.sql(size), tuple(chain.from_iterable(rows[start:start + size]))
+            start += size
+
+    def _get_cursor(self, connection):
+        if self.prepared_statements:
+            try:
+                return connection.cursor(prepared=True)
+            except Exception:
+                logging.warning("Prepared statements not available, using plain cursors")
+                self.prepared_statements = False
+        return connection.cursor()
 
     def add(self, entity):
+        if self.batch_size <= 1:
+            self._add(entity)
+            return
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer_size:
+                self._flush_or_retry()
+            self._buffer.append(entity)
+            if len(self._buffer) % self.batch_size == 0:
+                self._flush_or_retry()
+            else:
+                self._schedule_flush()
+
+    def _add(self, entity):
+        connection = cursor = None
+        failed = True
         try:
             insert_stm, args = self._get_insert_statement(entity)
             connection = self._get_connection()
-            cursor = connection.cursor()
+            cursor = self._get_cursor(connection)
+            started = time.perf_counter()
             cursor.execute(insert_stm, args)
             connection.commit()
+            COMMIT_SECONDS.observe(time.perf_counter() - started)
+            ROWS.inc()
+            failed = False
         except Exception:
             raise RepositoryException(f'Error when adding entity {entity.model.name}')
         finally:
-            cursor.close()
-            connection.close()
+            if cursor is not None:
+                cursor.close()
+            self._release_connection(connection, failed)
+
+    def add_many(self, entities):
+        entities_by_model = {}
+        for entity in entities:
+            entities_by_model.setdefault(entity.model, []).append(entity)
+        if entities_by_model:
+            rows = sum(len(model_entities) for model_entities in entities_by_model.values())
+            self._execute(entities_by_model, rows, self._get_bulk_insert_statements(
+                entities_by_model))
+
+    def add_batch(self, batch):
+        if not len(batch):
+            return
+        with self._lock:
+            if self._buffer:
+                self._flush()
+            self._execute([batch.model], len(batch), self._get_batch_insert_statements(batch))
+
+    def _execute(self, entity_models, rows, statements):
+        start = time.perf_counter()
+        executed = 0
+        connection = cursor = None
+        failed = True
+        try:
+            connection = self._get_connection()
+            cursor = self._get_cursor(connection)
+            for insert_stm, args in statements:
+                cursor.execute(insert_stm, args)
+                executed += 1
+            connection.commit()
+            failed = False
+        except Exception:
+            models_names = ",".join(model.name for model in entity_models)
+            raise RepositoryException(f'Error when adding entities {models_names}')
+        finally:
+            if cursor is not None:
+                cursor.close()
+            self._release_connection(connection, failed)
+
+        elapsed = time.perf_counter() - start
+        COMMIT_SECONDS.observe(elapsed)
+        ROWS.inc(rows)
+        self.flush_listener(FlushStats(rows, executed, elapsed))
+
+    @staticmethod
+    def _build_query_statement(model, columns):
+        return f'SELECT {",".join(columns)} FROM {model.name} ' \
+               f'WHERE symbol = %s AND quote_timestamp >= %s AND quote_timestamp < %s ' \
+               f'ORDER BY quote_timestamp, seq'
+
+    def query(self, symbol, start, end, fields=None, model=Model.QUOTE, columnar=False,
+              fetch_size=None):
+        model_fields = models[model]['fields']
+        columns = tuple(model_fields if fields is None else fields)
+        unknown = [column for column in columns if column not in model_fields]
+        if unknown:
+            raise RepositoryException(f'Unknown {model.name} fields {",".join(unknown)}')
+        sql = self.statement_cache.get((model, columns, 'query'), self._build_query_statement,
+                                       model, columns)
+        return self._query(model, columns, sql, (symbol, start, end), columnar,
+                           fetch_size or self.FETCH_SIZE)
+
+    def _query(self, model, columns, sql, args, columnar, fetch_size):
+        connection = cursor = None
+        exhausted = False
+        try:
+            connection = self.connection_pool.get_connection()
+            cursor = connection.cursor()
+            cursor.execute(sql, args)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    exhausted = True
+                    break
+                entities = [Entity(model, {column: value for column, value in zip(columns, row)
+                                           if value is not None}) for row in rows]
+                if columnar:
+                    yield EntityBatch.from_entities(model, entities)
+                else:
+                    yield from entities
+        except Exception:
+            raise RepositoryException(f'Error when querying {model.name}')
+        finally:
+            if cursor is not None:
+                try:
+                    if not exhausted:
+                        connection.consume_results()
+                    cursor.close()
+                except Exception:
+                    logging.warning("Error closing the cursor of a partially read query")
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    logging.warning("Error releasing the connection of a partially read query")
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._cancel_flush_timer()
+        entities, self._buffer = self._buffer, []
+        try:
+            self.add_many(entities)
+        except RepositoryException:
+            self._buffer[:0] = entities
+            raise
+
+    def _flush_or_retry(self):
+        try:
+            self._flush()
+        except RepositoryException:
+            self._schedule_flush()
+            raise
+
+    def _schedule_flush(self):
+        if self.max_latency is None or self._flush_timer is not None:
+            return
+        self._flush_timer = threading.Timer(self.max_latency, self._flush_on_timer)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+
+    def _cancel_flush_timer(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+    def _flush_on_timer(self):
+        with self._lock:
+            self._flush_timer = None
+            try:
+                self._flush()
+            except RepositoryException:
+                logging.exception("Error flushing %d buffered entities, retrying in %.3f s",
+                                  len(self._buffer), self.max_latency)
+                self._schedule_flush()
+
+    def _log_flush(self, stats):
+        logger.info("Flushed %d rows in %d statements in %.3f ms (statement cache hits=%d, "
+                    "misses=%d)", stats.rows, stats.statements, stats.elapsed * 1000,
+                     self.statement_cache.hits, self.statement_cache.misses)
 
     def close(self):
-        pass
+        with self._lock:
+            try:
+                self._flush()
+            finally:
+                self._release_connection(self._connection, discard=True)
@@ -0,0 +1,227 @@
+import json
+import mmap
+import os
+import struct
+from urllib.parse import quote
+from model import Model, Entity
+from model.entity import models
+from .repository import AbstractRepository, RepositoryException
+from .segment import SEGMENT_COLUMNS
+
+RING_HEADER = struct.Struct('<4sIIIQ')
+RING_MAGIC = b'QRNG'
+COUNT_OFFSET = RING_HEADER.size - 8
+RING_SUFFIX = '.ring'
+RECORD_PREFIX = 'QI'
+DATA_ALIGNMENT = 64
+RING_SOURCES = {'symbol': None, 'quote_timestamp': 'timestamp'}
+
+
+def ring_fields(model):
+    codes = dict(SEGMENT_COLUMNS[model])
+    fields = []
+    for field in models[model]['fields']:
+        source = RING_SOURCES.get(field, field)
+        if source is not None:
+            fields.append((source, codes[source]))
+    return tuple(fields)
+
+
+def ring_path(directory, symbol):
+    return os.path.join(directory, quote(symbol, safe='') + RING_SUFFIX)
+
+
+class TickRing:
+
+    def __init__(self, path, symbol, fields, capacity=None):
+        self.path = path
+        self.symbol = symbol
+        self.fields = tuple((name, code) for name, code in fields)
+        codes = [code for _, code in self.fields]
+        self.record = struct.Struct('<' + RECORD_PREFIX + ''.join(codes))
+        position = [name for name, _ in self.fields].index('timestamp')
+        self._timestamp_offset = struct.calcsize('<' + RECORD_PREFIX + ''.join(codes[:position]))
+        self.writable = capacity is not None
+        if self.writable and not os.path.exists(path):
+            self._create(capacity)
+        self._file = open(path, 'r+b' if self.writable else 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0,
+                               access=mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ)
+        self.data = memoryview(self._mmap)
+        self._open(capacity)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+    def _layout(self):
+        return json.dumps({'symbol': self.symbol, 'fields': self.fields}).encode()
+
+    def _create(self, capacity):
+        layout = self._layout()
+        offset = -(-(RING_HEADER.size + len(layout)) // DATA_ALIGNMENT) * DATA_ALIGNMENT
+        header = RING_HEADER.pack(RING_MAGIC, self.record.size, capacity, len(layout), 0) + layout
+        path = self.path + '.tmp'
+        with open(path, 'wb') as ring:
+            ring.write(header.ljust(offset, b'\0'))
+            ring.truncate(offset + capacity * self.record.size)
+            os.fsync(ring.fileno())
+        os.replace(path, self.path)
+
+    def _open(self, capacity):
+        magic, record_size, self.capacity, length, _ = RING_HEADER.unpack_from(self.data)
+        layout = bytes(self.data[RING_HEADER.size:RING_HEADER.size + length])
+        if magic != RING_MAGIC or record_size != self.record.size or layout != self._layout():
+            self.close()
+            raise RepositoryException(f'{self.path} is not a tick ring with the expected layout')
+        if capacity is not None and capacity != self.capacity:
+            self.close()
+            raise RepositoryException(f'{self.path} has a capacity of {self.capacity} ticks, '
+                                      f'remove it to change it to {capacity}')
+        self.offset = -(-(RING_HEADER.size + length) // DATA_ALIGNMENT) * DATA_ALIGNMENT
+        if self.writable:
+            self._recover()
+
+    def _recover(self):
+        count = len(self)
+        while count and self._sequence(count - 1) != count:
+            count -= 1
+        RING_HEADER.pack_into(self.data, 0, RING_MAGIC, self.record.size, self.capacity,
+                              len(self._layout()), count)
+
+    def __len__(self):
+        return RING_HEADER.unpack_from(self.data)[4]
+
+    def _record_offset(self, sequence):
+        return self.offset + (sequence % self.capacity) * self.record.size
+
+    def _sequence(self, sequence):
+        return struct.unpack_from('<Q', self.data, self._record_offset(sequence))[0]
+
+    def append(self, entity):
+        count = len(self)
+        mask = 0
+        values = []
+        for bit, (name, code) in enumerate(self.fields):
+            value = entity.get(name)
+            if value is None:
+                values.append(b'' if code.endswith('s') else 0)
+            else:
+                mask |= 1 << bit
+                values.append(str(value).encode() if code.endswith('s') else value)
+        self.record.pack_into(self.data, self._record_offset(count), count + 1, mask, *values)
+        struct.pack_into('<Q', self.data, COUNT_OFFSET, count + 1)
+
+    def view(self, start, stop):
+        first = self._record_offset(start)
+        if stop - start <= 0:
+            return self.data[first:first]
+        last = self._record_offset(stop - 1) + self.record.size
+        if last <= first:
+            raise RepositoryException('The requested ticks wrap around the end of the ring')
+        return self.data[first:last]
+
+    def records(self, start, stop):
+        sequence = start
+        while sequence < stop:
+            chunk = min(stop, sequence + self.capacity - sequence % self.capacity)
+            for record in self.record.iter_unpack(self.view(sequence, chunk)):
+                sequence += 1
+                if record[0] == sequence:
+                    yield record
+
+    def _entity(self, record):
+        fields = {'key': self.symbol}
+        mask = record[1]
+        for bit, ((name, code), value) in enumerate(zip(self.fields, record[2:])):
+            if mask & (1 << bit):
+                fields[name] = value.rstrip(b'\0').decode() if code.endswith('s') else value
+        return Entity(Model.QUOTE, fields)
+
+    def last(self, n):
+        count = len(self)
+        return [self._entity(record)
+                for record in self.records(max(0, count - min(n, self.capacity)), count)]
+
+    def _timestamp(self, sequence):
+        return struct.unpack_from('<q', self.data,
+                                  self._record_offset(sequence) + self._timestamp_offset)[0]
+
+    def _bisect(self, first, last, timestamp):
+        while first < last:
+            middle = (first + last) // 2
+            if self._timestamp(middle) < timestamp:
+                first = middle + 1
+            else:
+                last = middle
+        return first
+
+    def window(self, start, end):
+        count = len(self)
+        first = max(0, count - self.capacity)
+        return [self._entity(record)
+                for record in self.records(self._bisect(first, count, start),
+                                          self._bisect(first, count, end))]
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        self.data.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+
+class TickStore(AbstractRepository):
+
+    def __init__(self, directory, capacity=100000, capacities=None, model=Model.QUOTE):
+        self.directory = directory
+        self.capacity = capacity
+        self.capacities = {} if capacities is None else capacities
+        self.model = model
+        self.fields = ring_fields(model)
+        self._rings = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+    def ring(self, symbol):
+        ring = self._rings.get(symbol)
+        if ring is None:
+            ring = self._rings[symbol] = TickRing(ring_path(self.directory, symbol), symbol,
+                                                  self.fields,
+                                                  self.capacities.get(symbol, self.capacity))
+        return ring
+
+    def add(self, entity):
+        symbol = entity.symbol()
+        if symbol is None or entity.get('timestamp') is None:
+            raise RepositoryException('Entities need a symbol and a timestamp to be stored in '
+                                      'the tick store')
+        try:
+            self.ring(symbol).append(entity)
+        except (struct.error, OSError) as e:
+            raise RepositoryException(f'Error storing the {symbol} tick') from e
+
+    def flush(self):
+        for ring in self._rings.values():
+            ring.flush()
+
+    def close(self):
+        self.flush()
+        for ring in self._rings.values():
+            ring.close()
+        self._rings = {}
+
+
+def open_tick_ring(directory, symbol, model=Model.QUOTE):
+    return TickRing(ring_path(directory, symbol), symbol, ring_fields(model))
@@ -0,0 +1,375 @@
+import array
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+from model import Model, Entity
+from .repository import AbstractRepository, RepositoryException
+
+FILE_HEADER = struct.Struct('<4sI')
+BLOCK_HEADER = struct.Struct('<4sIqq8x')
+FILE_MAGIC = b'QSEG'
+BLOCK_MAGIC = b'QBLK'
+SEGMENT_SUFFIX = '.seg'
+ALIGNMENT = 8
+
+SEGMENT_COLUMNS = {
+    Model.QUOTE: (('timestamp', 'q'), ('bid_price', 'd'), ('ask_price', 'd'), ('last_price', 'd'),
+                  ('bid_size', 'd'), ('ask_size', 'd'), ('ask_id', '10s'), ('bid_id', '10s'),
+                  ('total_volume', 'q'), ('last_size', 'd'), ('trade_time', 'q'),
+                  ('quote_time', 'q'), ('last_id', '10s'), ('nav', 'd'))
+}
+
+
+def _padded(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def _day(timestamp):
+    return datetime.fromtimestamp(timestamp / 1000, timezone.utc).strftime('%Y-%m-%d')
+
+
+def segment_path(directory, day, symbol):
+    return os.path.join(directory, day, quote(symbol, safe='') + SEGMENT_SUFFIX)
+
+
+class SegmentLayout:
+
+    def __init__(self, columns):
+        self.columns = tuple((name, code) for name, code in columns)
+        self.sizes = tuple(struct.calcsize(code) for _, code in self.columns)
+
+    def block_size(self, rows):
+        return BLOCK_HEADER.size + sum(_padded(rows) + _padded(rows * size) for size in self.sizes)
+
+
+class _SegmentBuffer:
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.columns = [bytearray() if code.endswith('s') else array.array(code)
+                        for _, code in layout.columns]
+        self.masks = [bytearray() for _ in layout.columns]
+        self.min_timestamp = self.max_timestamp = None
+
+    def __len__(self):
+        return len(self.masks[0])
+
+    def append(self, timestamp, entity):
+        rows = len(self)
+        try:
+            for (name, code), size, column, mask in zip(self.layout.columns, self.layout.sizes,
+                                                        self.columns, self.masks):
+                value = entity.get(name)
+                mask.append(value is not None)
+                if code.endswith('s'):
+                    column += bytes(size) if value is None else \
+                        str(value).encode()[:size].ljust(size, b'\0')
+                else:
+                    column.append(0 if value is None else value)
+        except (TypeError, OverflowError):
+            for (_, code), size, column, mask in zip(self.layout.columns, self.layout.sizes,
+                                                     self.columns, self.masks):
+                del mask[rows:]
+                del column[rows * size if code.endswith('s') else rows:]
+            raise
+        if self.min_timestamp is None or timestamp < self.min_timestamp:
+            self.min_timestamp = timestamp
+        if self.max_timestamp is None or timestamp > self.max_timestamp:
+            self.max_timestamp = timestamp
+
+    def encode(self):
+        rows = len(self)
+        chunks = [BLOCK_HEADER.pack(BLOCK_MAGIC, rows, self.min_timestamp, self.max_timestamp)]
+        for size, column, mask in zip(self.layout.sizes, self.columns, self.masks):
+            chunks.append(bytes(mask).ljust(_padded(rows), b'\0'))
+            chunks.append(bytes(column).ljust(_padded(rows * size), b'\0'))
+        return b''.join(chunks)
+
+
+class SegmentRepository(AbstractRepository):
+
+    def __init__(self, directory, model=Model.QUOTE, flush_size=10000, fsync_interval=1.0,
+                 max_open_files=512, max_latency=None, clock=time.monotonic):
+        self.directory = directory
+        self.model = model
+        self.layout = SegmentLayout(SEGMENT_COLUMNS[model])
+        self.flush_size = flush_size
+        self.fsync_interval = fsync_interval
+        self.max_open_files = max_open_files
+        self.max_latency = max_latency
+        self.clock = clock
+        self.blocks = 0
+        self._buffers = {}
+        self._buffered = 0
+        self._files = OrderedDict()
+        self._dirty = set()
+        self._checked = set()
+        self._synced_at = clock()
+        self._lock = threading.Lock()
+        self._flush_timer = None
+        os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+    def add(self, entity):
+        if entity.model != self.model:
+            raise RepositoryException(f'Segment repository only stores {self.model.name} entities')
+        symbol = entity.symbol()
+        timestamp = entity.get('timestamp')
+        if symbol is None or timestamp is None:
+            raise RepositoryException('Entities need a symbol and a timestamp to be stored in '
+                                      'segments')
+        key = (_day(timestamp), symbol)
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = self._buffers[key] = _SegmentBuffer(self.layout)
+            try:
+                buffer.append(timestamp, entity)
+            except (TypeError, OverflowError) as e:
+                raise RepositoryException(f'Cannot store the {symbol} quote in a segment: '
+                                          f'{e}') from e
+            self._buffered += 1
+            if self._buffered >= self.flush_size:
+                self._flush()
+            else:
+                self._schedule_flush()
+
+    def _header(self, symbol):
+        layout = json.dumps({'model': self.model.name, 'symbol': symbol,
+                             'columns': self.layout.columns}).encode()
+        header = FILE_HEADER.pack(FILE_MAGIC, len(layout)) + layout
+        return header.ljust(_padded(len(header)), b' ')
+
+    def _open(self, path, symbol):
+        segment = self._files.get(path)
+        if segment is not None:
+            self._files.move_to_end(path)
+            return segment
+        if len(self._files) >= self.max_open_files:
+            self._close_file(*self._files.popitem(last=False))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if path not in self._checked and os.path.exists(path):
+            with SegmentFile(path) as existing:
+                length = existing.valid_length()
+            os.truncate(path, length)
+        self._checked.add(path)
+        segment = self._files[path] = open(path, 'ab')
+        if segment.tell() == 0:
+            segment.write(self._header(symbol))
+        return segment
+
+    def _close_file(self, path, segment):
+        if path in self._dirty:
+            os.fsync(segment.fileno())
+            self._dirty.discard(path)
+        segment.close()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._cancel_flush_timer()
+        for key in list(self._buffers):
+            day, symbol = key
+            buffer = self._buffers[key]
+            path = segment_path(self.directory, day, symbol)
+            try:
+                segment = self._open(path, symbol)
+                segment.write(buffer.encode())
+                segment.flush()
+            except OSError as e:
+                self._discard(path)
+                raise RepositoryException(f'Error writing segments to {self.directory}') from e
+            self._dirty.add(path)
+            del self._buffers[key]
+            self._buffered -= len(buffer)
+            self.blocks += 1
+        if self.clock() - self._synced_at >= self.fsync_interval:
+            self._sync()
+
+    def _schedule_flush(self):
+        if self.max_latency is None or self._flush_timer is not None:
+            return
+        self._flush_timer = threading.Timer(self.max_latency, self._flush_on_timer)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+
+    def _cancel_flush_timer(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+    def _flush_on_timer(self):
+        with self._lock:
+            self._flush_timer = None
+            try:
+                self._flush()
+            except (RepositoryException, OSError):
+                logging.exception("Error flushing %d buffered quotes, retrying in %.3f s",
+                                  self._buffered, self.max_latency)
+            if self._buffers or self._dirty:
+                self._schedule_flush()
+
+    def _discard(self, path):
+        segment = self._files.pop(path, None)
+        self._checked.discard(path)
+        self._dirty.discard(path)
+        if segment is not None:
+            try:
+                segment.close()
+            except OSError:
+                pass
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        for path in self._dirty:
+            os.fsync(self._files[path].fileno())
+        self._dirty = set()
+        self._synced_at = self.clock()
+
+    def _close_files(self):
+        self._sync()
+        for segment in self._files.values():
+            segment.close()
+        self._files = OrderedDict()
+
+    def close(self):
+        with self._lock:
+            try:
+                self._flush()
+            finally:
+                self._close_files()
+
+
+class SegmentBlock:
+
+    def __init__(self, segment, offset, rows, min_timestamp, max_timestamp):
+        self.segment = segment
+        self.offset = offset
+        self.rows = rows
+        self.min_timestamp = min_timestamp
+        self.max_timestamp = max_timestamp
+
+    def __len__(self):
+        return self.rows
+
+    def column(self, field):
+        rows = self.rows
+        offset = self.offset + BLOCK_HEADER.size
+        for (name, code), size in zip(self.segment.layout.columns, self.segment.layout.sizes):
+            data = offset + _padded(rows)
+            if name == field:
+                mask = self.segment.data[offset:offset + rows]
+                values = self.segment.data[data:data + rows * size]
+                return (values if code.endswith('s') else values.cast(code)), mask
+            offset = data + _padded(rows * size)
+        raise KeyError(field)
+
+    def values(self, field):
+        column, mask = self.column(field)
+        code = dict(self.segment.layout.columns)[field]
+        if code.endswith('s'):
+            size = struct.calcsize(code)
+            column = [bytes(column[i:i + size]).rstrip(b'\0').decode()
+                      for i in range(0, len(column), size)]
+        return [value if present else None for value, present in zip(column, mask)]
+
+    def __iter__(self):
+        names = [name for name, _ in self.segment.layout.columns]
+        columns = [self.values(name) for name in names]
+        for row in zip(*columns):
+            fields = {'key': self.segment.symbol}
+            fields.update((name, value) for name, value in zip(names, row) if value is not None)
+            yield Entity(self.segment.model, fields)
+
+
+class SegmentFile:
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.data = memoryview(self._mmap if self._mmap is not None else b'')
+        self.model = self.symbol = self.layout = None
+        self._first_block = len(self.data)
+        if len(self.data) >= FILE_HEADER.size:
+            magic, length = FILE_HEADER.unpack_from(self.data)
+            if magic != FILE_MAGIC:
+                self.close()
+                raise RepositoryException(f'{path} is not a segment file')
+            if _padded(FILE_HEADER.size + length) > len(self.data):
+                return
+            header = json.loads(bytes(self.data[FILE_HEADER.size:FILE_HEADER.size + length]))
+            self.model = Model[header['model']]
+            self.symbol = header['symbol']
+            self.layout = SegmentLayout(header['columns'])
+            self._first_block = _padded(FILE_HEADER.size + length)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+    def _blocks(self):
+        offset = self._first_block
+        while offset + BLOCK_HEADER.size <= len(self.data):
+            magic, rows, min_timestamp, max_timestamp = BLOCK_HEADER.unpack_from(self.data, offset)
+            size = self.layout.block_size(rows)
+            if magic != BLOCK_MAGIC or offset + size > len(self.data):
+                return
+            yield SegmentBlock(self, offset, rows, min_timestamp, max_timestamp)
+            offset += size
+
+    def blocks(self, start=None, end=None):
+        for block in self._blocks():
+            if (start is None or block.max_timestamp >= start) and \
+                    (end is None or block.min_timestamp < end):
+                yield block
+
+    def valid_length(self):
+        length = min(self._first_block, len(self.data)) if self.layout is not None else 0
+        for block in self._blocks():
+            length = block.offset + self.layout.block_size(block.rows)
+        return length
+
+    def close(self):
+        self.data.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+        self._file.close()
+
+
+def read_segments(directory, symbol, start, end):
+    day = datetime.fromtimestamp(start / 1000, timezone.utc).date()
+    last_day = datetime.fromtimestamp((end - 1) / 1000, timezone.utc).date()
+    while day <= last_day:
+        path = segment_path(directory, day.isoformat(), symbol)
+        day += timedelta(days=1)
+        if not os.path.exists(path):
+            continue
+        with SegmentFile(path) as segment:
+            for block in segment.blocks(start, end):
+                for entity in block:
+                    if start <= entity['timestamp'] < end:
+                        yield entity
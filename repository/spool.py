@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from itertools import islice
+import metrics
+from model import Entity, EntityException
+from .repository import AbstractRepository, RepositoryException
+
+SEGMENT_PREFIX = 'spool-'
+SEGMENT_SUFFIX = '.jsonl'
+CHECKPOINT_FILE = 'checkpoint'
+
+SPOOLED = metrics.registry.counter('quote_streamer_spooled_total',
+                                   'Entities spilled to the local spool')
+SPOOL_DRAINED = metrics.registry.counter('quote_streamer_spool_drained_total',
+                                         'Spooled entities written to the repository')
+SPOOL_RETRIES = metrics.registry.counter('quote_streamer_spool_retries_total',
+                                         'Failed repository writes retried by the spool')
+
+
+def _segment_name(sequence):
+    return f'{SEGMENT_PREFIX}{sequence:012d}{SEGMENT_SUFFIX}'
+
+
+def _segment_sequence(name):
+    return int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+
+class Spool:
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+        self._checkpoint_path = os.path.join(directory, CHECKPOINT_FILE)
+        segments = self.segments()
+        checkpoint = self._load_checkpoint()
+        if checkpoint is None:
+            self._read_sequence = segments[0] if segments else 1
+            self._read_offset = 0
+        else:
+            self._read_sequence, self._read_offset = checkpoint
+        self._reader = None
+        self._write_sequence = max(segments, default=0) + 1
+        self._writer = None
+        self._delete_consumed()
+
+    def segments(self):
+        return sorted(_segment_sequence(name) for name in os.listdir(self.directory)
+                      if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+
+    def _path(self, sequence):
+        return os.path.join(self.directory, _segment_name(sequence))
+
+    def _load_checkpoint(self):
+        try:
+            with open(self._checkpoint_path) as checkpoint:
+                position = json.load(checkpoint)
+            return position['segment'], position['offset']
+        except FileNotFoundError:
+            return None
+
+    def append(self, entity):
+        if self._writer is None or self._writer.tell() >= self.segment_size:
+            if self._writer is not None:
+                self._writer.close()
+                self._write_sequence += 1
+            self._writer = open(self._path(self._write_sequence), 'ab')
+        self._writer.write(entity.to_json().encode() + b'\n')
+
+    def flush(self):
+        if self._writer is not None:
+            self._writer.flush()
+
+    def _open_reader(self):
+        following = [sequence for sequence in self.segments() if sequence >= self._read_sequence]
+        if not following:
+            return False
+        if following[0] != self._read_sequence:
+            self._read_sequence, self._read_offset = following[0], 0
+        self._reader = open(self._path(self._read_sequence), 'rb')
+        self._reader.seek(self._read_offset)
+        return True
+
+    def _next_segment(self):
+        if not any(sequence > self._read_sequence for sequence in self.segments()):
+            return False
+        self._reader.close()
+        self._reader = None
+        self._read_sequence, self._read_offset = self._read_sequence + 1, 0
+        return True
+
+    def _writing(self, sequence):
+        return self._writer is not None and sequence == self._write_sequence
+
+    def read_lines(self, count):
+        lines = []
+        while len(lines) < count:
+            if self._reader is None and not self._open_reader():
+                break
+            line = self._reader.readline()
+            if line.endswith(b'\n'):
+                self._read_offset += len(line)
+                lines.append(line)
+            elif self._writing(self._read_sequence) or not self._next_segment():
+                self._reader.seek(self._read_offset)
+                break
+        return lines
+
+    def read(self, count):
+        entities = []
+        for line in self.read_lines(count):
+            try:
+                entities.append(Entity.from_json(line))
+            except (EntityException, ValueError):
+                logging.warning("Skipping invalid spooled entity %r", line[:100])
+        return entities
+
+    def drained(self):
+        segments = self.segments()
+        if not segments or self._read_sequence > segments[-1]:
+            return True
+        return self._read_sequence == segments[-1] and \
+            self._read_offset >= os.path.getsize(self._path(segments[-1]))
+
+    def commit(self):
+        path = self._checkpoint_path + '.tmp'
+        with open(path, 'w') as checkpoint:
+            json.dump({'segment': self._read_sequence, 'offset': self._read_offset}, checkpoint)
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.replace(path, self._checkpoint_path)
+        self._delete_consumed()
+
+    def _delete_consumed(self):
+        for sequence in self.segments():
+            if sequence < self._read_sequence:
+                os.remove(self._path(sequence))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._writer.close()
+            self._writer = None
+            self._write_sequence += 1
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+
+class SpoolingRepository(AbstractRepository):
+
+    def __init__(self, repository, directory, memory_size=10000, batch_size=1000,
+                 segment_size=64 * 1024 * 1024, retry_interval=1.0, close_timeout=10.0,
+                 clock=time.monotonic):
+        self.repository = repository
+        self.memory_size = memory_size
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.close_timeout = close_timeout
+        self.clock = clock
+        self.spooled = 0
+        self.drained = 0
+        self._spool = Spool(directory, segment_size)
+        self._memory = deque()
+        self._generation = 0
+        self._spilling = not self._spool.drained()
+        self._close_deadline = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._drain, name='spool-drainer', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+    @property
+    def spilling(self):
+        return self._spilling
+
+    def add(self, entity):
+        with self._condition:
+            if not self._spilling and len(self._memory) >= self.memory_size:
+                self._spill()
+            if self._spilling:
+                self._spool.append(entity)
+                self.spooled += 1
+                SPOOLED.inc()
+            else:
+                self._memory.append(entity)
+            self._condition.notify()
+
+    def _spill(self):
+        self._spilling = True
+        self._generation += 1
+        for entity in self._memory:
+            self._spool.append(entity)
+        self.spooled += len(self._memory)
+        SPOOLED.inc(len(self._memory))
+        self._memory.clear()
+        logging.warning("Spilling entities to %s", self._spool.directory)
+
+    def _next_batch(self):
+        with self._condition:
+            while True:
+                while not self._memory and not self._spilling and self._close_deadline is None:
+                    self._condition.wait()
+                if self._memory:
+                    return self._generation, list(islice(self._memory, self.batch_size)), False
+                if not self._spilling:
+                    return None
+                self._spool.flush()
+                entities = self._spool.read(self.batch_size)
+                if entities:
+                    return self._generation, entities, True
+                if self._spool.drained():
+                    self._spool.commit()
+                    self._spilling = False
+                else:
+                    self._condition.wait(self.retry_interval)
+
+    def _write(self, entities):
+        while True:
+            try:
+                self.repository.add_many(entities)
+                self.repository.flush()
+                return True
+            except RepositoryException:
+                logging.exception("Error writing %d entities, retrying in %.1f s", len(entities),
+                                  self.retry_interval)
+                SPOOL_RETRIES.inc()
+            with self._condition:
+                if not self._spilling:
+                    self._spill()
+                if self._close_deadline is not None and self.clock() >= self._close_deadline:
+                    return False
+                self._condition.wait(self.retry_interval)
+
+    def _drain(self):
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                generation, entities, spooled = batch
+                if not self._write(entities):
+                    return
+                with self._condition:
+                    if spooled:
+                        self._spool.commit()
+                        self.drained += len(entities)
+                        SPOOL_DRAINED.inc(len(entities))
+                    elif generation == self._generation:
+                        for _ in entities:
+                            self._memory.popleft()
+                    else:
+                        self._spool.flush()
+                        self._spool.read_lines(len(entities))
+                        self._spool.commit()
+        except Exception:
+            logging.exception("Spool drainer stopped, entities are kept in %s",
+                              self._spool.directory)
+            with self._condition:
+                if self._memory:
+                    self._spill()
+
+    def close(self):
+        with self._condition:
+            self._close_deadline = self.clock() + self.close_timeout
+            self._condition.notify()
+        self._thread.join()
+        with self._condition:
+            if self._memory:
+                self._spill()
+            self._spool.close()
+        self.repository.close()
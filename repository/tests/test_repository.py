@@ -1,8 +1,9 @@
 import pytest
 import json
+import threading
 import configuration
 from unittest.mock import Mock
-from model import Model, Entity
+from model import Model, Entity, EntityBatch
 from repository import DBRepository, RepositoryException
 
 
@@ -99,3 +100,303 @@ def test_db_repository_add_entity_supports_field_mapping(quote, monkeypatch):
     args = ('MSFT', 183.7, 183.88, 183.7, 8, 1, 'P', 'P', 42146720, 71997, 71985, 'D')
     cursor.execute.assert_called_once_with(stm, args)
     cursor.execute.assert_called_once_with(stm, args)
+
+
+@pytest.fixture()
+def db_mocks():
+    connection_pool = Mock()
+    connection = Mock()
+    cursor = Mock()
+    connection.cursor.return_value = cursor
+    connection_pool.get_connection.return_value = connection
+    return connection_pool, connection, cursor
+
+
+@pytest.fixture()
+def quote_mappings(monkeypatch):
+    mock_config = {}
+    mock_config['QUOTE'] = {}
+    mock_config['QUOTE']['repository_field_mappings'] = '{"key": "symbol"}'
+    monkeypatch.setattr(configuration, 'configuration', mock_config)
+
+
+def test_db_repository_add_many_inserts_all_rows_in_one_statement(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    entities = [Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 183.7}),
+                Entity(Model.QUOTE, {"key": "QQQ", "ask_price": 230.1, "delayed": False})]
+    repository = DBRepository(connection_pool)
+    repository.add_many(entities)
+
+    stm = 'INSERT INTO QUOTE (symbol,bid_price,ask_price,created_on) ' \
+          'VALUES (%s,%s,%s,CURRENT_TIMESTAMP()),(%s,%s,%s,CURRENT_TIMESTAMP())'
+    args = ('MSFT', 183.7, None, 'QQQ', None, 230.1)
+    cursor.execute.assert_called_once_with(stm, args)
+    connection.commit.assert_called_once()
+    connection.close.assert_called_once()
+
+
+def test_db_repository_add_many_throws_exception_if_error(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    cursor.execute.side_effect = Exception()
+    repository = DBRepository(connection_pool)
+    with pytest.raises(RepositoryException):
+        repository.add_many([Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 183.7})])
+    connection.close.assert_called_once()
+
+
+def test_db_repository_buffered_add_flushes_when_batch_is_full(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    stats = []
+    repository = DBRepository(connection_pool, batch_size=4, flush_listener=stats.append)
+    for price in [1.0, 2.0, 3.0]:
+        repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": price}))
+    cursor.execute.assert_not_called()
+
+    repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 4.0}))
+    cursor.execute.assert_called_once()
+    assert cursor.execute.call_args[0][1] == ('MSFT', 1.0, 'MSFT', 2.0, 'MSFT', 3.0, 'MSFT', 4.0)
+    assert len(stats) == 1
+    assert stats[0].rows == 4
+    assert stats[0].statements == 1
+
+
+def test_db_repository_buffered_add_flushes_on_exit(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    with DBRepository(connection_pool, batch_size=10) as repository:
+        repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 1.0}))
+        cursor.execute.assert_not_called()
+    cursor.execute.assert_called_once()
+    connection.commit.assert_called_once()
+
+
+def test_db_repository_buffered_add_flushes_after_max_latency(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    flushed = threading.Event()
+    repository = DBRepository(connection_pool, batch_size=10, max_latency=0.01,
+                              flush_listener=lambda stats: flushed.set())
+    repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 1.0}))
+    assert flushed.wait(timeout=5)
+    cursor.execute.assert_called_once()
+
+
+def test_db_repository_keeps_the_buffered_entities_when_a_flush_fails(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    cursor.execute.side_effect = [Exception(), None]
+    repository = DBRepository(connection_pool, batch_size=2)
+    repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 1.0}))
+    with pytest.raises(RepositoryException):
+        repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 2.0}))
+    repository.flush()
+    assert cursor.execute.call_args[0][1] == ('MSFT', 1.0, 'MSFT', 2.0)
+
+
+def test_db_repository_retries_a_failed_flush_after_max_latency(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    cursor.execute.side_effect = [Exception(), None]
+    flushed = threading.Event()
+    repository = DBRepository(connection_pool, batch_size=10, max_latency=0.01,
+                              flush_listener=lambda stats: flushed.set())
+    repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 1.0}))
+    assert flushed.wait(timeout=5)
+    assert cursor.execute.call_count == 2
+    assert cursor.execute.call_args[0][1] == ('MSFT', 1.0)
+
+
+def test_db_repository_keeps_the_entity_added_after_a_failed_timed_flush(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    failed = threading.Event()
+
+    def execute(*args):
+        if not failed.is_set():
+            failed.set()
+            raise Exception()
+    cursor.execute.side_effect = execute
+    repository = DBRepository(connection_pool, batch_size=10, max_latency=60)
+    repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 1.0}))
+    repository._flush_timer.cancel()
+    repository._flush_on_timer()
+    repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 2.0}))
+    repository.close()
+    assert cursor.execute.call_args[0][1] == ('MSFT', 1.0, 'MSFT', 2.0)
+
+
+def test_db_repository_bounds_the_buffer_while_the_database_is_down(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    cursor.execute.side_effect = Exception()
+    repository = DBRepository(connection_pool, batch_size=2, max_buffer_size=4)
+    errors = 0
+    for price in range(10):
+        try:
+            repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": float(price)}))
+        except RepositoryException:
+            errors += 1
+    assert len(repository._buffer) == 4
+    assert cursor.execute.call_count == 8
+    assert errors == 8
+
+
+def test_db_repository_reuses_cached_insert_statement(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    repository = DBRepository(connection_pool)
+    repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 1.0}))
+    repository.add(Entity(Model.QUOTE, {"key": "QQQ", "bid_price": 2.0}))
+    repository.add(Entity(Model.QUOTE, {"key": "QQQ", "ask_price": 2.0}))
+    assert repository.statement_cache.misses == 2
+    assert repository.statement_cache.hits == 1
+    assert len(repository.statement_cache) == 2
+    assert cursor.execute.call_args_list[1][0] == (
+        'INSERT INTO QUOTE (symbol,bid_price,created_on) '
+        'VALUES (%s,%s,CURRENT_TIMESTAMP())', ('QQQ', 2.0))
+
+
+def test_db_repository_splits_inserts_in_a_bounded_set_of_statement_sizes(db_mocks,
+                                                                         quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    repository = DBRepository(connection_pool)
+    for rows in (11, 13, 3):
+        repository.add_many([Entity(Model.QUOTE, {"key": "MSFT", "bid_price": float(i)})
+                             for i in range(rows)])
+    sizes = [len(call[0][1]) // 2 for call in cursor.execute.call_args_list]
+    assert sizes == [8, 2, 1, 8, 4, 1, 2, 1]
+    assert [value for call in cursor.execute.call_args_list[:3]
+            for value in call[0][1][1::2]] == [float(i) for i in range(11)]
+    assert len(repository.statement_cache) == 1
+
+
+def test_db_repository_uses_prepared_cursor_when_enabled(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    repository = DBRepository(connection_pool, prepared_statements=True)
+    repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 1.0}))
+    connection.cursor.assert_called_once_with(prepared=True)
+
+
+def test_db_repository_falls_back_to_plain_cursor_if_prepared_not_available(db_mocks,
+                                                                            quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+
+    def get_cursor(prepared=False):
+        if prepared:
+            raise TypeError()
+        return cursor
+
+    connection.cursor.side_effect = get_cursor
+    repository = DBRepository(connection_pool, prepared_statements=True)
+    repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 1.0}))
+    assert not repository.prepared_statements
+    cursor.execute.assert_called_once()
+
+
+def test_db_repository_holds_its_connection_when_enabled(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    repository = DBRepository(connection_pool, hold_connection=True)
+    repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 1.0}))
+    repository.add_many([Entity(Model.QUOTE, {"key": "QQQ", "bid_price": 2.0})])
+    connection_pool.get_connection.assert_called_once()
+    connection.close.assert_not_called()
+    repository.close()
+    connection.close.assert_called_once()
+
+
+def test_db_repository_discards_held_connection_on_error(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    cursor.execute.side_effect = [Exception(), None]
+    repository = DBRepository(connection_pool, hold_connection=True)
+    with pytest.raises(RepositoryException):
+        repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 1.0}))
+    connection.close.assert_called_once()
+    repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 1.0}))
+    assert connection_pool.get_connection.call_count == 2
+
+
+def test_db_repository_add_batch_inserts_all_rows_in_one_statement(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    batch = EntityBatch.from_entities(Model.QUOTE, [
+        Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 183.7, "delayed": False}),
+        Entity(Model.QUOTE, {"key": "QQQ", "ask_price": 230.1})])
+    repository = DBRepository(connection_pool)
+    repository.add_batch(batch)
+
+    stm = 'INSERT INTO QUOTE (symbol,bid_price,ask_price,created_on) ' \
+          'VALUES (%s,%s,%s,CURRENT_TIMESTAMP()),(%s,%s,%s,CURRENT_TIMESTAMP())'
+    args = ('MSFT', 183.7, None, 'QQQ', None, 230.1)
+    cursor.execute.assert_called_once_with(stm, args)
+    connection.commit.assert_called_once()
+
+
+def test_db_repository_add_batch_flushes_buffered_entities_first(db_mocks, quote_mappings):
+    connection_pool, connection, cursor = db_mocks
+    repository = DBRepository(connection_pool, batch_size=10)
+    repository.add(Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 1.0}))
+    repository.add_batch(EntityBatch.from_entities(Model.QUOTE, [
+        Entity(Model.QUOTE, {"key": "MSFT", "bid_price": 2.0})]))
+    assert [call[0][1] for call in cursor.execute.call_args_list] == [('MSFT', 1.0),
+                                                                      ('MSFT', 2.0)]
+
+
+def test_db_repository_query_streams_rows_with_fetchmany(db_mocks):
+    connection_pool, connection, cursor = db_mocks
+    cursor.fetchmany.side_effect = [[('MSFT', 183.7, None), ('MSFT', 183.8, 184.0)],
+                                    [('MSFT', 183.9, 184.1)], []]
+    repository = DBRepository(connection_pool)
+    rows = repository.query('MSFT', '2020-05-30', '2020-05-31',
+                            ['symbol', 'bid_price', 'ask_price'], fetch_size=2)
+    cursor.execute.assert_not_called()
+    first = next(rows)
+    assert first.fields_values == {'symbol': 'MSFT', 'bid_price': 183.7}
+    assert cursor.fetchmany.call_count == 1
+    assert [row['bid_price'] for row in rows] == [183.8, 183.9]
+    cursor.execute.assert_called_once_with(
+        'SELECT symbol,bid_price,ask_price FROM QUOTE WHERE symbol = %s AND '
+        'quote_timestamp >= %s AND quote_timestamp < %s ORDER BY quote_timestamp, seq',
+        ('MSFT', '2020-05-30', '2020-05-31'))
+    cursor.fetchmany.assert_called_with(2)
+    cursor.close.assert_called_once()
+    connection.close.assert_called_once()
+
+
+def test_db_repository_query_can_return_columnar_batches(db_mocks):
+    connection_pool, connection, cursor = db_mocks
+    cursor.fetchmany.side_effect = [[('MSFT', 1), ('MSFT', 2)], []]
+    repository = DBRepository(connection_pool)
+    batches = list(repository.query('MSFT', 'start', 'end', ['symbol', 'total_volume'],
+                                    columnar=True))
+    assert len(batches) == 1
+    assert batches[0].values('total_volume') == [1, 2]
+
+
+def test_db_repository_query_releases_the_connection_when_closed_early(db_mocks):
+    connection_pool, connection, cursor = db_mocks
+    cursor.fetchmany.return_value = [('MSFT',)]
+    repository = DBRepository(connection_pool)
+    rows = repository.query('MSFT', 'start', 'end', ['symbol'])
+    next(rows)
+    rows.close()
+    connection.consume_results.assert_called_once()
+    cursor.close.assert_called_once()
+    connection.close.assert_called_once()
+
+
+def test_db_repository_query_does_not_discard_results_when_fully_read(db_mocks):
+    connection_pool, connection, cursor = db_mocks
+    cursor.fetchmany.side_effect = [[('MSFT',)], []]
+    repository = DBRepository(connection_pool)
+    assert len(list(repository.query('MSFT', 'start', 'end', ['symbol']))) == 1
+    connection.consume_results.assert_not_called()
+    connection.close.assert_called_once()
+
+
+def test_db_repository_query_rejects_unknown_fields(db_mocks):
+    connection_pool, connection, cursor = db_mocks
+    repository = DBRepository(connection_pool)
+    with pytest.raises(RepositoryException):
+        repository.query('MSFT', 'start', 'end', ['symbol; DROP TABLE quote'])
+    connection_pool.get_connection.assert_not_called()
+
+
+def test_db_repository_query_throws_exception_if_error(db_mocks):
+    connection_pool, connection, cursor = db_mocks
+    cursor.execute.side_effect = Exception()
+    repository = DBRepository(connection_pool)
+    with pytest.raises(RepositoryException):
+        list(repository.query('MSFT', 'start', 'end'))
+    connection.close.assert_called_once()
@@ -0,0 +1,89 @@
+import pytest
+from model import Model, Entity
+from repository import TickStore, RepositoryException, open_tick_ring
+from repository.ring import ring_fields, ring_path, TickRing, COUNT_OFFSET
+
+TIMESTAMP = 1590879805110
+
+
+def quote(offset, **fields):
+    return Entity(Model.QUOTE, {"key": "SPY", "timestamp": TIMESTAMP + offset, **fields})
+
+
+def test_ring_fields_follow_the_model_fields():
+    assert [name for name, _ in ring_fields(Model.QUOTE)] == [
+        'timestamp', 'bid_price', 'ask_price', 'last_price', 'bid_size', 'ask_size', 'ask_id',
+        'bid_id', 'total_volume', 'last_size', 'trade_time', 'quote_time', 'last_id', 'nav']
+
+
+def test_tick_store_returns_the_last_ticks(tmp_path):
+    with TickStore(str(tmp_path), capacity=4) as store:
+        for i in range(6):
+            store.add(quote(i, bid_price=100.0 + i, ask_id="P" if i % 2 else None))
+        ticks = store.ring("SPY").last(3)
+    assert [tick.fields_values for tick in ticks] == [
+        {"key": "SPY", "timestamp": TIMESTAMP + 3, "bid_price": 103.0, "ask_id": "P"},
+        {"key": "SPY", "timestamp": TIMESTAMP + 4, "bid_price": 104.0},
+        {"key": "SPY", "timestamp": TIMESTAMP + 5, "bid_price": 105.0, "ask_id": "P"}]
+
+
+def test_tick_store_keeps_only_the_capacity_of_each_symbol(tmp_path):
+    with TickStore(str(tmp_path), capacity=100, capacities={"SPY": 3}) as store:
+        for i in range(10):
+            store.add(quote(i))
+        assert len(store.ring("SPY").last(10)) == 3
+        assert store.ring("SPY").capacity == 3
+
+
+def test_tick_ring_can_be_read_by_another_reader_while_written(tmp_path):
+    with TickStore(str(tmp_path), capacity=8) as store:
+        store.add(quote(0, bid_price=1.0))
+        with open_tick_ring(str(tmp_path), "SPY") as reader:
+            assert [tick['bid_price'] for tick in reader.last(5)] == [1.0]
+            store.add(quote(1, bid_price=2.0))
+            assert [tick['bid_price'] for tick in reader.last(5)] == [1.0, 2.0]
+
+
+def test_tick_ring_returns_a_time_window_across_the_end_of_the_ring(tmp_path):
+    with TickStore(str(tmp_path), capacity=5) as store:
+        for i in range(12):
+            store.add(quote(i * 10))
+        ring = store.ring("SPY")
+        ticks = ring.window(TIMESTAMP + 75, TIMESTAMP + 110)
+    assert [tick['timestamp'] - TIMESTAMP for tick in ticks] == [80, 90, 100]
+
+
+def test_tick_ring_view_exposes_records_without_copying(tmp_path):
+    with TickStore(str(tmp_path), capacity=5) as store:
+        store.add(quote(0, bid_price=1.0))
+        store.add(quote(1, bid_price=2.0))
+        ring = store.ring("SPY")
+        view = ring.view(0, 2)
+        assert len(view) == 2 * ring.record.size
+        assert [record[3] for record in ring.record.iter_unpack(view)] == [1.0, 2.0]
+        view.release()
+
+
+def test_tick_ring_recovers_the_count_after_a_crash(tmp_path):
+    with TickStore(str(tmp_path), capacity=5) as store:
+        for i in range(3):
+            store.add(quote(i))
+        ring = store.ring("SPY")
+        ring.data[COUNT_OFFSET:COUNT_OFFSET + 8] = (7).to_bytes(8, 'little')
+    with TickStore(str(tmp_path), capacity=5) as store:
+        assert len(store.ring("SPY")) == 3
+        store.add(quote(3))
+        assert [tick['timestamp'] - TIMESTAMP for tick in store.ring("SPY").last(5)] == [0, 1, 2, 3]
+
+
+def test_tick_ring_rejects_a_different_capacity(tmp_path):
+    with TickStore(str(tmp_path), capacity=5) as store:
+        store.add(quote(0))
+    with pytest.raises(RepositoryException):
+        TickRing(ring_path(str(tmp_path), "SPY"), "SPY", ring_fields(Model.QUOTE), 6)
+
+
+def test_tick_store_rejects_entities_without_timestamp(tmp_path):
+    with TickStore(str(tmp_path)) as store:
+        with pytest.raises(RepositoryException):
+            store.add(Entity(Model.QUOTE, {"key": "SPY"}))
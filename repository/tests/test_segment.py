@@ -0,0 +1,130 @@
+import os
+import threading
+import pytest
+from model import Model, Entity
+from repository import SegmentRepository, SegmentFile, RepositoryException, read_segments
+from repository.segment import segment_path
+
+TIMESTAMP = 1590879805110
+
+
+def quote(symbol, offset, **fields):
+    return Entity(Model.QUOTE, {"key": symbol, "timestamp": TIMESTAMP + offset, **fields})
+
+
+def test_segment_repository_writes_one_file_per_day_and_symbol(tmp_path):
+    with SegmentRepository(str(tmp_path)) as repository:
+        repository.add(quote("MSFT", 0, bid_price=183.7))
+        repository.add(quote("EUR/USD", 0, bid_price=1.1))
+        repository.add(quote("MSFT", 24 * 60 * 60 * 1000, bid_price=184.0))
+    assert os.path.exists(segment_path(str(tmp_path), '2020-05-30', 'MSFT'))
+    assert os.path.exists(segment_path(str(tmp_path), '2020-05-31', 'MSFT'))
+    assert os.path.exists(segment_path(str(tmp_path), '2020-05-30', 'EUR/USD'))
+
+
+def test_segment_repository_reads_back_a_time_range(tmp_path):
+    with SegmentRepository(str(tmp_path), flush_size=2) as repository:
+        for i in range(5):
+            repository.add(quote("MSFT", i, bid_price=100.0 + i, total_volume=i,
+                                 ask_id="P" if i % 2 else None))
+    quotes = list(read_segments(str(tmp_path), "MSFT", TIMESTAMP + 1, TIMESTAMP + 4))
+    assert [q.fields_values for q in quotes] == [
+        {"key": "MSFT", "timestamp": TIMESTAMP + 1, "bid_price": 101.0, "total_volume": 1,
+         "ask_id": "P"},
+        {"key": "MSFT", "timestamp": TIMESTAMP + 2, "bid_price": 102.0, "total_volume": 2},
+        {"key": "MSFT", "timestamp": TIMESTAMP + 3, "bid_price": 103.0, "total_volume": 3,
+         "ask_id": "P"}]
+
+
+def test_segment_file_exposes_typed_columns_and_block_index(tmp_path):
+    with SegmentRepository(str(tmp_path), flush_size=3) as repository:
+        for i in range(4):
+            repository.add(quote("MSFT", i, bid_price=100.0 + i))
+    with SegmentFile(segment_path(str(tmp_path), '2020-05-30', 'MSFT')) as segment:
+        blocks = list(segment.blocks())
+        assert [(len(b), b.min_timestamp, b.max_timestamp) for b in blocks] == [
+            (3, TIMESTAMP, TIMESTAMP + 2), (1, TIMESTAMP + 3, TIMESTAMP + 3)]
+        assert [len(b) for b in segment.blocks(start=TIMESTAMP + 3)] == [1]
+        column, mask = blocks[0].column("bid_price")
+        assert column.tolist() == [100.0, 101.0, 102.0]
+        assert bytes(mask) == b'\x01\x01\x01'
+        del column, mask, blocks
+
+
+def test_segment_repository_discards_a_torn_last_block_when_reopened(tmp_path):
+    with SegmentRepository(str(tmp_path)) as repository:
+        repository.add(quote("MSFT", 0, bid_price=1.0))
+    path = segment_path(str(tmp_path), '2020-05-30', 'MSFT')
+    with open(path, 'ab') as segment:
+        segment.write(b'QBLK\x05\x00')
+    with SegmentRepository(str(tmp_path)) as repository:
+        repository.add(quote("MSFT", 1, bid_price=2.0))
+    quotes = read_segments(str(tmp_path), "MSFT", TIMESTAMP, TIMESTAMP + 10)
+    assert [q['bid_price'] for q in quotes] == [1.0, 2.0]
+
+
+def test_segment_repository_syncs_periodically(tmp_path, monkeypatch):
+    now = [0.0]
+    synced = []
+    monkeypatch.setattr(os, 'fsync', synced.append)
+    repository = SegmentRepository(str(tmp_path), flush_size=1, fsync_interval=1.0,
+                                   clock=lambda: now[0])
+    repository.add(quote("MSFT", 0))
+    assert synced == []
+    now[0] = 1.0
+    repository.add(quote("MSFT", 1))
+    assert len(synced) == 1
+    repository.close()
+
+
+def test_segment_repository_flushes_and_syncs_after_max_latency(tmp_path, monkeypatch):
+    synced = threading.Event()
+    monkeypatch.setattr(os, 'fsync', lambda fd: synced.set())
+    repository = SegmentRepository(str(tmp_path), flush_size=1000, fsync_interval=0.02,
+                                   max_latency=0.01)
+    repository.add(quote("MSFT", 0))
+    assert synced.wait(timeout=5)
+    assert repository.blocks == 1
+    repository.close()
+
+
+def test_segment_repository_rejects_entities_without_symbol_or_timestamp(tmp_path):
+    repository = SegmentRepository(str(tmp_path))
+    with pytest.raises(RepositoryException):
+        repository.add(Entity(Model.QUOTE, {"key": "MSFT"}))
+
+
+def test_segment_repository_rejects_a_quote_it_cannot_encode_and_keeps_the_others(tmp_path):
+    with SegmentRepository(str(tmp_path)) as repository:
+        repository.add(quote("MSFT", 0, bid_price=1.0, total_volume=10))
+        repository.add(quote("QQQ", 0, bid_price=2.0))
+        with pytest.raises(RepositoryException):
+            repository.add(quote("MSFT", 1, bid_price=3.0, total_volume=1 << 70))
+        repository.add(quote("MSFT", 2, bid_price=4.0))
+    quotes = read_segments(str(tmp_path), "MSFT", TIMESTAMP, TIMESTAMP + 10)
+    assert [(q['bid_price'], q.get('total_volume')) for q in quotes] == [(1.0, 10), (4.0, None)]
+    assert [q['bid_price'] for q in read_segments(str(tmp_path), "QQQ", TIMESTAMP,
+                                                   TIMESTAMP + 10)] == [2.0]
+
+
+def test_segment_repository_closes_the_least_recently_written_file(tmp_path, monkeypatch):
+    synced = []
+    checked = []
+    valid_length = SegmentFile.valid_length
+    monkeypatch.setattr(os, 'fsync', synced.append)
+    monkeypatch.setattr(SegmentFile, 'valid_length',
+                        lambda segment: checked.append(segment.path) or valid_length(segment))
+    repository = SegmentRepository(str(tmp_path), flush_size=1, fsync_interval=3600,
+                                   max_open_files=2)
+    repository.add(quote("MSFT", 0))
+    repository.add(quote("QQQ", 0))
+    repository.add(quote("MSFT", 1))
+    repository.add(quote("SPY", 0))
+    assert len(synced) == 1
+    assert list(repository._files) == [segment_path(str(tmp_path), '2020-05-30', symbol)
+                                       for symbol in ("MSFT", "SPY")]
+    repository.add(quote("QQQ", 1))
+    repository.close()
+    assert checked == []
+    quotes = read_segments(str(tmp_path), "QQQ", TIMESTAMP, TIMESTAMP + 10)
+    assert [q['timestamp'] for q in quotes] == [TIMESTAMP, TIMESTAMP + 1]
@@ -0,0 +1,176 @@
+import configparser
+import os
+import threading
+import configuration
+from model import Model, Entity
+from repository import SpoolingRepository, RepositoryException, SegmentRepository, \
+    WriterPoolRepository, create_repository
+from repository.spool import Spool
+
+
+class FlakyRepository:
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.rows = []
+        self.closed = False
+        self.attempts = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def add_many(self, entities):
+        self.release.wait()
+        self.attempts += 1
+        if self.failures:
+            self.failures -= 1
+            raise RepositoryException('database down')
+        self.rows.extend(entity['key'] for entity in entities)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def quote(i):
+    return Entity(Model.QUOTE, {"key": f"Q{i}", "bid_price": float(i)})
+
+
+def test_spooling_repository_writes_through_memory_when_the_database_keeps_up(tmp_path):
+    repository = FlakyRepository()
+    with SpoolingRepository(repository, str(tmp_path), memory_size=100, batch_size=10) as spool:
+        for i in range(50):
+            spool.add(quote(i))
+    assert repository.rows == [f"Q{i}" for i in range(50)]
+    assert spool.spooled == 0
+    assert repository.closed
+
+
+def test_spooling_repository_spills_when_the_database_falls_behind(tmp_path):
+    repository = FlakyRepository()
+    repository.release.clear()
+    spool = SpoolingRepository(repository, str(tmp_path), memory_size=5, batch_size=3)
+    for i in range(20):
+        spool.add(quote(i))
+    assert spool.spilling
+    assert spool.spooled >= 15
+    repository.release.set()
+    spool.close()
+    assert repository.rows == [f"Q{i}" for i in range(20)]
+
+
+def test_spooling_repository_retries_in_order_after_database_errors(tmp_path):
+    repository = FlakyRepository(failures=3)
+    with SpoolingRepository(repository, str(tmp_path), memory_size=100, batch_size=4,
+                            retry_interval=0.01) as spool:
+        for i in range(30):
+            spool.add(quote(i))
+    assert repository.rows == [f"Q{i}" for i in range(30)]
+    assert repository.attempts > 3
+
+
+def test_spooling_repository_keeps_the_spool_when_the_database_is_down_at_close(tmp_path):
+    down = FlakyRepository(failures=1000)
+    spool = SpoolingRepository(down, str(tmp_path), memory_size=100, batch_size=4,
+                               retry_interval=0.01, close_timeout=0.05)
+    for i in range(10):
+        spool.add(quote(i))
+    spool.close()
+    assert down.rows == []
+
+    repository = FlakyRepository()
+    with SpoolingRepository(repository, str(tmp_path), memory_size=100, batch_size=4) as spool:
+        spool.add(quote(10))
+    assert repository.rows == [f"Q{i}" for i in range(11)]
+
+
+class BufferingRepository:
+
+    def __init__(self):
+        self.pending = []
+
+    def add(self, entity):
+        self.pending.append(entity)
+
+    def flush(self):
+        raise RepositoryException('database down')
+
+    def close(self):
+        pass
+
+
+def test_spooling_repository_waits_for_the_writer_pool_before_checkpointing(tmp_path):
+    pool = WriterPoolRepository(BufferingRepository, workers=2)
+    spool = SpoolingRepository(pool, str(tmp_path), memory_size=100, batch_size=4,
+                               retry_interval=0.01, close_timeout=0.05)
+    for i in range(10):
+        spool.add(quote(i))
+    spool.close()
+
+    repository = FlakyRepository()
+    with SpoolingRepository(repository, str(tmp_path), memory_size=100, batch_size=4):
+        pass
+    assert repository.rows == [f"Q{i}" for i in range(10)]
+
+
+def test_spooling_repository_does_not_write_checkpointed_entities_again(tmp_path):
+    repository = FlakyRepository()
+    with SpoolingRepository(repository, str(tmp_path), memory_size=0, batch_size=4) as spool:
+        for i in range(10):
+            spool.add(quote(i))
+    assert spool.spooled == 10
+    assert repository.rows == [f"Q{i}" for i in range(10)]
+
+    again = FlakyRepository()
+    with SpoolingRepository(again, str(tmp_path), memory_size=0, batch_size=4):
+        pass
+    assert again.rows == []
+
+
+def test_spool_rotates_segments_and_deletes_them_once_consumed(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=100)
+    for i in range(10):
+        spool.append(quote(i))
+    spool.flush()
+    assert len(spool.segments()) > 1
+    assert [entity['key'] for entity in spool.read(10)] == [f"Q{i}" for i in range(10)]
+    spool.commit()
+    assert len(spool.segments()) == 1
+    assert spool.drained()
+    spool.close()
+
+
+def test_spool_ignores_a_torn_line_at_the_end_of_an_old_segment(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(quote(0))
+    spool.close()
+    segment = os.path.join(str(tmp_path), os.listdir(str(tmp_path))[0])
+    with open(segment, 'ab') as torn:
+        torn.write(b'{"key": "Q1"')
+    spool = Spool(str(tmp_path))
+    spool.append(quote(2))
+    spool.flush()
+    assert [entity['key'] for entity in spool.read(10)] == ["Q0", "Q2"]
+    spool.close()
+
+
+def test_spool_reads_up_to_the_end_of_the_last_segment_after_a_restart(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(quote(1))
+    spool.close()
+    spool = Spool(str(tmp_path))
+    assert [entity.get('key') for entity in spool.read(10)] == ['Q1']
+    assert spool.read(10) == []
+    assert spool.drained()
+    spool.close()
+
+
+def test_create_repository_does_not_spool_without_a_spool_section(tmp_path, monkeypatch):
+    config = configparser.ConfigParser()
+    config['DATABASE'] = {'repository': 'segments'}
+    config['SEGMENTS'] = {'directory': str(tmp_path)}
+    monkeypatch.setattr(configuration, 'configuration', config)
+    repository = create_repository()
+    assert isinstance(repository, SegmentRepository)
+    repository.close()
@@ -0,0 +1,135 @@
+import configparser
+import threading
+import time
+import pytest
+from unittest.mock import Mock
+import configuration
+from model import Model, Entity
+from repository import WriterPoolRepository, RepositoryException, create_db_repository
+
+
+class RecordingRepository:
+
+    def __init__(self):
+        self.entities = []
+        self.threads = set()
+        self.closed = False
+        self.flushed = 0
+
+    def add(self, entity):
+        self.threads.add(threading.current_thread().name)
+        self.entities.append(entity)
+
+    def flush(self):
+        self.flushed = len(self.entities)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture()
+def repositories():
+    return []
+
+
+@pytest.fixture()
+def factory(repositories):
+    def create():
+        repository = RecordingRepository()
+        repositories.append(repository)
+        return repository
+    return create
+
+
+def quote(symbol, price):
+    return Entity(Model.QUOTE, {"key": symbol, "bid_price": price})
+
+
+def test_writer_pool_creates_one_repository_per_worker(factory, repositories):
+    with WriterPoolRepository(factory, workers=3):
+        pass
+    assert len(repositories) == 3
+    assert all(repository.closed for repository in repositories)
+
+
+def test_writer_pool_keeps_order_per_symbol_in_a_single_worker(factory, repositories):
+    symbols = [f'SYM{i}' for i in range(20)]
+    with WriterPoolRepository(factory, workers=4) as pool:
+        pool.add_many([quote(symbol, price) for price in range(50) for symbol in symbols])
+
+    for symbol in symbols:
+        owners = [repository for repository in repositories
+                  if any(entity['key'] == symbol for entity in repository.entities)]
+        assert len(owners) == 1
+        prices = [entity['bid_price'] for entity in owners[0].entities
+                  if entity['key'] == symbol]
+        assert prices == list(range(50))
+    assert sum(len(repository.entities) for repository in repositories) == 1000
+    assert all(len(repository.threads) == 1 for repository in repositories)
+
+
+def test_writer_pool_partitions_by_symbol_field_when_key_not_present(factory, repositories):
+    pool = WriterPoolRepository(factory, workers=2)
+    entities = [Entity(Model.QUOTE, {"symbol": "QQQ", "bid_price": i}) for i in range(10)]
+    pool.add_many(entities)
+    pool.close()
+    assert sorted(len(repository.entities) for repository in repositories) == [0, 10]
+
+
+def test_writer_pool_raises_a_repository_error_on_the_next_add():
+    repository = Mock()
+    repository.add.side_effect = [RepositoryException('database down'), None]
+    pool = WriterPoolRepository(lambda: repository, workers=1)
+    pool.add(quote("QQQ", 1))
+    while not pool.stats['writer-0']['errors']:
+        time.sleep(0.001)
+    with pytest.raises(RepositoryException):
+        pool.add(quote("QQQ", 2))
+    pool.add(quote("QQQ", 2))
+    pool.close()
+    assert pool.stats['writer-0'] == {'queued': 0, 'added': 1, 'errors': 1}
+    repository.close.assert_called_once()
+
+
+def test_writer_pool_raises_a_repository_error_on_close():
+    repository = Mock()
+    repository.close.side_effect = RepositoryException('database down')
+    pool = WriterPoolRepository(lambda: repository, workers=2)
+    pool.add(quote("QQQ", 1))
+    with pytest.raises(RepositoryException):
+        pool.close()
+
+
+def test_writer_pool_flush_waits_for_every_worker(factory, repositories):
+    pool = WriterPoolRepository(factory, workers=3)
+    pool.add_many([quote(f'SYM{i}', i) for i in range(30)])
+    pool.flush()
+    assert sum(repository.flushed for repository in repositories) == 30
+    pool.close()
+
+
+def test_writer_pool_flush_raises_the_errors_of_its_workers():
+    repository = Mock()
+    repository.flush.side_effect = [RepositoryException('database down'), None]
+    pool = WriterPoolRepository(lambda: repository, workers=1)
+    pool.add(quote("QQQ", 1))
+    with pytest.raises(RepositoryException):
+        pool.flush()
+    pool.flush()
+    pool.close()
+
+
+def test_writer_pool_delegates_queries_to_a_worker_repository():
+    repository = Mock()
+    pool = WriterPoolRepository(lambda: repository, workers=2)
+    pool.query('MSFT', 'start', 'end', ['symbol'], columnar=True)
+    repository.query.assert_called_once_with('MSFT', 'start', 'end', ['symbol'], columnar=True)
+    pool.close()
+
+
+def test_create_db_repository_needs_a_connection_for_queries(monkeypatch):
+    config = configparser.ConfigParser()
+    config['DATABASE'] = {'writer_workers': '4', 'pool_size': '4'}
+    monkeypatch.setattr(configuration, 'configuration', config)
+    with pytest.raises(RepositoryException):
+        create_db_repository(Mock())
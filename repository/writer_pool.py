@@ -0,0 +1,120 @@
+import logging
+import queue
+import threading
+import metrics
+from .repository import AbstractRepository, RepositoryException
+
+_STOP = object()
+QUEUE_DEPTH = metrics.registry.gauge('quote_streamer_writer_queue_depth',
+                                     'Entities waiting in the writer pool queues')
+
+
+class WriterPoolRepository(AbstractRepository):
+
+    def __init__(self, repository_factory, workers=4, queue_size=10000):
+        self._workers = [_Writer(repository_factory(), queue_size, f'writer-{i}')
+                         for i in range(workers)]
+        QUEUE_DEPTH.set_function(lambda: sum(worker.queue.qsize() for worker in self._workers))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+    def _partition(self, entity):
+        symbol = entity.symbol()
+        return 0 if symbol is None else hash(symbol) % len(self._workers)
+
+    def add(self, entity):
+        self._raise_error()
+        self._workers[self._partition(entity)].put(entity)
+
+    def add_many(self, entities):
+        for entity in entities:
+            self.add(entity)
+
+    def flush(self):
+        for done in [worker.flush() for worker in self._workers]:
+            done.wait()
+        self._raise_error()
+
+    def _raise_error(self):
+        for worker in self._workers:
+            error = worker.take_error()
+            if error is not None:
+                raise error
+
+    def query(self, symbol, start, end, fields=None, **kwargs):
+        return self._workers[0].repository.query(symbol, start, end, fields, **kwargs)
+
+    @property
+    def stats(self):
+        return {worker.name: {'queued': worker.queue.qsize(), 'added': worker.added,
+                              'errors': worker.errors}
+                for worker in self._workers}
+
+    def close(self):
+        for worker in self._workers:
+            worker.stop()
+        for worker in self._workers:
+            worker.join()
+        self._raise_error()
+
+
+class _Writer:
+
+    def __init__(self, repository, queue_size, name):
+        self.repository = repository
+        self.name = name
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.added = 0
+        self.errors = 0
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, entity):
+        self.queue.put(entity)
+
+    def flush(self):
+        done = threading.Event()
+        self.queue.put(done)
+        return done
+
+    def take_error(self):
+        error, self._error = self._error, None
+        return error
+
+    def stop(self):
+        self.queue.put(_STOP)
+
+    def join(self):
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            if isinstance(item, threading.Event):
+                try:
+                    self.repository.flush()
+                except RepositoryException as e:
+                    self._fail(e, "Writer %s failed to flush entities")
+                item.set()
+                continue
+            try:
+                self.repository.add(item)
+                self.added += 1
+            except RepositoryException as e:
+                self._fail(e, "Writer %s failed to add entity")
+        try:
+            self.repository.close()
+        except RepositoryException as e:
+            self._fail(e, "Writer %s failed to flush pending entities")
+
+    def _fail(self, error, message):
+        self._error = error
+        self.errors += 1
+        logging.exception(message, self.name)